@@ -0,0 +1,358 @@
+""" قياس أداء handle_message دون Telegram أو Gemini حقيقيين.
+
+كل تجربة (حجم قاعدة الأسئلة × درجة التوازي) تعمل في عملية مستقلة بقاعدة بيانات مؤقتة،
+مع نموذج Gemini وهمي بزمن استجابة ونسبة فشل قابلة للضبط، وبوت وهمي يسجل الرسائل المرسلة والمحذوفة.
+
+    python benchmark.py --faq-rows 10 1000 100000 --concurrency 1 16 64 --messages 400 --latency 0.05
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import sqlite3
+import asyncio
+import argparse
+import resource
+import tempfile
+import tracemalloc
+import subprocess
+from types import SimpleNamespace
+
+
+ADMIN_ID = 1
+GROUP_ID = -1001
+CHANNEL_ID = -1002
+
+# (نوع الدردشة، النية المتوقعة، نص الرسالة) — {n} يجعل كل رسالة فريدة حتى لا تُخدم من ذاكرة الردود
+SCENARIOS = [
+    ("group", "1", "كيف أسجل في الدورة رقم {n} وما هي المواعيد؟"),
+    ("group", "2", "Please review my paragraph {n}: yesterday I visit my grandmother and we eats dinner together."),
+    ("group", "3", "She don't like apples and he go to school every days {n}"),
+    ("group", "4", "join my channel https://t.me/spam{n} for free courses"),
+    ("group", "5", "hello"),
+    ("group", "6", "What does resilient{n} mean?"),
+    ("private", None, "متى يبدأ الكورس رقم {n}؟"),
+    ("admin", None, "ما هي أفضل طريقة لمراجعة الدروس {n}؟"),
+]
+# كلمات يتعرف بها النموذج الوهمي على النية المقصودة
+INTENT_MARKERS = (("review my paragraph", "2"), ("don't like apples", "3"), ("t.me/spam", "4"),
+                  ("resilient", "6"))
+
+_LETTERS = "abcdefghijklmnopqrstuvwxyz" + "ابتثجحخدذرزسشصضطظعغفقكلمنهوي"
+
+
+# --- أدوات وهمية ---
+
+class StubResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class StubModel:
+    """ بديل GenerativeModel: يرد حسب نوع الطلب بعد زمن استجابة محدد، ويفشل بنسبة محددة. """
+
+    def __init__(self, latency, failure_rate, seed=0):
+        import prompts
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._intent_prefix = prompts.TEMPLATES["intent"].footer[:30]
+        self._vocabulary_prefix = prompts.TEMPLATES["vocabulary"].footer[:30]
+        self.prompt_sizes = []
+        self.calls = 0
+        self.failures = 0
+
+    @staticmethod
+    def _intent(prompt):
+        for marker, intent in INTENT_MARKERS:
+            if marker in prompt:
+                return intent
+        return "1"
+
+    def generate_content(self, prompt, generation_config=None, stream=False, **kwargs):
+        self.calls += 1
+        self.prompt_sizes.append(len(prompt))
+        latency = self.latency * self._random.uniform(0.5, 1.5) if self.latency else 0
+        if stream:
+            return self._stream(prompt, latency)
+        time.sleep(latency)
+        self._maybe_fail()
+        return StubResponse(self._reply(prompt, generation_config))
+
+    def _maybe_fail(self):
+        if self._random.random() < self.failure_rate:
+            self.failures += 1
+            raise RuntimeError("stub failure")
+
+    def _reply(self, prompt, generation_config=None):
+        intent = self._intent(prompt)
+        if generation_config:
+            reply = {"intent": intent, "answer": "stub answer"}
+            if intent == "6":
+                reply["vocabulary"] = {f: f"stub {f}" for f in ("word", "meaning", "arabic", "example", "closing")}
+            return json.dumps(reply)
+        if prompt.startswith(self._intent_prefix):
+            return intent
+        if prompt.startswith(self._vocabulary_prefix):
+            return "resilient\nable to recover\nمرن\nShe is resilient.\nKeep going!"
+        return "stub answer"
+
+    def _stream(self, prompt, latency, parts=4):
+        # نفس الرد مقسمًا على أجزاء، وزمن الاستجابة موزع بينها
+        self._maybe_fail()
+        text = self._reply(prompt)
+        size = max(1, -(-len(text) // parts))
+        for start in range(0, len(text), size):
+            time.sleep(latency / parts)
+            yield StubResponse(text[start:start + size])
+
+
+class FakeSent:
+    def __init__(self, bot, chat_id, message_id):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+
+    async def edit_text(self, text, **kwargs):
+        self.bot._record("edit_text")
+        return self
+
+
+class FakeBot:
+    """ يسجل كل ما كان سيُرسل إلى Telegram. """
+
+    def __init__(self):
+        self.calls = {}
+        self._next_id = 10 ** 6
+
+    def _record(self, name, chat_id=None):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        self._next_id += 1
+        return FakeSent(self, chat_id, self._next_id)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        return self._record("send_message", chat_id)
+
+    async def delete_message(self, chat_id, message_id, **kwargs):
+        self._record("delete")
+        return True
+
+    async def delete_messages(self, chat_id, message_ids, **kwargs):
+        self._record("delete_messages")
+        return True
+
+    async def restrict_chat_member(self, **kwargs):
+        self._record("restrict")
+        return True
+
+
+def make_update(bot, kind, text, n):
+    """ كائن بنفس الحقول التي يقرؤها handle_message من Update. """
+    user_id = ADMIN_ID if kind == "admin" else 10_000 + n
+    chat_id = GROUP_ID if kind == "group" else user_id
+    user = SimpleNamespace(id=user_id, first_name="Bench", last_name=None, username=None)
+    chat = SimpleNamespace(id=chat_id, type="supergroup" if kind == "group" else "private")
+    message = SimpleNamespace(text=text, chat_id=chat_id, message_id=n, from_user=user, chat=chat)
+
+    async def reply_text(reply, **kwargs):
+        return bot._record("reply_text", chat_id)
+
+    async def delete():
+        bot._record("delete")
+        return True
+
+    message.reply_text = reply_text
+    message.delete = delete
+    return SimpleNamespace(message=message, effective_message=message, effective_chat=chat,
+                           effective_user=user, update_id=n)
+
+
+# --- العملية الفرعية: تجربة واحدة ---
+
+def seed_database(path, rows, seed=0):
+    """ قاعدة أسئلة اصطناعية بالحجم المطلوب. """
+    rng = random.Random(seed)
+
+    def sentence(words):
+        return " ".join("".join(rng.choice(_LETTERS) for _ in range(rng.randint(3, 8))) for _ in range(words))
+
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE IF NOT EXISTS faq (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    question TEXT,
+                    answer TEXT,
+                    category TEXT
+                )""")
+    conn.executemany("INSERT INTO faq (question, answer, category) VALUES (?, ?, ?)",
+                     ((sentence(rng.randint(4, 10)), sentence(rng.randint(10, 30)), "bench") for _ in range(rows)))
+    conn.commit()
+    conn.close()
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+async def drive(main, bot, messages, concurrency, warmup):
+    context = SimpleNamespace(bot=bot, user_data={}, args=[])
+    updates = []
+    for n in range(warmup + messages):
+        kind, _, template = SCENARIOS[n % len(SCENARIOS)]
+        updates.append(make_update(bot, kind, template.format(n=n), n))
+    for update in updates[:warmup]:
+        await main.handle_message(update, context)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(update):
+        async with semaphore:
+            started = time.perf_counter()
+            await main.handle_message(update, context)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(update) for update in updates[warmup:]))
+    return latencies, time.perf_counter() - started
+
+
+def run_worker(args):
+    workdir = tempfile.mkdtemp(prefix="faqbot-bench-")
+    db_path = os.path.join(workdir, "faq.db")
+    seed_database(db_path, args.faq_rows)
+    os.environ.update({
+        "FAQBOT_TOKEN": "123456:BENCHMARK",
+        "GEMINI_API_KEY": "benchmark",
+        "ALLOWED_GROUP_ID": str(GROUP_ID),
+        "ADMIN_USER_ID": str(ADMIN_ID),
+        "CHANNEL_ID": str(CHANNEL_ID),
+        "FAQ_DB_PATH": db_path,
+        "LOG_LEVEL": args.log_level,
+        # حدود الإرسال لا تخص الأداء المقاس هنا، وتجعل إفراغ طابور الإرسال يستغرق دقائق
+        "OUTBOUND_GLOBAL_LIMIT": "0/1",
+        "OUTBOUND_PRIVATE_LIMIT": "0/1",
+        "OUTBOUND_GROUP_LIMIT": "0/1",
+        # الموجة كاملة تُرسل دفعة واحدة؛ نقيس زمن المعالجة لا سياسة إسقاط الطلبات
+        "LLM_QUEUE_DEPTH": "1000000",
+        "LLM_QUEUE_MAX_WAIT": "3600",
+        # فاصل تعديلات الرد المتدفق حد لـ Telegram لا كلفة معالجة؛ بدونه يقيس p95 انتظار الفاصل فقط
+        "STREAM_EDIT_INTERVAL": "0",
+        "STREAM_GROUP_EDIT_INTERVAL": "0",
+    })
+    os.chdir(workdir)
+    if args.trace_memory:
+        tracemalloc.start()
+
+    started = time.perf_counter()
+    import main
+    main.initialize_state()
+    startup = time.perf_counter() - started
+
+    stub = StubModel(args.latency, args.failure_rate)
+    main.llm_client.model = stub
+    main.is_within_working_hours = lambda: True  # النتائج لا تعتمد على ساعة التشغيل
+    main.NOTICE_DELETE_DELAY = 0
+    bot = FakeBot()
+
+    async def run():
+        result = await drive(main, bot, args.messages, args.concurrency, args.warmup)
+        await main.on_shutdown(None)
+        return result
+
+    latencies, wall = asyncio.run(run())
+    shutil.rmtree(workdir, ignore_errors=True)
+    peak = tracemalloc.get_traced_memory()[1] if args.trace_memory else None
+    from metrics import STAGE_SECONDS
+    stages = {key[0]: total / count * 1000 for key, (_, total, count) in STAGE_SECONDS._values.items() if count}
+    sizes = stub.prompt_sizes or [0]
+    print(json.dumps({
+        "faq_rows": args.faq_rows,
+        "concurrency": args.concurrency,
+        "messages": len(latencies),
+        "startup_s": startup,
+        "throughput": len(latencies) / wall if wall else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": max(latencies) * 1000 if latencies else 0.0,
+        "peak_traced_mb": peak / 2 ** 20 if peak is not None else None,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "prompt_avg_chars": sum(sizes) / len(sizes),
+        "prompt_max_chars": max(sizes),
+        "llm_calls": stub.calls,
+        "llm_failures": stub.failures,
+        "bot_calls": bot.calls,
+        "stage_avg_ms": stages,
+    }))
+
+
+# --- العملية الرئيسية: تشغيل كل التجارب وعرض النتائج ---
+
+COLUMNS = [  # (المفتاح، العنوان، العرض، الصيغة)
+    ("faq_rows", "FAQ", 7, "d"), ("concurrency", "conc", 5, "d"), ("throughput", "msg/s", 8, ".1f"),
+    ("p50_ms", "p50ms", 8, ".1f"), ("p95_ms", "p95ms", 8, ".1f"), ("p99_ms", "p99ms", 8, ".1f"),
+    ("max_rss_mb", "rssMB", 7, ".1f"), ("prompt_avg_chars", "prompt", 7, ".0f"),
+    ("llm_calls", "llm", 5, "d"), ("startup_s", "start_s", 8, ".2f"),
+]
+
+
+def run_all(args):
+    results = []
+    for rows in args.faq_rows:
+        for concurrency in args.concurrency:
+            command = [sys.executable, os.path.abspath(__file__), "--worker",
+                       "--faq-rows", str(rows), "--concurrency", str(concurrency),
+                       "--messages", str(args.messages), "--warmup", str(args.warmup),
+                       "--latency", str(args.latency), "--failure-rate", str(args.failure_rate),
+                       "--log-level", args.log_level]
+            if args.trace_memory:
+                command.append("--trace-memory")
+            output = subprocess.run(command, capture_output=True, text=True,
+                                    cwd=os.path.dirname(os.path.abspath(__file__)))
+            if output.returncode != 0:
+                print(f"❌ فشلت التجربة (FAQ={rows}, conc={concurrency}):\n{output.stderr[-2000:]}", file=sys.stderr)
+                continue
+            results.append(json.loads(output.stdout.strip().splitlines()[-1]))
+            if not args.json:
+                if len(results) == 1:
+                    print(" ".join(f"{title:>{width}}" for _, title, width, _ in COLUMNS))
+                print(" ".join(f"{results[-1][key]:>{width}{spec}}" for key, _, width, spec in COLUMNS), flush=True)
+                if args.stages:
+                    print("    " + ", ".join(f"{stage}={ms:.1f}ms" for stage, ms in
+                                            sorted(results[-1]["stage_avg_ms"].items(), key=lambda item: -item[1])))
+    if args.json:
+        print(json.dumps(results, indent=2))
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load test for handle_message.")
+    parser.add_argument("--faq-rows", type=int, nargs="+", default=[10, 1000, 100000])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--messages", type=int, default=400)
+    parser.add_argument("--warmup", type=int, default=len(SCENARIOS))
+    parser.add_argument("--latency", type=float, default=0.05, help="stub Gemini latency in seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of stub Gemini calls that raise")
+    parser.add_argument("--trace-memory", action="store_true", help="report tracemalloc peak (slower)")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--stages", action="store_true", help="print the average time of each stage")
+    parser.add_argument("--json", action="store_true", help="print raw results as JSON")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.worker:
+        args.faq_rows = args.faq_rows[0]
+        args.concurrency = args.concurrency[0]
+    return args
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    if arguments.worker:
+        run_worker(arguments)
+    else:
+        run_all(arguments)
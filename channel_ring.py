@@ -0,0 +1,94 @@
+import os
+import logging
+import threading
+from collections import deque
+
+
+# عدد رسائل القناة المحفوظة (حجم الحلقة)
+CHANNEL_RING_SIZE = int(os.getenv("CHANNEL_RING_SIZE", 5))
+
+# جدول بعدد ثابت من الخانات: الرسالة رقم seq تُكتب في الخانة seq % N فوق أقدم رسالة
+CHANNEL_RING_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS channel_ring (
+            slot INTEGER PRIMARY KEY,
+            seq INTEGER NOT NULL,
+            message_id INTEGER,
+            chat_id INTEGER,
+            text TEXT
+        )""",
+]
+
+_UPSERT = """
+    INSERT INTO channel_ring (slot, seq, message_id, chat_id, text) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(slot) DO UPDATE SET
+        seq = excluded.seq,
+        message_id = excluded.message_id,
+        chat_id = excluded.chat_id,
+        text = excluded.text
+"""
+
+
+def ensure_channel_ring_schema(cur):
+    for statement in CHANNEL_RING_SCHEMA:
+        cur.execute(statement)
+
+
+def migrate_channel_messages(cur, size=CHANNEL_RING_SIZE):
+    """ نقل آخر رسائل الجدول القديم channel_messages إلى الحلقة ثم حذفه (مرة واحدة). """
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'channel_messages'")
+    if cur.fetchone() is None:
+        return
+    cur.execute("SELECT message_id, chat_id, text FROM channel_messages ORDER BY id DESC LIMIT ?", (size,))
+    rows = list(reversed(cur.fetchall()))
+    # الحذف قبل الإدراج حتى تُزيل مشغلات الجدول القديم مداخله من الفهرس النصي
+    cur.execute("DELETE FROM channel_messages")
+    cur.execute("SELECT COALESCE(MAX(seq), -1) + 1 FROM channel_ring")
+    start = cur.fetchone()[0]
+    for seq, (message_id, chat_id, text) in enumerate(rows, start):
+        cur.execute(_UPSERT, (seq % size, seq, message_id, chat_id, text))
+    cur.execute("DROP TABLE channel_messages")
+    logging.info(f"✅ تم نقل {len(rows)} رسالة قناة إلى الجدول الدائري.")
+
+
+class ChannelRing:
+    """ آخر N رسائل من القناة: جدول دائري في SQLite ونسخة deque في الذاكرة؛ الإضافة والقراءة O(1). """
+
+    def __init__(self, storage, size=CHANNEL_RING_SIZE):
+        self.storage = storage
+        self.size = size
+        self._messages = deque(maxlen=size)  # من الأقدم إلى الأحدث
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def hydrate(self):
+        """ تحميل الحلقة من قاعدة البيانات عند التشغيل، مع إعادة ترتيب الخانات إذا تغير حجمها. """
+        with self.storage.transaction() as conn:
+            rows = conn.execute("SELECT slot, seq, message_id, chat_id, text FROM channel_ring "
+                                "ORDER BY seq DESC").fetchall()
+            keep = rows[:self.size]
+            if len(rows) > self.size or any(slot != seq % self.size for slot, seq, *_ in keep):
+                conn.execute("DELETE FROM channel_ring")
+                for _, seq, message_id, chat_id, text in reversed(keep):
+                    conn.execute(_UPSERT, (seq % self.size, seq, message_id, chat_id, text))
+                logging.info(f"✅ تم إعادة ترتيب الجدول الدائري على {self.size} خانات.")
+        with self._lock:
+            self._messages.clear()
+            self._messages.extend(text for *_, text in reversed(keep))
+            self._seq = keep[0][1] + 1 if keep else 0
+        logging.info(f"✅ تم تحميل {len(keep)} رسالة قناة في الذاكرة.")
+
+    def append(self, message_id, chat_id, text):
+        """ إضافة رسالة فوق أقدم خانة؛ تُرجع Future لعملية الكتابة. """
+        with self._lock:
+            seq = self._seq
+            self._seq += 1
+            self._messages.append(text)
+        return self.storage.submit_write(self._store, seq, message_id, chat_id, text)
+
+    def _store(self, conn, seq, message_id, chat_id, text):
+        conn.execute(_UPSERT, (seq % self.size, seq, message_id, chat_id, text))
+
+    def recent(self):
+        """ رسائل القناة من الأحدث إلى الأقدم، من الذاكرة دون أي استعلام. """
+        with self._lock:
+            return list(reversed(self._messages))
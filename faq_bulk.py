@@ -0,0 +1,184 @@
+""" استيراد وتصدير جدول الأسئلة دفعة واحدة (CSV أو JSONL).
+
+الاستيراد في معاملة واحدة بـ executemany، مع إزالة التكرار حسب السؤال الموحد: السؤال الموجود
+يُحدّث جوابه وفئته، والجديد يُضاف. التصدير يقرأ الجدول على دفعات دون تحميله كاملًا في الذاكرة.
+
+سطر الأوامر:
+    python faq_bulk.py import faq.csv [--db faq.db] [--skip-existing]
+    python faq_bulk.py export faq.jsonl [--db faq.db]
+"""
+import io
+import os
+import csv
+import json
+import logging
+import argparse
+
+from response_cache import normalize_message
+from similarity_index import _LETTER_FOLDING
+
+
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", 1000))  # عدد الصفوف المقروءة في كل دفعة عند التصدير
+FORMATS = ("csv", "jsonl")
+FIELDS = ("question", "answer", "category")
+
+FAQ_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS faq (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            question TEXT,
+            answer TEXT,
+            category TEXT
+        )""",
+]
+
+
+def ensure_faq_schema(cur):
+    for statement in FAQ_SCHEMA:
+        cur.execute(statement)
+
+
+def question_key(question):
+    """ مفتاح إزالة التكرار: السؤال بعد التوحيد (أحرف صغيرة، بدون تشكيل وترقيم، همزات موحدة). """
+    return normalize_message(question).translate(_LETTER_FOLDING)
+
+
+def detect_format(filename):
+    extension = os.path.splitext(filename or "")[1].lower().lstrip(".")
+    if extension in ("json", "ndjson"):
+        return "jsonl"
+    return extension if extension in FORMATS else None
+
+
+def parse_rows(data, fmt):
+    """ (سؤال، جواب، فئة) لكل صف صالح في الملف المرفوع؛ الصفوف بلا سؤال أو جواب تُتخطى. """
+    text = data.decode("utf-8-sig") if isinstance(data, (bytes, bytearray)) else data
+    if fmt == "jsonl":
+        records = (json.loads(line) for line in text.splitlines() if line.strip())
+    elif fmt == "csv":
+        reader = csv.reader(io.StringIO(text))
+        header = next(reader, None)
+        if header and {h.strip().lower() for h in header} >= {"question", "answer"}:
+            names = [h.strip().lower() for h in header]
+            records = (dict(zip(names, row)) for row in reader)
+        else:
+            # ملف بلا عناوين: الأعمدة بالترتيب سؤال، جواب، فئة
+            rows = [header] if header else []
+            records = (dict(zip(FIELDS, row)) for source in (rows, reader) for row in source)
+    else:
+        raise ValueError(f"unsupported format: {fmt}")
+    for record in records:
+        question = (record.get("question") or "").strip()
+        answer = (record.get("answer") or "").strip()
+        if question and answer:
+            yield question, answer, (record.get("category") or "").strip() or None
+
+
+def import_rows(conn, rows, update_existing=True):
+    """ الاستيراد داخل معاملة الكاتب: ينفذ عبر storage.write (أو write_sync من سطر الأوامر).
+
+    يعيد (الأسئلة المضافة [(id، سؤال، جواب)]، الأسئلة المحدثة [(id، سؤال، جواب)]، عدد المتخطاة).
+    """
+    existing = {}
+    for faq_id, question in conn.execute("SELECT id, question FROM faq"):
+        existing.setdefault(question_key(question), faq_id)
+    inserts, updates, seen = [], [], {}
+    skipped = 0
+    for question, answer, category in rows:
+        key = question_key(question)
+        if key in seen:
+            # نفس السؤال مكرر داخل الملف: آخر نسخة هي المعتمدة
+            target = seen[key]
+            target[:] = [target[0], question, answer, category]
+            skipped += 1
+            continue
+        if key in existing:
+            if not update_existing:
+                skipped += 1
+                continue
+            entry = [existing[key], question, answer, category]
+            updates.append(entry)
+        else:
+            entry = [None, question, answer, category]
+            inserts.append(entry)
+        seen[key] = entry
+
+    last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM faq").fetchone()[0]
+    conn.executemany("INSERT INTO faq (question, answer, category) VALUES (?, ?, ?)",
+                     [(q, a, c) for _, q, a, c in inserts])
+    conn.executemany("UPDATE faq SET answer = ?, category = ? WHERE id = ?",
+                     [(a, c, faq_id) for faq_id, _, a, c in updates])
+    # الكاتب واحد والمعرفات تصاعدية، فالأسئلة المضافة هي ما بعد أكبر معرف سابق
+    inserted = conn.execute("SELECT id, question, answer FROM faq WHERE id > ? ORDER BY id", (last_id,)).fetchall()
+    updated = [(faq_id, q, a) for faq_id, q, a, _ in updates]
+    return inserted, updated, skipped
+
+
+def iter_faq_chunks(conn, chunk_size=EXPORT_CHUNK_SIZE):
+    """ صفوف الجدول على دفعات بترتيب المعرف (ترقيم بالمفتاح بدل OFFSET حتى يبقى كل استعلام سريعًا). """
+    last_id = 0
+    while True:
+        chunk = conn.execute("SELECT id, question, answer, category FROM faq WHERE id > ? ORDER BY id LIMIT ?",
+                             (last_id, chunk_size)).fetchall()
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1][0]
+
+
+def export_to_file(conn, path, fmt):
+    """ كتابة الجدول في ملف دفعة بعد دفعة؛ يعيد عدد الصفوف. """
+    count = 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f) if fmt == "csv" else None
+        if writer:
+            writer.writerow(("id",) + FIELDS)
+        for chunk in iter_faq_chunks(conn):
+            if writer:
+                writer.writerows(chunk)
+            else:
+                f.writelines(json.dumps(dict(zip(("id",) + FIELDS, row)), ensure_ascii=False) + "\n" for row in chunk)
+            count += len(chunk)
+    return count
+
+
+def main(argv=None):
+    from storage import Storage
+    from retrieval import ensure_fts_schema
+    from faq_cache import ensure_generation_schema
+    from channel_ring import ensure_channel_ring_schema
+
+    parser = argparse.ArgumentParser(description="Bulk import/export of the FAQ table.")
+    parser.add_argument("action", choices=("import", "export"))
+    parser.add_argument("path", help="CSV or JSONL file")
+    parser.add_argument("--db", default=os.getenv("FAQ_DB_PATH", "faq.db"))
+    parser.add_argument("--format", choices=FORMATS, help="default: from the file extension")
+    parser.add_argument("--skip-existing", action="store_true", help="keep answers of questions already in the table")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    fmt = args.format or detect_format(args.path)
+    if fmt is None:
+        parser.error("unknown file format; use --format")
+    storage = Storage(args.db, read_workers=1)
+    try:
+        with storage.transaction() as conn:
+            cur = conn.cursor()
+            # نفس الجداول والمشغلات التي ينشئها البوت، حتى تتحدث الفهارس وعداد الأجيال مع الاستيراد
+            ensure_faq_schema(cur)
+            ensure_channel_ring_schema(cur)
+            ensure_generation_schema(cur)
+            ensure_fts_schema(cur)
+        if args.action == "import":
+            with open(args.path, "rb") as f:
+                rows = list(parse_rows(f.read(), fmt))
+            inserted, updated, skipped = storage.write_sync(import_rows, rows, not args.skip_existing)
+            logging.info(f"✅ تم الاستيراد: {len(inserted)} جديد، {len(updated)} محدث، {skipped} متخطى.")
+        else:
+            count = storage.submit(export_to_file, args.path, fmt).result()
+            logging.info(f"✅ تم تصدير {count} سؤالًا إلى {args.path}.")
+    finally:
+        storage.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from retrieval import CHANNEL_ANSWER
+
+
+# كل كم ثانية نتحقق من عداد الأجيال في قاعدة البيانات (لالتقاط كتابات العمليات الأخرى)
+SNAPSHOT_CHECK_INTERVAL = float(os.getenv("SNAPSHOT_CHECK_INTERVAL", 5))
+SEARCH_MEMO_SIZE = int(os.getenv("SEARCH_MEMO_SIZE", 512))
+
+# عدادا أجيال يزيدان مع كل تعديل، حتى من عمليات أخرى: faq_generation للأسئلة (جزء من مفتاح ذاكرة الردود
+# وفهرس التشابه)، وchannel_generation لرسائل القناة (إعادة تحميل النسخة فقط)، حتى لا يُسقط كل منشور
+# في القناة كل الردود المخزنة
+_TRIGGER_EVENTS = (("ai", "INSERT"), ("ad", "DELETE"), ("au", "UPDATE"))
+GENERATION_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )""",
+    "INSERT OR IGNORE INTO meta (key, value) VALUES ('faq_generation', 0)",
+    "INSERT OR IGNORE INTO meta (key, value) VALUES ('channel_generation', 0)",
+] + [
+    # المشغلات القديمة كانت تزيد faq_generation مع رسائل القناة أيضًا
+    f"DROP TRIGGER IF EXISTS channel_ring_gen_{suffix}" for suffix, _ in _TRIGGER_EVENTS
+] + [
+    f"""CREATE TRIGGER IF NOT EXISTS {table}_{key}_{suffix} AFTER {event} ON {table} BEGIN
+            UPDATE meta SET value = value + 1 WHERE key = '{key}';
+        END"""
+    for table, key in (("faq", "faq_generation"), ("channel_ring", "channel_generation"))
+    for suffix, event in _TRIGGER_EVENTS
+]
+
+
+def ensure_generation_schema(cur):
+    for statement in GENERATION_SCHEMA:
+        cur.execute(statement)
+
+
+def read_generation(cur):
+    """ (جيل الأسئلة، جيل رسائل القناة). """
+    cur.execute("SELECT key, value FROM meta WHERE key IN ('faq_generation', 'channel_generation')")
+    values = dict(cur.fetchall())
+    return values.get("faq_generation", 0), values.get("channel_generation", 0)
+
+
+class FaqSnapshot:
+    """ نسخة ثابتة في الذاكرة من الأسئلة ورسائل القناة لجيل معين.
+    version جيل الأسئلة وحدها؛ channel_version جيل رسائل القناة. """
+
+    def __init__(self, version, faq_entries, channel_texts, channel_version=0):
+        self.version = version
+        self.channel_version = channel_version
+        self.faq_entries = faq_entries
+        self.channel_texts = channel_texts  # من الأقدم إلى الأحدث
+        self.entries = faq_entries + [(text, CHANNEL_ANSWER) for text in channel_texts]
+        self._search_memo = OrderedDict()
+
+
+class FaqSnapshotCache:
+    """ يحتفظ بآخر نسخة من البيانات ويعيد بناءها فقط عند الكتابة أو تغير عداد الأجيال. """
+
+    def __init__(self, storage, check_interval=SNAPSHOT_CHECK_INTERVAL):
+        self.storage = storage
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._last_check = 0.0
+        self._pending_check = None
+        self._lock = threading.Lock()
+
+    def _load(self, conn):
+        version, channel_version = read_generation(conn.cursor())
+        faq_entries = conn.execute("SELECT question, answer FROM faq").fetchall()
+        channel_texts = [text for (text,) in conn.execute("SELECT text FROM channel_ring ORDER BY seq ASC")]
+        logging.info(f"✅ تم تحميل {len(faq_entries)} سؤالًا و{len(channel_texts)} رسالة قناة (الجيل {version}).")
+        return FaqSnapshot(version, faq_entries, channel_texts, channel_version)
+
+    @staticmethod
+    def _generations(snapshot):
+        return snapshot.version, snapshot.channel_version
+
+    def _install(self, snapshot):
+        with self._lock:
+            # لا نستبدل نسخة أحدث بنسخة أقدم حُملت بالتوازي
+            if self._snapshot is None or self._generations(snapshot) >= self._generations(self._snapshot):
+                self._snapshot = snapshot
+            self._last_check = time.monotonic()
+            return self._snapshot
+
+    def refresh(self):
+        """ إعادة بناء النسخة فورًا على الخيط الحالي (عند التشغيل). """
+        return self._install(self._load(self.storage.connection()))
+
+    async def refresh_async(self):
+        """ إعادة بناء النسخة في خيط قراءة (تُستدعى بعد كل كتابة). """
+        return self._install(await self.storage.run(self._load))
+
+    def _check_generation(self, conn):
+        try:
+            if read_generation(conn.cursor()) != self._generations(self._snapshot):
+                self._install(self._load(conn))
+        except Exception as e:
+            logging.error(f"❌ خطأ في قراءة عداد الأجيال: {e}")
+        finally:
+            self._pending_check = None
+
+    def get(self):
+        """ إرجاع النسخة الحالية فورًا؛ التحقق من عداد الأجيال يجري في الخلفية عند انتهاء فترة التحقق. """
+        snapshot = self._snapshot
+        if snapshot is None:
+            return self.refresh()
+        # done(): التحقق قد ينتهي في خيط القراءة قبل أن يُسند مستقبله هنا
+        pending = self._pending_check
+        if (pending is None or pending.done()) and time.monotonic() - self._last_check >= self.check_interval:
+            self._last_check = time.monotonic()
+            self._pending_check = self.storage.submit(self._check_generation)
+        return snapshot
+
+    async def search(self, query, k, search_fn):
+        """ تخزين نتائج البحث داخل النسخة الحالية، فتسقط تلقائيًا عند تغير الجيل.
+        search_fn(conn, query, k) تُنفذ في خيط قراءة. """
+        snapshot = self.get()
+        key = (query, k)
+        memo = snapshot._search_memo
+        if key in memo:
+            memo.move_to_end(key)
+            return memo[key]
+        result = await self.storage.run(search_fn, query, k)
+        memo[key] = result
+        if len(memo) > SEARCH_MEMO_SIZE:
+            memo.popitem(last=False)
+        return result
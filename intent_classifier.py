@@ -0,0 +1,166 @@
+import os
+import re
+import math
+import time
+import logging
+from collections import defaultdict
+from response_cache import normalize_message, EVICTION_EVERY
+from moderation import DEFAULT_PATTERNS
+
+
+# لا نستغني عن Gemini إلا إذا كانت ثقة المصنف المحلي أعلى من هذا الحد
+INTENT_CONFIDENCE_THRESHOLD = float(os.getenv("INTENT_CONFIDENCE_THRESHOLD", 0.9))
+# أقل عدد من الأمثلة المسجلة قبل الاعتماد على نموذج الـ n-gram
+INTENT_MIN_TRAINING = int(os.getenv("INTENT_MIN_TRAINING", 200))
+INTENT_TRAINING_LIMIT = 20000  # أقصى عدد أمثلة تُحمّل عند التشغيل، وأقصى عدد يبقى في الجدول
+INTENT_LOG_MAX_AGE = float(os.getenv("INTENT_LOG_MAX_AGE", 90 * 24 * 3600))  # الأمثلة الأقدم تُحذف (بالثواني)
+LIKELIHOOD_SCALE = 4  # وزن متوسط احتمال الخصائص مقابل الاحتمال المسبق
+
+INTENTS = ("1", "2", "3", "4", "5", "6")
+
+INTENT_LOG_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS intent_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            message TEXT NOT NULL,
+            intent TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )""",
+]
+
+# قواعد للحالات الواضحة: (النية، الثقة، النمط)
+# روابط الدعوات والاختصار فقط (نفس أنماط المرشح المحلي)؛ رابط درس في القناة أو صفحة قاموس يُترك للنموذج
+_LINK = re.compile("|".join(re.escape(pattern) for pattern in DEFAULT_PATTERNS), re.IGNORECASE)
+_MEANING = re.compile(
+    r"^(what\s+(does|do|is)\s+.{1,40}\s+mean|what\s+is\s+the\s+meaning\s+of\s+.{1,40}|meaning\s+of\s+.{1,40}"
+    r"|define\s+.{1,40}|ما\s+معنى\s+.{1,40}|معنى\s+(كلمة\s+)?.{1,40}|شنو\s+معنى\s+.{1,40}|يعني\s+ايه\s+.{1,40})\??$",
+    re.IGNORECASE,
+)
+# كلمة إنجليزية مع علامة على السؤال عن معناها ("serendipity meaning?"، "resilient معنى")؛
+# الكلمة المفردة وحدها ("yes"، "nice"، "really?") دردشة في الغالب، فتُترك للنموذج المتعلم أو Gemini
+_WORD_WITH_MEANING_CUE = re.compile(r"^[A-Za-z][A-Za-z'\-]{1,30}\s+(meaning|means|معنى|معناها|يعني)\s*\??$",
+                                    re.IGNORECASE)
+_CHATTER = {
+    "hi", "hello", "hey", "ok", "okay", "thanks", "thank you", "good morning", "good night", "bye",
+    "السلام عليكم", "وعليكم السلام", "مرحبا", "اهلا", "شكرا", "شكرا جزيلا", "تمام", "صباح الخير", "مساء الخير",
+}
+
+
+def ensure_intent_log_schema(cur):
+    for statement in INTENT_LOG_SCHEMA:
+        cur.execute(statement)
+
+
+def _features(text):
+    """ خصائص النموذج: كلمات مفردة + n-gram حرفية ثلاثية (تعمل للعربية والإنجليزية معًا). """
+    words = text.split()
+    features = [f"w:{w}" for w in words]
+    padded = f" {text} "
+    features.extend(f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2))
+    return features
+
+
+class IntentClassifier:
+    """ مصنف محلي سريع: قواعد للحالات الواضحة ثم Naive Bayes متعدد الحدود يتعلم من قرارات Gemini. """
+
+    def __init__(self, storage, threshold=INTENT_CONFIDENCE_THRESHOLD, min_training=INTENT_MIN_TRAINING):
+        self.storage = storage
+        self.threshold = threshold
+        self.min_training = min_training
+        self.class_counts = defaultdict(int)
+        self.feature_counts = defaultdict(lambda: defaultdict(int))
+        self.feature_totals = defaultdict(int)
+        self.vocabulary = set()
+        self.samples = 0
+        self._records = 0
+        self.fast_path_hits = 0
+        self.total = 0
+
+    def load(self):
+        """ تدريب النموذج من أزواج (رسالة، نية) المسجلة سابقًا. """
+        rows = self.storage.connection().execute(
+            "SELECT message, intent FROM intent_log ORDER BY id DESC LIMIT ?", (INTENT_TRAINING_LIMIT,)).fetchall()
+        for message, intent in rows:
+            self._learn(normalize_message(message), intent)
+        logging.info(f"✅ تم تدريب المصنف المحلي على {self.samples} مثالًا.")
+
+    def _learn(self, text, intent):
+        if intent not in INTENTS or not text:
+            return
+        self.class_counts[intent] += 1
+        counts = self.feature_counts[intent]
+        for feature in _features(text):
+            counts[feature] += 1
+            self.feature_totals[intent] += 1
+            self.vocabulary.add(feature)
+        self.samples += 1
+
+    @staticmethod
+    def _insert(conn, message, intent, created_at, evict):
+        conn.execute("INSERT INTO intent_log (message, intent, created_at) VALUES (?, ?, ?)",
+                     (message, intent, created_at))
+        if evict:
+            IntentClassifier.evict(conn, created_at)
+
+    @staticmethod
+    def evict(conn, now=None):
+        """ حذف الأمثلة الأقدم من INTENT_LOG_MAX_AGE، ثم ما زاد على INTENT_TRAINING_LIMIT (الأقدم أولًا). """
+        now = now or time.time()
+        conn.execute("DELETE FROM intent_log WHERE created_at < ?", (now - INTENT_LOG_MAX_AGE,))
+        conn.execute("DELETE FROM intent_log WHERE id <= (SELECT MAX(id) FROM intent_log) - ?",
+                     (INTENT_TRAINING_LIMIT,))
+
+    def record(self, message, intent):
+        """ تسجيل قرار Gemini (كتابة في الخلفية) وتحديث النموذج تدريجيًا دون إعادة تدريب كاملة.
+
+        يُستدعى فقط للنوايا التي صنفها Gemini فعلًا؛ النية المأخوذة من ذاكرة الردود مسجلة من قبل،
+        وتسجيلها مرة أخرى يضخم وزن الصيغ الشائعة في الاحتمالات المسبقة.
+        """
+        self._records += 1
+        self.storage.fire_and_forget(self._insert, message, intent, time.time(), self._records % EVICTION_EVERY == 0)
+        self._learn(normalize_message(message), intent)
+
+    def _rules(self, message, text):
+        if _LINK.search(message):
+            return "4", 0.97
+        if text in _CHATTER or not text:
+            return "5", 0.95
+        if _MEANING.match(message.strip()) or _WORD_WITH_MEANING_CUE.match(message.strip()):
+            return "6", 0.93
+        return None
+
+    def _predict(self, text):
+        if self.samples < self.min_training:
+            return None
+        features = _features(text)
+        vocab_size = len(self.vocabulary) + 1
+        scores = {}
+        for intent, class_count in self.class_counts.items():
+            counts = self.feature_counts[intent]
+            denominator = math.log(self.feature_totals[intent] + vocab_size)
+            likelihood = sum(math.log(counts.get(feature, 0) + 1) - denominator for feature in features)
+            # متوسط الاحتمال لكل خاصية بدل مجموعها حتى لا تبالغ الرسائل الطويلة في الثقة
+            scores[intent] = math.log(class_count / self.samples) + likelihood / len(features) * LIKELIHOOD_SCALE
+        # تحويل اللوغاريتمات إلى احتمالات لاستخدام أعلى احتمال كثقة
+        best = max(scores.values())
+        exp_scores = {intent: math.exp(score - best) for intent, score in scores.items()}
+        total = sum(exp_scores.values())
+        intent = max(exp_scores, key=exp_scores.get)
+        return intent, exp_scores[intent] / total
+
+    def classify(self, message):
+        """ إرجاع (النية، الثقة) إذا كان القرار المحلي واثقًا بما يكفي، وإلا None للرجوع إلى Gemini. """
+        self.total += 1
+        text = normalize_message(message)
+        result = self._rules(message, text) or self._predict(text)
+        if result and result[1] >= self.threshold:
+            self.fast_path_hits += 1
+            return result
+        return None
+
+    def stats(self):
+        return {
+            "fast_path_hits": self.fast_path_hits,
+            "total": self.total,
+            "hit_rate": (self.fast_path_hits / self.total) if self.total else 0.0,
+            "samples": self.samples,
+        }
@@ -0,0 +1,389 @@
+import os
+import time
+import random
+import logging
+import asyncio
+import functools
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from google.api_core import exceptions as google_exceptions
+except ImportError:
+    google_exceptions = None
+
+from metrics import LLM_BREAKER_STATE, LLM_CALLS, LLM_EXTRA_ATTEMPTS
+from llm_scheduler import LlmScheduler, SchedulerBusyError
+
+
+# إعدادات التزامن والمهلة الزمنية لطلبات Gemini
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", 4))  # أقصى عدد طلبات متزامنة
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", 30))  # المهلة القصوى لكل طلب بالثواني (شاملة إعادة المحاولات)
+GEMINI_ATTEMPT_TIMEOUT = float(os.getenv("GEMINI_ATTEMPT_TIMEOUT", 12))  # مهلة المحاولة الواحدة
+# إعادة المحاولة بتأخير عشوائي متزايد، ضمن رصيد عام حتى لا تضاعف إعادة المحاولات الحمل وقت الأعطال
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", 2))
+GEMINI_RETRY_BASE_DELAY = float(os.getenv("GEMINI_RETRY_BASE_DELAY", 0.5))
+GEMINI_RETRY_BUDGET = float(os.getenv("GEMINI_RETRY_BUDGET", 0.2))  # محاولات إضافية مسموحة لكل طلب
+# نسخة ثانية من الطلب القصير (النية) إذا تأخر الرد الأول أكثر من هذا (ثوانٍ؛ 0 للتعطيل)
+GEMINI_HEDGE_DELAY = float(os.getenv("GEMINI_HEDGE_DELAY", 2))
+# قاطع الدائرة: يفتح بعد عدد من الإخفاقات المتتالية ويرفض الطلبات مدة التهدئة
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", 5))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", 30))
+
+FALLBACK_REPLY = "عذرًا، لم أتمكن من معالجة سؤالك. يرجى المحاولة لاحقًا."
+TIMEOUT_REPLY = "عذرًا، استغرق الرد وقتًا أطول من المتوقع. يرجى المحاولة لاحقًا."
+UNAVAILABLE_REPLY = "عذرًا، المساعد الذكي غير متاح مؤقتًا. يرجى المحاولة بعد قليل."
+
+
+class CircuitOpenError(Exception):
+    """ الدائرة مفتوحة: Gemini يفشل باستمرار فلا يُرسل الطلب أصلًا. """
+
+
+def is_transient(error):
+    """ هل يستحق الخطأ إعادة المحاولة (ويُحسب على قاطع الدائرة)؟ أخطاء الطلب نفسه (4xx، رد محجوب) لا. """
+    if google_exceptions is not None and isinstance(error, google_exceptions.ClientError):
+        return isinstance(error, google_exceptions.TooManyRequests)
+    return not isinstance(error, (ValueError, CircuitOpenError))
+
+
+class RetryBudget:
+    """ رصيد المحاولات الإضافية: كل طلب يضيف ratio وكل إعادة أو نسخة تحوط تستهلك 1. """
+
+    def __init__(self, ratio=GEMINI_RETRY_BUDGET, capacity=10):
+        self.ratio = ratio
+        self.capacity = capacity
+        self.tokens = float(capacity)
+
+    def deposit(self):
+        self.tokens = min(self.capacity, self.tokens + self.ratio)
+
+    def withdraw(self):
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class CircuitBreaker:
+    """ مغلق: الطلبات تمر. مفتوح: تُرفض حتى انتهاء التهدئة. نصف مفتوح: طلب تجريبي واحد يقرر. """
+
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+    _GAUGE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, threshold=BREAKER_FAILURE_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self.rejected = 0
+        self._probing = False
+        LLM_BREAKER_STATE.set(0)
+
+    def _set_state(self, state):
+        if state != self.state:
+            logging.warning(f"⚡ قاطع دائرة Gemini: {self.state} -> {state}")
+            self.state = state
+            LLM_BREAKER_STATE.set(self._GAUGE[state])
+
+    def available(self):
+        """ هل سيُسمح بطلب الآن؟ (دون تغيير الحالة) """
+        if self.state == self.OPEN:
+            return time.monotonic() - self.opened_at >= self.cooldown
+        return not (self.state == self.HALF_OPEN and self._probing)
+
+    def allow(self):
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+            self._set_state(self.HALF_OPEN)
+            self._probing = False
+        if self.state == self.OPEN or (self.state == self.HALF_OPEN and self._probing):
+            self.rejected += 1
+            return False
+        if self.state == self.HALF_OPEN:
+            self._probing = True
+        return True
+
+    def abandon(self):
+        """ الطلب التجريبي أُلغي قبل أن يُعرف مصيره: يُسمح بطلب تجريبي آخر. """
+        self._probing = False
+
+    def record_success(self):
+        self.failures = 0
+        self._probing = False
+        self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+            if self.state != self.OPEN:
+                self.opens += 1
+            self.opened_at = time.monotonic()
+            self._set_state(self.OPEN)
+
+
+class GeminiClient:
+    """ عميل غير متزامن لـ Gemini يعمل خارج حلقة الأحداث مع حد أقصى للتزامن. """
+
+    def __init__(self, model=None, max_concurrency=GEMINI_MAX_CONCURRENCY, timeout=GEMINI_TIMEOUT,
+                 attempt_timeout=GEMINI_ATTEMPT_TIMEOUT, max_retries=GEMINI_MAX_RETRIES, model_factory=None):
+        self._model = model
+        self.model_factory = model_factory  # يبني النموذج عند أول طلب بدل وقت الاستيراد
+        self._model_lock = threading.Lock()
+        self.timeout = timeout
+        self.attempt_timeout = attempt_timeout
+        self.max_retries = max_retries
+        self.max_concurrency = max_concurrency
+        # منفذ مخصص حتى لا تزاحم طلبات Gemini باقي المهام في المنفذ الافتراضي؛ ضعف عدد الأماكن لأن المحاولة
+        # المتروكة بعد المهلة (أو الخاسرة أمام نسخة التحوط) تشغل خيطها حتى تنتهي مهلة HTTP الخاصة بها
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency * 2, thread_name_prefix="gemini")
+        self.in_flight = 0
+        self.breaker = CircuitBreaker()
+        # حد التزامن الوحيد: طابور أولويات (طلب المشرف يسبق دردشة المجموعة، والطلبات الزائدة تسقط بدل أن تتراكم)،
+        # ونسخة التحوط تأخذ مكانًا منه أيضًا
+        self.scheduler = LlmScheduler(max_concurrency)
+        self.budget = RetryBudget()
+        self.retries = 0
+        self.hedges = 0
+        # دالة اختيارية تُستدعى بعد كل طلب: (prompt, generation_config, text, error, latency)
+        self.observer = None
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._model = self.model_factory()
+        return self._model
+
+    @model.setter
+    def model(self, model):
+        self._model = model
+
+    def prewarm(self):
+        """ بناء النموذج في المنفذ المخصص دون انتظار، حتى لا يدفع أول طلب حقيقي كلفة التهيئة. """
+        future = self._executor.submit(lambda: self.model)
+        future.add_done_callback(lambda f: f.exception())  # الخطأ يُسجل في model_factory ويتكرر مع أول طلب
+        return future
+
+    def available(self):
+        """ False إذا كانت الدائرة مفتوحة: الأفضل الرد محليًا بدل انتظار طلب محكوم عليه بالفشل. """
+        return self.breaker.available()
+
+    def _generate_sync(self, prompt, generation_config=None, timeout=None):
+        # مهلة HTTP داخل المكتبة حتى لا يبقى الخيط معلقًا بعد أن نتوقف عن انتظاره
+        kwargs = {"request_options": {"timeout": timeout}} if timeout else {}
+        if generation_config is not None:
+            kwargs["generation_config"] = generation_config
+        response = self.model.generate_content(prompt, **kwargs)
+        return response.text
+
+    async def _attempt(self, prompt, generation_config, timeout):
+        """ محاولة واحدة في المنفذ المخصص، داخل مكان الطلب في طابور الأولويات. """
+        loop = asyncio.get_running_loop()
+        self.in_flight += 1
+        # run_in_executor لا ينقل contextvars؛ ننسخ السياق حتى يعرف خيط Gemini التحديث الجاري
+        call = functools.partial(contextvars.copy_context().run, self._generate_sync, prompt, generation_config,
+                                 timeout)
+        future = loop.run_in_executor(self._executor, call)
+
+        def finished(done):
+            self.in_flight -= 1
+            if not done.cancelled():
+                done.exception()  # محاولة متروكة بعد المهلة: لا تحذير "exception was never retrieved"
+
+        future.add_done_callback(finished)
+        return await asyncio.wait_for(asyncio.shield(future), timeout)
+
+    async def _call(self, prompt, generation_config, timeout, hedge_after):
+        """ محاولة واحدة، مع نسخة تحوط ثانية إذا تأخرت أكثر من hedge_after؛ أول رد ناجح يُعتمد.
+
+        النسخة الثانية تحتاج رصيدًا ومكانًا حرًا في طابور الأولويات فورًا، فلا تنتظر خلف طلبات الآخرين.
+        """
+        if not hedge_after or hedge_after >= timeout:
+            return await self._attempt(prompt, generation_config, timeout)
+        first = asyncio.ensure_future(self._attempt(prompt, generation_config, timeout))
+        done, _ = await asyncio.wait({first}, timeout=hedge_after)
+        if done or not self.scheduler.try_acquire():
+            return await first
+        if not self.budget.withdraw():
+            self.scheduler.release()
+            return await first
+        self.hedges += 1
+        LLM_EXTRA_ATTEMPTS.inc(kind="hedge")
+        hedge = asyncio.ensure_future(self._attempt(prompt, generation_config, timeout - hedge_after))
+        hedge.add_done_callback(lambda _: self.scheduler.release())
+        pending = {first, hedge}
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    return task.result()
+                error = task.exception()
+        raise error
+
+    async def generate(self, prompt, timeout=None, generation_config=None, retries=None, hedge_after=None):
+        """ طلب Gemini بمهلة كلية، وإعادة محاولة للأخطاء العابرة ضمن الرصيد، ونسخة تحوط اختيارية.
+
+        يرفع CircuitOpenError فورًا إذا كانت الدائرة مفتوحة، وSchedulerBusyError إذا سقط الطلب من طابور الأولويات.
+        الانتظار في الطابور جزء من المهلة الكلية.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (timeout or self.timeout)
+        retries = self.max_retries if retries is None else retries
+        started = time.perf_counter()
+        text, error = None, None
+        admitted = False
+        try:
+            if not self.breaker.available():
+                raise CircuitOpenError()
+            await self.scheduler.acquire(timeout=deadline - loop.time())
+            admitted = True
+            self.budget.deposit()
+            for attempt in range(retries + 1):
+                if not self.breaker.allow():
+                    raise CircuitOpenError()
+                try:
+                    text = await self._call(prompt, generation_config,
+                                            min(self.attempt_timeout, deadline - loop.time()), hedge_after)
+                except asyncio.CancelledError:
+                    self.breaker.abandon()
+                    raise
+                except Exception as e:
+                    transient = is_transient(e)
+                    if transient:
+                        self.breaker.record_failure()
+                    else:
+                        self.breaker.record_success()  # Gemini رد فعلًا، والخطأ في الطلب نفسه
+                    delay = GEMINI_RETRY_BASE_DELAY * 2 ** attempt * random.uniform(0.5, 1.5)
+                    if (not transient or attempt == retries or loop.time() + delay >= deadline
+                            or not self.breaker.available() or not self.budget.withdraw()):
+                        raise
+                    self.retries += 1
+                    LLM_EXTRA_ATTEMPTS.inc(kind="retry")
+                    logging.warning(f"⚠️ فشل طلب Gemini ({type(e).__name__})، إعادة المحاولة بعد {delay:.1f} ثانية.")
+                    await asyncio.sleep(delay)
+                else:
+                    self.breaker.record_success()
+                    return text
+        except CircuitOpenError:
+            error = "circuit_open"
+            raise
+        except SchedulerBusyError:
+            error = "shed"
+            raise
+        except asyncio.TimeoutError:
+            error = "timeout"
+            raise
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            raise
+        finally:
+            if admitted:
+                self.scheduler.release()
+            LLM_CALLS.inc(outcome="success" if error is None else error if error in ("timeout", "circuit_open", "shed")
+                          else "error")
+            if self.observer is not None and error not in ("circuit_open", "shed"):
+                self.observer(prompt, generation_config, text, error, time.perf_counter() - started)
+
+    def _stream_sync(self, prompt, emit, cancelled, timeout):
+        # يعمل في خيط المنفذ: كل جزء نصي يُمرر إلى حلقة الأحداث فور وصوله
+        for chunk in self.model.generate_content(prompt, stream=True, request_options={"timeout": timeout}):
+            if cancelled.is_set():
+                return
+            try:
+                text = chunk.text
+            except ValueError:  # جزء بلا نص (مثل سبب الانتهاء فقط)
+                continue
+            if text:
+                emit(text)
+
+    async def stream(self, prompt, timeout=None):
+        """ توليد أجزاء رد Gemini فور وصولها؛ المهلة تشمل الرد كاملًا كما في generate.
+
+        لا إعادة محاولة هنا (قد يكون جزء من الرد قد أُرسل للطالب)، لكن النتيجة تُحسب على قاطع الدائرة.
+        """
+        if not self.breaker.available():
+            LLM_CALLS.inc(outcome="circuit_open")
+            raise CircuitOpenError()
+        loop = asyncio.get_running_loop()
+        timeout = timeout or self.timeout
+        chunks = asyncio.Queue()
+        cancelled = threading.Event()
+        done = object()
+
+        def emit(item):
+            try:
+                loop.call_soon_threadsafe(chunks.put_nowait, item)
+            except RuntimeError:  # حلقة الأحداث أُغلقت
+                cancelled.set()
+
+        def produce():
+            try:
+                self._stream_sync(prompt, emit, cancelled, timeout)
+            except BaseException as e:
+                emit(e)
+            else:
+                emit(done)
+
+        async with self.scheduler.slot(timeout=timeout):
+            # الفحص الفعلي بعد الطابور: الدائرة قد تُفتح أثناء الانتظار
+            if not self.breaker.allow():
+                LLM_CALLS.inc(outcome="circuit_open")
+                raise CircuitOpenError()
+            self.in_flight += 1
+            started = time.perf_counter()
+            deadline = loop.time() + timeout
+            parts, error = [], None
+            loop.run_in_executor(self._executor, functools.partial(contextvars.copy_context().run, produce))
+            try:
+                while True:
+                    item = await asyncio.wait_for(chunks.get(), timeout=max(deadline - loop.time(), 0))
+                    if item is done:
+                        self.breaker.record_success()
+                        return
+                    if isinstance(item, BaseException):
+                        raise item
+                    parts.append(item)
+                    yield item
+            except asyncio.TimeoutError:
+                error = "timeout"
+                self.breaker.record_failure()
+                raise
+            except BaseException as e:  # يشمل إغلاق المولد قبل نهايته
+                error = str(e) or type(e).__name__
+                if not isinstance(e, Exception):
+                    self.breaker.abandon()
+                elif is_transient(e):
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                raise
+            finally:
+                cancelled.set()
+                self.in_flight -= 1
+                LLM_CALLS.inc(outcome="success" if error is None else "timeout" if error == "timeout" else "error")
+                if self.observer is not None:
+                    self.observer(prompt, None, "".join(parts) if error is None else None, error,
+                                  time.perf_counter() - started)
+
+    def stats(self):
+        return {
+            "state": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "opens": self.breaker.opens,
+            "rejected": self.breaker.rejected,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "budget": self.budget.tokens,
+            "in_flight": self.in_flight,
+            **{f"queue_{key}": value for key, value in self.scheduler.stats().items()},
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
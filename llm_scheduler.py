@@ -0,0 +1,176 @@
+""" جدولة طلبات Gemini حسب الأولوية: المشرف ثم الإشراف ثم الخاص ثم ردود المجموعة ثم مراجعة الكتابات.
+
+عدد الأماكن = GEMINI_MAX_CONCURRENCY؛ الطلب الذي لا يجد مكانًا ينتظر في طابور محدود (LLM_QUEUE_DEPTH).
+عند امتلاء الطابور يُطرد أقل الطلبات أولوية (أو يُرفض الطلب الجديد إذا كان هو الأقل)، والطلب الذي تجاوز
+أقصى انتظار لفئته يسقط بدل أن يصل رده بعد أن فقد قيمته. الطلب الساقط يرفع SchedulerBusyError فيرد البوت
+برسالة انشغال مهذبة، فيبقى زمن الانتظار محدودًا للجميع أثناء موجات الحركة.
+"""
+import os
+import time
+import heapq
+import asyncio
+import itertools
+import contextvars
+from contextlib import asynccontextmanager, contextmanager
+
+from metrics import LLM_QUEUE_DEPTH, LLM_QUEUE_SECONDS, LLM_SHED
+
+
+LLM_QUEUE_DEPTH_LIMIT = int(os.getenv("LLM_QUEUE_DEPTH", 32))  # أقصى عدد طلبات منتظرة
+LLM_QUEUE_MAX_WAIT = float(os.getenv("LLM_QUEUE_MAX_WAIT", 10))  # أقصى انتظار لردود المجموعة بالثواني
+
+BUSY_REPLY = "عذرًا، المساعد مشغول جدًا الآن. يرجى إعادة إرسال سؤالك بعد قليل."
+
+# الأولويات (الأصغر أولًا)
+PRIORITY_ADMIN = 0
+PRIORITY_MODERATION = 1  # تصنيف رسائل المجموعة (يكشف المخالفات)
+PRIORITY_PRIVATE = 2
+PRIORITY_GROUP = 3
+PRIORITY_COMPOSITION = 4  # مراجعة موضوع الكتابة: طويلة ويمكن إعادة طلبها
+
+PRIORITY_NAMES = {
+    PRIORITY_ADMIN: "admin",
+    PRIORITY_MODERATION: "moderation",
+    PRIORITY_PRIVATE: "private",
+    PRIORITY_GROUP: "group",
+    PRIORITY_COMPOSITION: "composition",
+}
+
+# أقصى انتظار في الطابور لكل فئة: المشرف ينتظر دائمًا، والطالب في الخاص أطول من دردشة المجموعة
+MAX_WAIT = {
+    PRIORITY_ADMIN: None,
+    PRIORITY_MODERATION: LLM_QUEUE_MAX_WAIT * 1.5,
+    PRIORITY_PRIVATE: LLM_QUEUE_MAX_WAIT * 2,
+    PRIORITY_GROUP: LLM_QUEUE_MAX_WAIT,
+    PRIORITY_COMPOSITION: LLM_QUEUE_MAX_WAIT,
+}
+
+# أولوية التحديث الجاري؛ تُضبط في handle_message وتنتقل مع السياق إلى GeminiClient
+CURRENT_PRIORITY = contextvars.ContextVar("llm_priority", default=PRIORITY_GROUP)
+
+
+class SchedulerBusyError(Exception):
+    """ سقط الطلب من الطابور (امتلاء أو تجاوز أقصى انتظار) دون أن يصل إلى Gemini. """
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+@contextmanager
+def llm_priority(priority):
+    """ تعيين أولوية طلبات Gemini داخل الكتلة (مثل مراجعة الكتابة داخل رسالة مجموعة). """
+    token = CURRENT_PRIORITY.set(priority)
+    try:
+        yield
+    finally:
+        CURRENT_PRIORITY.reset(token)
+
+
+class LlmScheduler:
+    """ أماكن محدودة لطلبات Gemini مع طابور أولويات محدود العمق ومهل انتظار لكل فئة. """
+
+    def __init__(self, slots, max_depth=LLM_QUEUE_DEPTH_LIMIT, max_wait=None):
+        self.free = slots
+        self.max_depth = max_depth
+        self.max_wait = dict(MAX_WAIT if max_wait is None else max_wait)
+        self._waiting = []  # كومة (الأولوية، الترتيب، المستقبل)
+        self._order = itertools.count()
+        self.admitted = 0
+        self.queued = 0
+        self.shed = {"full": 0, "evicted": 0, "expired": 0}
+
+    def depth(self):
+        return sum(1 for _, _, future in self._waiting if not future.done())
+
+    def _update_depth(self):
+        if len(self._waiting) > 2 * self.max_depth:
+            # طلبات مطرودة أو منتهية لا تزال في الكومة
+            self._waiting = [entry for entry in self._waiting if not entry[2].done()]
+            heapq.heapify(self._waiting)
+        LLM_QUEUE_DEPTH.set(self.depth())
+
+    def _drop(self, priority, reason):
+        self.shed[reason] += 1
+        LLM_SHED.inc(priority=PRIORITY_NAMES.get(priority, priority), reason=reason)
+
+    def _evict_lowest(self, priority):
+        """ طرد أحدث طلب منتظر أقل أولوية من priority لإفساح مكان له؛ False إذا لم يوجد. """
+        victims = [entry for entry in self._waiting if not entry[2].done() and entry[0] > priority]
+        if not victims:
+            return False
+        victim = max(victims, key=lambda entry: (entry[0], entry[1]))
+        victim[2].set_exception(SchedulerBusyError("evicted"))
+        self._drop(victim[0], "evicted")
+        return True
+
+    def try_acquire(self, priority=None):
+        """ أخذ مكان حر فورًا دون انتظار (ولا تخطي لطلب منتظر)؛ False إذا لم يوجد. """
+        priority = CURRENT_PRIORITY.get() if priority is None else priority
+        if self.free <= 0 or self.depth():
+            return False
+        self.free -= 1
+        self.admitted += 1
+        LLM_QUEUE_SECONDS.observe(0.0, priority=PRIORITY_NAMES.get(priority, priority))
+        return True
+
+    async def acquire(self, priority=None, timeout=None):
+        """ انتظار مكان لطلب Gemini؛ يرفع SchedulerBusyError إذا امتلأ الطابور أو طال الانتظار. """
+        priority = CURRENT_PRIORITY.get() if priority is None else priority
+        name = PRIORITY_NAMES.get(priority, priority)
+        if self.try_acquire(priority):
+            return
+        if self.depth() >= self.max_depth and not self._evict_lowest(priority):
+            self._drop(priority, "full")
+            raise SchedulerBusyError("full")
+        # الانتظار محدود بأقصى انتظار الفئة وبما بقي من مهلة الطلب نفسه
+        max_wait = self.max_wait.get(priority)
+        if timeout is not None:
+            max_wait = timeout if max_wait is None else min(max_wait, timeout)
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, next(self._order), future))
+        self.queued += 1
+        self._update_depth()
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), max_wait)
+        except asyncio.TimeoutError:
+            if not future.done():
+                future.cancel()
+                self._drop(priority, "expired")
+                raise SchedulerBusyError("expired")
+            if future.exception() is not None:
+                raise future.exception()  # طُرد مع انتهاء المهلة: يبقى السبب "evicted" (ومحسوبًا مرة واحدة)
+            self.release()  # المكان وصل مع انتهاء المهلة: نعيده لمن بعده
+            self._drop(priority, "expired")
+            raise SchedulerBusyError("expired")
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self.release()
+            future.cancel()
+            raise
+        finally:
+            LLM_QUEUE_SECONDS.observe(time.perf_counter() - started, priority=name)
+            self._update_depth()
+        self.admitted += 1
+
+    def release(self):
+        """ تسليم المكان مباشرة لأعلى طلب منتظر أولوية، أو إعادته إلى الأماكن الحرة. """
+        while self._waiting:
+            _, _, future = heapq.heappop(self._waiting)
+            if not future.done():
+                future.set_result(None)
+                self._update_depth()
+                return
+        self.free += 1
+
+    @asynccontextmanager
+    async def slot(self, priority=None, timeout=None):
+        await self.acquire(priority, timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        return {"depth": self.depth(), "admitted": self.admitted, "queued": self.queued, **self.shed}
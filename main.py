@@ -1,11 +1,12 @@
 import os
-import sqlite3
 import shutil
 import logging
 import uuid
+import tempfile
 import time
 import asyncio
 from datetime import datetime, timedelta
+_IMPORT_STARTED = time.perf_counter()  # بداية تقرير زمن البدء (قبل استيراد المكتبات الثقيلة)
 from telegram import ChatPermissions
 from telegram import Update
 from telegram.ext import (
@@ -13,71 +14,224 @@ from telegram.ext import (
     MessageHandler,
     CommandHandler,  # أضف هذا
     filters,
-    ContextTypes
+    ContextTypes,
+    TypeHandler,
 )
-import google.generativeai as genai
-import pytz  # إضافة مكتبة pytz لضبط التوقيت
-from flask import Flask, request, jsonify
 import threading
+import queue
 import re
+from logging.handlers import QueueHandler, QueueListener
+from llm import GeminiClient, CircuitOpenError, FALLBACK_REPLY, GEMINI_HEDGE_DELAY, TIMEOUT_REPLY, UNAVAILABLE_REPLY
+from llm_scheduler import (
+    BUSY_REPLY,
+    PRIORITY_ADMIN,
+    PRIORITY_COMPOSITION,
+    PRIORITY_MODERATION,
+    PRIORITY_PRIVATE,
+    SchedulerBusyError,
+    llm_priority,
+)
+from retrieval import ensure_fts_schema, search_knowledge, CHANNEL_ANSWER, FAQ_TOP_K
+from faq_cache import FaqSnapshotCache, ensure_generation_schema
+from response_cache import ResponseCache, ensure_response_cache_schema
+from vocab_cache import VocabularyCache, ensure_vocabulary_schema, extract_headword, parse_vocabulary, render_vocabulary
+from intent_classifier import IntentClassifier, ensure_intent_log_schema
+from prompts import build_prompt
+from webhook_server import run_webhook
+from sharding import SHARD_WORKERS, run_front
+from update_processing import OrderedUpdateProcessor
+from rate_limit import RateLimiter, ensure_rate_limit_schema
+from storage import Storage
+from similarity_index import SimilarityIndex
+from metrics import CONTENT_TYPE, ERRORS, INTENTS, UPDATES, InstrumentedRequest, STAGE_SECONDS, STARTUP_SECONDS, render as render_metrics, timed
+from moderation import Moderator
+from faq_bulk import FORMATS, detect_format, ensure_faq_schema, export_to_file, import_rows, parse_rows
+from channel_ring import ChannelRing, ensure_channel_ring_schema, migrate_channel_messages
+from traffic_replay import ReplayRequest, TrafficRecorder
+from streaming import drain_final_edits, stream_reply
+from outbound import OutboundQueue, PRIORITY_MODERATION as OUTBOUND_PRIORITY_MODERATION
+from structured_reply import (
+    STRUCTURED_GENERATION_CONFIG,
+    parse_intent,
+    parse_structured_reply,
+)
 
 
-# تهيئة التسجيل (logging)
-logging.basicConfig(level=logging.INFO)
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# تهيئة التسجيل (logging): المستوى من LOG_LEVEL (DEBUG لإظهار تفاصيل كل رسالة)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+SHARD_INDEX = os.getenv("SHARD_INDEX")  # رقم العامل في وضع العمال المتعددين (sharding.py)، يظهر في كل سطر سجل
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s' if SHARD_INDEX is None else \
+    f'%(asctime)s - shard {SHARD_INDEX} - %(levelname)s - %(message)s'
+logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT)
+# الكتابة الفعلية للسجلات في خيط مستقل حتى لا تحجب حلقة الأحداث
+_log_queue = queue.SimpleQueue()
+_log_listener = QueueListener(_log_queue, *logging.root.handlers, respect_handler_level=True)
+logging.root.handlers = [QueueHandler(_log_queue)]
+_log_listener.start()
+
+
+def env_int(name, default=0):
+    """ قراءة رقم صحيح من البيئة؛ المتغير المفقود أو غير الصالح يُسجل ولا يوقف الاستيراد. """
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        logging.error(f"❌ قيمة غير صالحة للمتغير {name}: {value}")
+        return default
 
 
 # قراءة المتغيرات من البيئة
 TOKEN = os.getenv("FAQBOT_TOKEN")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-ALLOWED_GROUP_ID = int(os.getenv("ALLOWED_GROUP_ID"))  # معرف المجموعة المسموح بها
-ADMIN_USER_ID = int(os.getenv("ADMIN_USER_ID"))  # معرف المستخدم المشرف (أنت)
+ALLOWED_GROUP_ID = env_int("ALLOWED_GROUP_ID")  # معرف المجموعة المسموح بها
+ADMIN_USER_ID = env_int("ADMIN_USER_ID")  # معرف المستخدم المشرف (أنت)
 CHANNEL_ID = os.getenv("CHANNEL_ID")
 WEBHOOK_URL = os.getenv("WEBHOOK_URL") # عنوان URL الخاص بالويبهوك
-user_violations = {}  # لتتبع عدد مخالفات كل مستخدم
-# تهيئة Gemini API
-try:
-    genai.configure(api_key=GEMINI_API_KEY)
-    model = genai.GenerativeModel('gemini-2.0-flash')
-    logging.info("✅ تم تهيئة Gemini API بنجاح!")
-except Exception as e:
-    logging.error(f"❌ خطأ في تهيئة Gemini API: {e}")
-    
-app_flask = Flask(__name__)
+GROUP_STRUCTURED_MODE = os.getenv("GROUP_STRUCTURED_MODE", "1") == "1"  # طلب واحد للنية والرد معًا في المجموعة
+NOTICE_DELETE_DELAY = 10  # ثوانٍ قبل حذف رسائل التحذير والكتم
+DEGRADED_NOTICE = "⚠️ المساعد الذكي غير متاح مؤقتًا، هذه أقرب إجابة من الأسئلة الشائعة:"
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "1") == "1"  # إرسال الردود الطويلة أثناء توليدها بتعديلات متتالية
+TRAFFIC_RECORD_PATH = os.getenv("TRAFFIC_RECORD_PATH")  # ملف JSONL لتسجيل الحركة (traffic_replay.py)
+SHARD_COUNT = env_int("SHARD_COUNT", 1)  # عدد العمال الذين يتشاركون قاعدة البيانات (يضبطه sharding.py)
+TRAFFIC_REPLAY = os.getenv("TRAFFIC_REPLAY") == "1"  # يُضبط من traffic_replay.py: لا طلبات حقيقية إلى Telegram
+# تهيئة Gemini API عند أول طلب فقط: استيراد مكتبة Gemini وحده يستغرق قرابة ثانية
+def create_gemini_model():
+    try:
+        import google.generativeai as genai
+        genai.configure(api_key=GEMINI_API_KEY)
+        model = genai.GenerativeModel('gemini-2.0-flash')
+        logging.info("✅ تم تهيئة Gemini API بنجاح!")
+        return model
+    except Exception as e:
+        logging.error(f"❌ خطأ في تهيئة Gemini API: {e}")
+        raise
 
-# نقطة نهاية أساسية للتحقق من عمل الخادم
-@app_flask.route('/')
-def home():
-    return "✅ البوت يعمل بشكل صحيح!", 200
-    
+
+llm_client = GeminiClient(model_factory=create_gemini_model)
+
+
+# خادم Flask لفحص الصحة والمقاييس، في وضع polling فقط (خادم الويبهوك يخدم نفس المسارات)
+def create_flask_app():
+    from flask import Flask, Response
+
+    app_flask = Flask(__name__)
+
+    # نقطة نهاية أساسية للتحقق من عمل الخادم
+    @app_flask.route('/')
+    def home():
+        return "✅ البوت يعمل بشكل صحيح!", 200
+
+    # مقاييس زمن كل مرحلة بصيغة Prometheus
+    @app_flask.route('/metrics')
+    def metrics():
+        return Response(render_metrics(), content_type=CONTENT_TYPE)
+
+    return app_flask
+
+
+# طبقة التخزين: وضع WAL، اتصال لكل خيط، والكتابات مجمعة في خيط واحد
+storage = Storage()
+FTS_AVAILABLE = False
+
+
+def initialize_database():
+    """ إنشاء الجداول والفهارس والعدادات إذا لم تكن موجودة (عند التشغيل وبعد إعادة التعيين). """
+    global FTS_AVAILABLE
+    try:
+        with storage.transaction() as conn:
+            cur = conn.cursor()
+            ensure_faq_schema(cur)
+            # آخر رسائل القناة في جدول دائري بعدد ثابت من الخانات
+            ensure_channel_ring_schema(cur)
+            # عداد الأجيال للنسخة المحفوظة في الذاكرة، وذاكرة الردود، والحدود، وسجل النوايا
+            ensure_generation_schema(cur)
+            ensure_response_cache_schema(cur)
+            ensure_vocabulary_schema(cur)
+            ensure_rate_limit_schema(cur)
+            ensure_intent_log_schema(cur)
+        logging.info("✅ تم إنشاء الجداول بنجاح!")
+    except Exception as e:
+        logging.error(f"❌ خطأ في إنشاء الجداول: {e}")
+
+    # إنشاء الفهرس النصي (FTS5) لاسترجاع المداخل الأكثر صلة فقط
+    try:
+        with storage.transaction() as conn:
+            ensure_fts_schema(conn.cursor())
+        FTS_AVAILABLE = True
+    except Exception as e:
+        FTS_AVAILABLE = False
+        logging.error(f"❌ خطأ في إنشاء الفهرس النصي، سيتم استخدام كامل قاعدة البيانات: {e}")
+
+    # نقل رسائل القناة من الجدول القديم (بعد الفهرس حتى تنتقل مداخلها فيه أيضًا)
+    try:
+        with storage.transaction() as conn:
+            migrate_channel_messages(conn.cursor())
+    except Exception as e:
+        logging.error(f"❌ خطأ في نقل رسائل القناة: {e}")
 
 
-# إنشاء اتصال بقاعدة البيانات
-try:
-    conn = sqlite3.connect('faq.db', check_same_thread=False)  # إضافة check_same_thread=False
-    cur = conn.cursor()
-    logging.info("✅ تم الاتصال بقاعدة البيانات بنجاح!")
-except Exception as e:
-    logging.error(f"❌ خطأ في الاتصال بقاعدة البيانات: {e}")
-
-# إنشاء الجداول إذا لم تكن موجودة
-try:
-    cur.execute('''CREATE TABLE IF NOT EXISTS faq (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    question TEXT,
-                    answer TEXT,
-                    category TEXT
-                )''')
-    cur.execute('''CREATE TABLE IF NOT EXISTS channel_messages (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    message_id INTEGER,
-                    chat_id INTEGER,
-                    text TEXT
-                )''')
-    conn.commit()
-    logging.info("✅ تم إنشاء الجداول بنجاح!")
-except Exception as e:
-    logging.error(f"❌ خطأ في إنشاء الجداول: {e}")
+# آخر رسائل القناة في الذاكرة (تُقرأ منها مراجعات الكتابة دون استعلام)
+channel_ring = ChannelRing(storage)
+
+# نسخة من البيانات في الذاكرة حتى لا تلمس معالجات القراءة قاعدة البيانات
+faq_cache = FaqSnapshotCache(storage)
+
+# فهرس تشابه محلي للأسئلة: السؤال المطابق تقريبًا لسؤال مخزن يُجاب مباشرة دون Gemini
+similarity_index = SimilarityIndex()
+
+# ذاكرة دائمة لردود Gemini على الأسئلة المتكررة
+response_cache = ResponseCache(storage)
+
+# معاني الكلمات (النية 6) محللة بمفتاح الكلمة: الكلمة المسؤول عنها سابقًا تُجاب دون Gemini
+vocabulary_cache = VocabularyCache(storage)
+
+# حدود الرسائل لكل مستخدم (نافذة منزلقة محفوظة في قاعدة البيانات)
+rate_limiter = RateLimiter(storage)
+
+# مصنف محلي للنوايا الواضحة يتعلم من قرارات Gemini السابقة
+intent_classifier = IntentClassifier(storage)
+moderator = Moderator()
+
+# كل ما يُرسل إلى Telegram من المعالجات يمر بطابور واحد يحترم حدود الإرسال (الردود المتدفقة تعدل رسالتها مباشرة)
+outbound = OutboundQueue()
+
+_initialized = False
+FIRST_UPDATE_SECONDS = None
+
+
+def initialize_state():
+    """ إنشاء الجداول وتحميل النسخ المحفوظة في الذاكرة، مرة واحدة (من create_application أو أدوات القياس). """
+    global _initialized
+    if _initialized:
+        return
+    started = time.perf_counter()
+    initialize_database()
+    try:
+        channel_ring.hydrate()
+    except Exception as e:
+        logging.error(f"❌ خطأ في تحميل رسائل القناة: {e}")
+    try:
+        similarity_index.load(storage.connection(), faq_cache.get().version)
+    except Exception as e:
+        logging.error(f"❌ خطأ في بناء فهرس التشابه: {e}")
+    try:
+        intent_classifier.load()
+    except Exception as e:
+        logging.error(f"❌ خطأ في تهيئة المصنف المحلي: {e}")
+    _initialized = True
+    STARTUP_SECONDS.set(time.perf_counter() - started, phase="initialize")
+
+
+def report_first_update():
+    """ الزمن من بدء الاستيراد حتى انتهاء معالجة أول تحديث (يُقاس مرة واحدة لكل عملية). """
+    global FIRST_UPDATE_SECONDS
+    if FIRST_UPDATE_SECONDS is not None:
+        return
+    FIRST_UPDATE_SECONDS = time.perf_counter() - _IMPORT_STARTED
+    STARTUP_SECONDS.set(FIRST_UPDATE_SECONDS, phase="first_update")
+    logging.info(f"⏱️ تمت معالجة أول تحديث بعد {FIRST_UPDATE_SECONDS:.2f} ثانية من بدء التشغيل.")
 
 def escape_markdown_v2(text):
     escape_chars = r"\_*[]()~`>#+-=|{}.!"
@@ -95,46 +249,40 @@ def get_user_name(update):
         return "عزيزي الطالب"  # قيمة افتراضية إذا لم يوجد اسم
         
 def get_recent_channel_messages():
-    """ استرجاع آخر 5 رسائل مخزنة من القناة """
+    """ استرجاع آخر رسائل القناة من الجدول الدائري في الذاكرة """
     try:
-        cur.execute("SELECT text FROM channel_messages ORDER BY id DESC LIMIT 5")
-        messages = cur.fetchall()
-        return [msg[0] for msg in messages]  # إرجاع الرسائل كنصوص
+        if SHARD_COUNT > 1:
+            # منشورات القناة تصل إلى عامل واحد؛ الباقون يقرؤونها من النسخة المتزامنة بعداد الأجيال
+            return list(reversed(faq_cache.get().channel_texts))
+        return channel_ring.recent()
     except Exception as e:
         logging.error(f"❌ خطأ في جلب الرسائل المخزنة من القناة: {e}")
         return []
 # دالة لإضافة استفسار جديد
-def add_faq(question, answer, category):
+async def add_faq(question, answer, category):
     try:
-        cur.execute("INSERT INTO faq (question, answer, category) VALUES (?, ?, ?)", 
-                    (question, answer, category))
-        conn.commit()
+        faq_id = await storage.write(lambda conn: conn.execute("INSERT INTO faq (question, answer, category) VALUES (?, ?, ?)",
+                                                               (question, answer, category)).lastrowid)
+        similarity_index.add(faq_id, question, answer)
+        similarity_index.version = (await faq_cache.refresh_async()).version
         logging.info(f"✅ تم إضافة استفسار جديد: {question}")
         return True  # إرجاع True إذا تمت الإضافة بنجاح
     except Exception as e:
         logging.error(f"❌ خطأ في إضافة استفسار جديد: {e}")
         return False  # إرجاع False إذا حدث خطأ
 
-async def store_channel_message(update: Update):
+async def store_channel_message(update: Update, context: ContextTypes.DEFAULT_TYPE = None):
     """تخزين الرسالة فقط إذا كانت من القناة الرسمية"""
     try:
-        message_id = update.message.message_id
-        chat_id = update.message.chat_id
-        text = update.message.text
+        message_id = update.effective_message.message_id
+        chat_id = update.effective_message.chat_id
+        text = update.effective_message.text
 
         # 🔹 التحقق من أن الرسالة قادمة من القناة الرسمية
         if str(chat_id) == os.getenv("CHANNEL_ID"):
-            cur.execute("INSERT INTO channel_messages (message_id, chat_id, text) VALUES (?, ?, ?)",
-                        (message_id, chat_id, text))
-
-            cur.execute("SELECT COUNT(*) FROM channel_messages")
-            count = cur.fetchone()[0]
-
-        if count > 5:
-            # حذف أقدم الرسائل للحفاظ على العدد عند 10 فقط
-            cur.execute("DELETE FROM channel_messages WHERE id IN (SELECT id FROM channel_messages ORDER BY id ASC LIMIT ?)", (count - 5,))
-  
-            conn.commit()
+            # كتابة الخانة seq % N فوق أقدم رسالة: لا عدّ ولا حذف
+            await asyncio.wrap_future(channel_ring.append(message_id, chat_id, text))
+            await faq_cache.refresh_async()
             logging.info(f"✅ تم تخزين رسالة من القناة: {text}")
         else:
             logging.info(f"⚠️ تم تجاهل رسالة لأنها ليست من القناة الرسمية. (Chat ID: {chat_id})")
@@ -142,59 +290,179 @@ async def store_channel_message(update: Update):
     except Exception as e:
         logging.error(f"❌ خطأ في تخزين رسالة القناة: {e}")
 
+# دالة لاستيراد عدة أسئلة في معاملة واحدة، ثم تحديث فهرس التشابه بالأسئلة المتغيرة فقط
+async def import_faq(rows, update_existing=True):
+    inserted, updated, skipped = await storage.write(import_rows, rows, update_existing)
+
+    def update_index():
+        similarity_index.remove_many([faq_id for faq_id, _, _ in updated])
+        similarity_index.add_many(inserted + updated)
+
+    # حساب n-gram لآلاف الأسئلة لا يجب أن يحجب حلقة الأحداث
+    await asyncio.get_running_loop().run_in_executor(None, update_index)
+    similarity_index.version = (await faq_cache.refresh_async()).version
+    logging.info(f"✅ تم استيراد الأسئلة: {len(inserted)} جديد، {len(updated)} محدث، {skipped} متخطى.")
+    return len(inserted), len(updated), skipped
+
 # دالة لحذف استفسار برقمه
-def delete_faq(faq_id):
+async def delete_faq(faq_id):
     try:
-        cur.execute("DELETE FROM faq WHERE id = ?", (faq_id,))
-        conn.commit()
+        deleted = await storage.write(lambda conn: conn.execute("DELETE FROM faq WHERE id = ?", (faq_id,)).rowcount > 0)
+        if deleted:
+            similarity_index.remove(faq_id)
+            similarity_index.version = (await faq_cache.refresh_async()).version
         logging.info(f"✅ تم حذف الاستفسار برقم: {faq_id}")
-        return cur.rowcount > 0  # True إذا تم الحذف بنجاح
+        return deleted  # True إذا تم الحذف بنجاح
     except Exception as e:
         logging.error(f"❌ خطأ في حذف الاستفسار: {e}")
         return False
 
-# دالة للحصول على جميع الأسئلة والأجوبة
+# دالة للحصول على جميع الأسئلة والأجوبة (من النسخة المحفوظة في الذاكرة)
 def get_faq_data():
         try:
-            cur.execute("SELECT question, answer FROM faq")
-            faq_entries = cur.fetchall()  # تعديل التسمية من `data` إلى `faq_entries`
-            logging.info(f"✅ تم استخراج {len(faq_entries)} سؤالًا من قاعدة البيانات.")
-
-            cur.execute("SELECT text FROM channel_messages")
-            channel_entries = [(text, "معلومة من القناة") for (text,) in cur.fetchall()]
-
-            return faq_entries + channel_entries  # ✅ الآن `faq_entries` معرف
+            return faq_cache.get().entries
         except Exception as e:
             logging.error(f"❌ خطأ في جلب بيانات الأسئلة: {e}")
             return []
 
+# دالة لاسترجاع أفضل المداخل المرتبطة برسالة المستخدم فقط
+async def get_relevant_faq(message, k=FAQ_TOP_K):
+    if not FTS_AVAILABLE:
+        return get_faq_data()[:k]
+    try:
+        return await faq_cache.search(message, k, search_knowledge)
+    except Exception as e:
+        logging.error(f"❌ خطأ في البحث في الفهرس النصي: {e}")
+        return []
+
+
+# دالة للرد المباشر من جواب مخزن عندما يطابق السؤال سؤالًا موجودًا (دون Gemini)
+async def reply_direct_answer(update, message):
+    try:
+        similarity_index.sync(storage, faq_cache.get().version)
+        with timed("direct_answer"):
+            match = similarity_index.match(message)
+    except Exception as e:
+        logging.error(f"❌ خطأ في البحث في فهرس التشابه: {e}")
+        return False
+    if match is None:
+        return False
+    answer, score = match
+    INTENTS.inc(intent="1", source="direct")
+    logging.info(f"⚡ [LOG] - رد مباشر من الأسئلة المخزنة (التشابه {score:.2f}).")
+    outbound.reply(update.message, answer, parse_mode='Markdown')
+    return True
+
 
-# دالة لإنشاء رد من Gemini
-def generate_gemini_response(prompt):
+# دالة للبحث في ذاكرة الردود: (الرد المخزن أو None، جيل البيانات لتخزين الرد الجديد)
+async def get_cached_response(cache_key):
+    if not cache_key:
+        return None, None
     try:
-        response = model.generate_content(prompt)
-        if response.text:
+        version = faq_cache.get().version
+        cached = await response_cache.get(*cache_key, version)
+        if cached:
+            logging.info(f"⚡ تم استخدام رد مخزن للنية {cache_key[1]}.")
+        return cached, version
+    except Exception as e:
+        logging.error(f"❌ خطأ في قراءة ذاكرة الردود: {e}")
+        return None, None
+
+
+# دالة لإنشاء رد من Gemini (تعمل خارج حلقة الأحداث عبر GeminiClient)
+# cache_key = (الرسالة، النية): يُبحث عنه في ذاكرة الردود قبل الاتصال بـ Gemini ويُخزن الرد الناجح فيها
+async def generate_gemini_response(prompt, cache_key=None, stage="answer", hedge_after=None):
+    cached, version = await get_cached_response(cache_key)
+    if cached:
+        return cached
+    return await request_gemini(prompt, stage, cache_key, version, hedge_after)
+
+# دالة لطلب رد جديد من Gemini وتخزينه؛ الأخطاء تتحول إلى رسائل مناسبة للطالب (دون تفاصيل الخطأ)
+async def request_gemini(prompt, stage="answer", cache_key=None, version=None, hedge_after=None):
+    try:
+        with timed(stage):
+            text = await llm_client.generate(prompt, hedge_after=hedge_after)
+        if text:
             logging.info("✅ تم استقبال رد من Gemini بنجاح!")
-            return response.text
+            if cache_key and version is not None:
+                try:
+                    response_cache.put(*cache_key, version, text)
+                except Exception as e:
+                    logging.error(f"❌ خطأ في تخزين الرد: {e}")
+            return text
         else:
             logging.error("❌ لم يتم استقبال نص من Gemini.")
-            return "عذرًا، لم أتمكن من معالجة سؤالك. يرجى المحاولة لاحقًا."
+            return FALLBACK_REPLY
+    except CircuitOpenError:
+        logging.warning("⚠️ دائرة Gemini مفتوحة، لم يُرسل الطلب.")
+        return UNAVAILABLE_REPLY
+    except SchedulerBusyError as e:
+        logging.warning(f"⚠️ طابور Gemini مزدحم، سقط الطلب ({e.reason}).")
+        return BUSY_REPLY
+    except asyncio.TimeoutError:
+        logging.error(f"❌ انتهت مهلة طلب Gemini ({llm_client.timeout} ثانية).")
+        return TIMEOUT_REPLY
     except Exception as e:
         logging.error(f"❌ خطأ في generate_gemini_response: {e}")
-        return f"عذرًا، حدث خطأ أثناء معالجة سؤالك: {str(e)}"
-
-# تهيئة المتغيرات العامة
-user_message_count = {}  # لتتبع عدد الرسائل لكل مستخدم
-last_reset_date = datetime.now(pytz.timezone('Africa/Khartoum')).date()  # تاريخ آخر إعادة تعيين
+        return FALLBACK_REPLY
+
+# وضع الأسئلة الشائعة فقط: عندما تكون دائرة Gemini مفتوحة نرد من أقرب سؤال مخزن بدل طلب محكوم عليه بالفشل
+async def reply_from_faq_only(update, use_faq=True):
+    matches = []
+    if use_faq:
+        matches = [(q, a) for q, a in await get_relevant_faq(update.message.text, k=1) if a != CHANNEL_ANSWER]
+    if not matches:
+        outbound.reply(update.message, UNAVAILABLE_REPLY)
+        return
+    question, answer = matches[0]
+    INTENTS.inc(intent="1", source="degraded")
+    logging.warning("⚠️ [LOG] - رد من الأسئلة الشائعة فقط (Gemini غير متاح).")
+    outbound.reply(update.message, f"{DEGRADED_NOTICE}\n\n❓ {question}\n{answer}", parse_mode='Markdown')
+
+# دالة للرد على الطالب برد Gemini: متدفقًا عند تفعيل STREAM_REPLIES (يظهر أول جزء فور وصوله)، وإلا دفعة واحدة
+# faq_fallback: الرد من الأسئلة الشائعة إذا كان Gemini غير متاح (لا معنى له لتصحيح نص أو مراجعة موضوع)
+async def reply_with_gemini(update, prompt, cache_key=None, stage="answer", faq_fallback=True):
+    cached, version = await get_cached_response(cache_key)
+    if cached:
+        outbound.reply(update.message, cached, parse_mode='Markdown')
+        return
+    if not llm_client.available():
+        await reply_from_faq_only(update, use_faq=faq_fallback)
+        return
+    if not STREAM_REPLIES:
+        response = await request_gemini(prompt, stage, cache_key, version)
+        outbound.reply(update.message, response, parse_mode='Markdown')
+        return
+    with timed(stage):
+        text = await stream_reply(update.message, llm_client.stream(prompt),
+                                  error_reply=FALLBACK_REPLY, timeout_reply=TIMEOUT_REPLY, busy_reply=BUSY_REPLY)
+    if text and cache_key and version is not None:
+        try:
+            response_cache.put(*cache_key, version, text)
+        except Exception as e:
+            logging.error(f"❌ خطأ في تخزين الرد: {e}")
 
-# دالة لإعادة تعيين عدد الرسائل يوميًا
-def reset_message_count():
-    global user_message_count, last_reset_date
-    today = datetime.now(pytz.timezone('Africa/Khartoum')).date()
-    if today > last_reset_date:
-        user_message_count = {}  # إعادة تعيين عدد الرسائل
-        last_reset_date = today  # تحديث تاريخ آخر إعادة تعيين
-        logging.info("✅ تم إعادة تعيين عدد الرسائل للمستخدمين.")
+# دالة لطلب النية والرد معًا في طلب واحد بصيغة JSON (None يعني الرجوع إلى مسار الطلبين)
+# SchedulerBusyError يمر إلى المستدعي: لا معنى لطلب ثانٍ بعد أن سقط الأول من طابور مزدحم
+async def generate_structured_reply(message, user_name):
+    prompt = build_prompt("structured", message, await get_relevant_faq(message), user_name=user_name)
+    try:
+        with timed("structured"):
+            text = await llm_client.generate(prompt, generation_config=STRUCTURED_GENERATION_CONFIG)
+    except CircuitOpenError:
+        return None
+    except SchedulerBusyError:
+        raise
+    except asyncio.TimeoutError:
+        logging.error(f"❌ انتهت مهلة الطلب المنظم ({llm_client.timeout} ثانية).")
+        return None
+    except Exception as e:
+        logging.error(f"❌ خطأ في generate_structured_reply: {e}")
+        return None
+    result = parse_structured_reply(text)
+    if result is None:
+        logging.warning("⚠️ الرد المنظم لا يطابق المخطط، سيتم استخدام مسار الطلبين.")
+    return result
 
 # ساعات عمل البوت (بتوقيت السودان)
 WORKING_HOURS_START = 6  # 8 صباحًا
@@ -202,20 +470,24 @@ WORKING_HOURS_END = 24   # 12 صباحًا
 
 # دالة للتحقق من ساعات العمل
 def is_within_working_hours():
+    import pytz  # مكتبة pytz لضبط التوقيت (تُستورد عند أول استخدام)
     now = datetime.now(pytz.timezone('Africa/Khartoum'))
     logging.info(f"الوقت الحالي (بتوقيت السودان): {now.hour}:{now.minute}")
     return WORKING_HOURS_START <= now.hour < WORKING_HOURS_END
 
 # دالة لمعالجة الرسائل
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    started = time.perf_counter()
+    intent = None
     try:
         if not update.message:
-            print("⚠️ [LOG] - لا توجد رسالة في التحديث. قد يكون السبب أنه تحديث غير نصي.")
+            logging.debug("⚠️ [LOG] - لا توجد رسالة في التحديث. قد يكون السبب أنه تحديث غير نصي.")
             return
         user_id = update.message.from_user.id
         chat_id = update.message.chat_id
         message = update.message.text
-        print(f"🔍 [LOG] - استلمنا رسالة من المستخدم {user_id} في المجموعة {chat_id}: {message}")
+        UPDATES.inc(chat="private" if chat_id == user_id else "group" if chat_id == ALLOWED_GROUP_ID else "other")
+        logging.debug(f"🔍 [LOG] - استلمنا رسالة من المستخدم {user_id} في المجموعة {chat_id}: {message}")
 
         logging.info(f"تم استقبال رسالة من المستخدم: {user_id} في الدردشة: {chat_id}")
 
@@ -236,378 +508,389 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                             answer = parts[1].strip()
                             category = parts[2].strip()
 
-                            if add_faq(question, answer, category):
-                                await update.message.reply_text("✅ تم إضافة الاستفسار بنجاح!")
+                            if await add_faq(question, answer, category):
+                                outbound.reply(update.message, "✅ تم إضافة الاستفسار بنجاح!")
                             else:
-                                await update.message.reply_text("❌ فشل في إضافة الاستفسار.")
+                                outbound.reply(update.message, "❌ فشل في إضافة الاستفسار.")
                         else:
-                            await update.message.reply_text("❌ صيغة غير صحيحة. استخدم: /addfaq سؤال | جواب | فئة")
+                            outbound.reply(update.message, "❌ صيغة غير صحيحة. استخدم: /addfaq سؤال | جواب | فئة")
                     except Exception as e:
                         logging.error(f"خطأ في إضافة الاستفسار: {e}")
-                        await update.message.reply_text("❌ حدث خطأ أثناء الإضافة.")
+                        outbound.reply(update.message, "❌ حدث خطأ أثناء الإضافة.")
 
                 # معالجة أمر الحذف
                 elif message.startswith("/deletefaq"):
                     try:
                         faq_id = message.replace("/deletefaq", "").strip()
                         if faq_id.isdigit():
-                            if delete_faq(int(faq_id)):
-                                await update.message.reply_text(f"✅ تم حذف الاستفسار رقم {faq_id}.")
+                            if await delete_faq(int(faq_id)):
+                                outbound.reply(update.message, f"✅ تم حذف الاستفسار رقم {faq_id}.")
                             else:
-                                await update.message.reply_text(f"❌ لا يوجد استفسار بالرقم {faq_id}.")
+                                outbound.reply(update.message, f"❌ لا يوجد استفسار بالرقم {faq_id}.")
                         else:
-                            await update.message.reply_text("❌ الرقم غير صالح. مثال: /deletefaq 1")
+                            outbound.reply(update.message, "❌ الرقم غير صالح. مثال: /deletefaq 1")
                     except Exception as e:
                         logging.error(f"خطأ في حذف الاستفسار: {e}")
-                        await update.message.reply_text("❌ حدث خطأ أثناء الحذف.")
+                        outbound.reply(update.message, "❌ حدث خطأ أثناء الحذف.")
 
                 # إذا كانت رسالة عادية من المشرف
                 else:
                     # يمكنك إرسال أي رسالة في الخاص وسيقوم البوت بالرد عليها
-                    faq_data = get_faq_data()
-                    prompt = "أنت معلم لغة إنجليزية محترف. لديك قاعدة بيانات تحتوي على الأسئلة والأجوبة التالية:\n\n"
-                    for q, a in faq_data:
-                        prompt += f"س: {q}\nج: {a}\n\n"
-                        prompt += f"استفسار المستخدم: {message}\n\n"
-                        prompt += ("أجب على استفسار المستخدم استنادًا إلى قاعدة البيانات إذا كان مرتبطًا بها. "
-                        "في حال عدم العثور على إجابة مباشرة، قدّم ردًا عامًا بأسلوب أستاذ لغة إنجليزية محترف، مع الحرص على الوضوح والإيجاز. "
-                        "اجعل الرد جذابًا بصريًا باستخدام الإيموجي عند الحاجة، دون مبالغة. "
-                        "لتجنب الإزعاج، لا تُضمّن جملة تحفيزية أو طلب تقييم إلا إذا كان ذلك مناسبًا في سياق الرد. "
-                        "إذا سُئلت عن اسمك، أجب باختصار بأنك QueriesShot، بوت متخصص في الإجابة عن الأسئلة الشائعة في تعلم اللغة الإنجليزية. و أجب بنفس لغة رسالة الإستفسار"
-)
+                    with timed("rate_limit"):
+                        allowed = await rate_limiter.allow("admin", user_id)
+                    if not allowed:
+                        outbound.reply(update.message, "عذرًا، لقد تجاوزت الحد المسموح به من الرسائل اليومية.")
+                        return
+                    prompt = build_prompt("private", message, await get_relevant_faq(message))
 
-                    response = generate_gemini_response(prompt)
-                    await update.message.reply_text(response, parse_mode='Markdown')
+                    with llm_priority(PRIORITY_ADMIN):
+                        await reply_with_gemini(update, prompt, cache_key=(message, "admin"))
 
             # إذا كان المستخدم عاديًا في الخاص
             else:
                 # التحقق من ساعات العمل
                 if not is_within_working_hours():
-                    await update.message.reply_text(
+                    outbound.reply(update.message,
                         "*عذرًا، البوت يعمل فقط من الساعة 8 صباحًا حتى 7 مساءً بتوقيت السودان*.\n"
                         "*Sorry, the bot operates only from 8 AM to 7 PM Sudan time.*", parse_mode='Markdown', disable_web_page_preview=True)
                     return  # تجاهل الرسالة خارج ساعات العمل
 
-                reset_message_count()
-
-                if user_id not in user_message_count:
-                    user_message_count[user_id] = 0
-
-                if user_message_count[user_id] >= 10:
-                    await update.message.reply_text("عذرًا، لقد تجاوزت الحد المسموح به من الرسائل اليومية.")
+                with timed("rate_limit"):
+                    allowed = await rate_limiter.allow("private", user_id)
+                if not allowed:
+                    outbound.reply(update.message, "عذرًا، لقد تجاوزت الحد المسموح به من الرسائل اليومية.")
                     return
 
-                user_message_count[user_id] += 1
-
-                faq_data = get_faq_data()
-                prompt = "أنت معلم لغة إنجليزية محترف. لديك قاعدة بيانات تحتوي على الأسئلة والأجوبة التالية:\n\n"
-                for q, a in faq_data:
-                    prompt += f"س: {q}\nج: {a}\n\n"
-                    prompt += f"استفسار المستخدم: {message}\n\n"
-                    prompt += ("أجب على استفسار المستخدم استنادًا إلى قاعدة البيانات إذا كان مرتبطًا بها. "
-                    "في حال عدم العثور على إجابة مباشرة، قدّم ردًا عامًا بأسلوب أستاذ لغة إنجليزية محترف، مع الحرص على الوضوح والإيجاز. "
-                    "اجعل الرد جذابًا بصريًا باستخدام الإيموجي عند الحاجة، دون مبالغة. "
-                    "لتجنب الإزعاج، لا تُضمّن جملة تحفيزية أو طلب تقييم إلا إذا كان ذلك مناسبًا في سياق الرد. و أجب بنفس لغة رسالة الإستفسار ")
+                if await reply_direct_answer(update, message):
+                    return
 
-                # إذا كانت رسالة عادية من المشرف
-                else:
-                # يمكنك إرسال أي رسالة في الخاص وسيقوم البوت بالرد عليها
-                    faq_data = get_faq_data()
-                prompt = "أنت معلم لغة إنجليزية محترف. لديك قاعدة بيانات تحتوي على الأسئلة والأجوبة التالية:\n\n"
-                for q, a in faq_data:
-                    prompt += f"س: {q}\nج: {a}\n\n"
-                prompt += f"استفسار المستخدم: {message}\n\n"
-                prompt += ("أجب على استفسار المستخدم استنادًا إلى قاعدة البيانات إذا كان مرتبطًا بها. "
-                "في حال عدم العثور على إجابة مباشرة، قدّم ردًا عامًا بأسلوب أستاذ لغة إنجليزية محترف، مع الحرص على الوضوح والإيجاز. "
-                "اجعل الرد جذابًا بصريًا باستخدام الإيموجي عند الحاجة، دون مبالغة. "
-                "لتجنب الإزعاج، لا تُضمّن جملة تحفيزية أو طلب تقييم إلا إذا كان ذلك مناسبًا في سياق الرد. "
-                "إذا سُئلت عن اسمك، أجب باختصار بأنك QueriesShot، بوت متخصص في الإجابة عن الأسئلة الشائعة في تعلم اللغة الإنجليزية.")
-
-                response = generate_gemini_response(prompt)
-                await update.message.reply_text(response, parse_mode='Markdown')
+                prompt = build_prompt("private", message, await get_relevant_faq(message))
+                with llm_priority(PRIORITY_PRIVATE):
+                    await reply_with_gemini(update, prompt, cache_key=(message, "private"))
 
         # إذا كانت الرسالة في المجموعة
         elif chat_id == ALLOWED_GROUP_ID:
             if 'sender_chat' in message:
                 return  # تجاهل الرسائل المرسلة باسم القناة أو المجموعة
+            # المرشح المحلي: كلمات وروابط محظورة ورسائل مكررة أو متلاحقة، دون طلب إلى Gemini (وخارج ساعات العمل أيضًا)
+            if user_id != ADMIN_USER_ID:
+                with timed("moderation"):
+                    verdict = moderator.check(chat_id, user_id, update.message.message_id, message)
+                if verdict:
+                    intent = "4"
+                    INTENTS.inc(intent=intent, source="moderation")
+                    logging.info(f"🚨 [LOG] - المرشح المحلي: {verdict.reason} {verdict.pattern or ''}")
+                    await handle_violation(update, context, chat_id, user_id, notify=verdict.notify,
+                                           earlier_message_ids=verdict.earlier_message_ids)
+                    return
         # تطبيق القيود المطبقة في المجموعة
             if not is_within_working_hours():
                 return  # تجاهل الرسالة خارج ساعات العمل
 
-            reset_message_count()
-
-            if user_id not in user_message_count:
-                user_message_count[user_id] = 0
-
-            if user_message_count[user_id] >= 10:
+            with timed("rate_limit"):
+                allowed = await rate_limiter.allow("group", user_id)
+            if not allowed:
                 return
 
-            user_message_count[user_id] += 1
-
-                # تحقق من نية الرسالة أولاً
-            intent_prompt = f"""حدد نية الرسالة التالية من الخيارات التالية فقط:
-                1. إستفسار أو أي مسألة تتعلق بالقناة أو أي طلب مساعدة ذو علاقة بالتعلم
-                2. قطعة إنشائية مكتوبة باللغة الإنجليزية، سواء قصيرة أو طويلة، تتحدث عن موضوع معين بشكل مترابط (مثل: My day, My favorite food, A trip I took). يجب أن تحتوي على جمل مترابطة، وليست مجرد كلمات أو جملة واحدة.
-                3. خطأ إملائي أو غرامري في اللغة الإنجليزية
-                4. مخالفة، سلوك غير لائق أو ترويج ومضايقة أو كلمات بذيئة أو رسائل spam 
-                5. أخرى (غير ذات صلة) أي خارج سياق القناة وهي قناة تعلم الإنجليزية
-                6. سؤال مباشر عن معنى كلمة أو عبارة باللغة الإنجليزية أو مثل شائع
-
-                الرسالة: "{message}"
-
-                الرد يجب أن يكون رقمًا فقط بين 1 و6."""
-                
-            intent = generate_gemini_response(intent_prompt).strip()
-            intent = str(int(intent))
-            logging.info(f"🔍 [LOG] - النية المستلمة من Gemini: {intent}")
-            print(f"🔍 [LOG] - النية المستلمة من Gemini: {intent}")  # طباعة في الكونسول
-
+            if await reply_direct_answer(update, message):
+                return
 
-        # معالجة حسب النية
-            prompt = ""
+            # المصنف المحلي يحسم الحالات الواضحة دون الاتصال بـ Gemini
+            structured = None
+            with timed("local_intent"):
+                local_intent = intent_classifier.classify(message)
+            if local_intent:
+                intent = local_intent[0]
+                INTENTS.inc(intent=intent, source="local")
+                logging.info(f"⚡ [LOG] - النية من المصنف المحلي: {intent} (الثقة {local_intent[1]:.2f})")
+            else:
+                version = faq_cache.get().version
+                cached_intent = await response_cache.get(message, "intent", version)
+                if not cached_intent and not llm_client.available():
+                    # الأسئلة الواضحة أُجيبت محليًا أعلاه؛ لا نرسل طلبًا محكومًا عليه بالفشل من أجل باقي الرسائل
+                    logging.warning("⚠️ [LOG] - Gemini غير متاح، تم تجاهل رسالة المجموعة.")
+                    return
+                # طلب واحد للنية والرد معًا، إلا إذا كانت النية مخزنة مسبقًا (فقد يكون الرد مخزنًا أيضًا)
+                # التصنيف الساقط من طابور مزدحم يُتجاهل دون رد انشغال، حتى لا تُغرق المجموعة برسائله أثناء الموجة
+                # تصنيف رسائل المجموعة يكشف المخالفات، فيسبق ردود المجموعة في طابور Gemini
+                if GROUP_STRUCTURED_MODE and not cached_intent:
+                    try:
+                        with llm_priority(PRIORITY_MODERATION):
+                            structured = await generate_structured_reply(message, get_user_name(update))
+                    except SchedulerBusyError:
+                        logging.warning("⚠️ [LOG] - طابور Gemini مزدحم، تم تجاهل رسالة المجموعة.")
+                        return
+                if structured:
+                    intent = structured["intent"]
+                    INTENTS.inc(intent=intent, source="structured")
+                    response_cache.put(message, "intent", version, intent)
+                    if intent == "1":
+                        response_cache.put(message, intent, version, structured["answer"])
+                else:
+                    # الذاكرة فُحصت أعلاه: الطلب مباشرة إلى Gemini حتى لا يُحسب عدم الوجود مرتين
+                    with llm_priority(PRIORITY_MODERATION):
+                        raw_intent = cached_intent or await request_gemini(build_prompt("intent", message), "intent", (message, "intent"), version, GEMINI_HEDGE_DELAY)
+                    if raw_intent == BUSY_REPLY:
+                        logging.warning("⚠️ [LOG] - طابور Gemini مزدحم، تم تجاهل رسالة المجموعة.")
+                        return
+                    intent = parse_intent(raw_intent)
+                    if intent is None:
+                        logging.warning("⚠️ [LOG] - لم يتم التعرف على النية من رد Gemini.")
+                        return
+                    INTENTS.inc(intent=intent, source="cache" if cached_intent else "gemini")
+                if not cached_intent:
+                    intent_classifier.record(message, intent)
+                logging.info(f"🔍 [LOG] - النية المستلمة من Gemini: {intent}")
+
+
+        # معالجة حسب النية (ردود المجموعة بأولوية PRIORITY_GROUP الافتراضية)
             if intent == "1":  # استفسار عام
-                faq_data = get_faq_data()
-                prompt = "أنت معلم لغة إنجليزية محترف. لديك قاعدة بيانات تحتوي على الأسئلة والأجوبة التالية:\n\n"
-                for q, a in faq_data:
-                    prompt += f"س: {q}\nج: {a}\n\n"
-                prompt += f' أجب على استفسار المستخدم استنادًا إلى قاعدة البيانات إذا كان مرتبطًا بها. يجب أن يكون الرد بنفس لغة الاستفسار. الرسالة الأصلية = "{message}"'
-                    
-                
-                response = generate_gemini_response(prompt)
-                await update.message.reply_text(response, parse_mode='Markdown')
+                if structured:
+                    outbound.reply(update.message, structured["answer"], parse_mode='Markdown')
+                else:
+                    prompt = build_prompt("faq", message, await get_relevant_faq(message))
+                    await reply_with_gemini(update, prompt, cache_key=(message, intent))
             elif intent == "2":  # دراسة باللغة الإنجليزية
-                recent_messages = get_recent_channel_messages()
-                if recent_messages:
-                    prompt += "🔹 إليك بعض الدروس الحديثة من القناة:\n"
-                for msg in recent_messages:
-                    prompt += f"📌 {msg}\n"
-                user_name = get_user_name(update)
-                prompt = f"""
-أنت مدرس لغة إنجليزية محترف، ومهمتك هي مساعدة الطالب {user_name} على الانتقال من التفكير الحرفي إلى التفكير بأسلوب أمريكي طبيعي.
-
-قبل أن تبدأ، اتبع هذا المبدأ الأساسي:
-
-✅ إذا كانت الجمل طبيعية، مفهومة، وبنية النص واضحة وسلسة — حتى لو كانت بسيطة — فلا تُجري أي تصحيحات. اكتفِ برسالة تشجيعية فقط، ولا تحاول تحسين شيء لا يحتاج إلى تحسين.
-
-❌ لا تُدخل تغييرات من أجل التحسين الشكلي أو الأسلوبي فقط، ولا تتعامل مع كل نص وكأنه بحاجة لصقل لغوي احترافي.
-
-هدفنا هو تحسين التفكير الطبيعي، لا الوصول للكمال اللغوي.
-
-ثم تابع تقييمك باستخدام أحد الخيارين التاليين فقط:
-
- اتبع دائمًا هذا النسق الثابت في حالة اجراء التصحيحات 🔶:
-
----
-مرحباً {user_name}، عملك ممتاز واللغة سليمة!  
-لكن إليك بعض التعديلات البسيطة لتجعل أسلوبك أقرب لطريقة التفكير الأمريكية:
-
-🔧 Quick Tweaks:  
-بدلاً من:  
-🔹 "X"  
-جرب:  
-✅ "Y"  (أكثر طبيعية)
-
-🔹 "Z"  
-✅ "W"  (شائعة في الحديث اليومي)
-
-✨ نصيحة: لا تحفظ فقط، حاول *تفكر بالإنجليزية* وتستخدم تعبيرات أهل اللغة.
-
-Keep it up — you're really getting the feel of the language
-
-
- **إذا كانت القطعة فصيحة بما فيه الكفاية ولا تحتاج تعديل**، استخدم الرد التالي بالإنجليزية  🔶 :
-
-
-أحسنت يا {user_name}!  
-القطعة ممتازة وطبيعية تمامًا — وكأنها كُتبت من قبل متحدث أصلي.  
-
-✨ نصيحة: استمر في هذا الأسلوب، واضح أنك لا تترجم حرفيًا بل *تفكر بالإنجليزية*، وهذا هو المطلوب.
-
-استمر!
----
-
-**تعليمات إضافية:**
-- لا تشرح التعديلات بالتفصيل.
-- لا تُعِد كتابة النص كاملاً بعد التعديل.
-- اذكر فقط الكلمات أو التعابير التي تحتاج تحسين.
-- استخدم تعبيرات شائعة في الإنجليزية الأمريكية، واذكر البريطانية فقط إن كان الفرق مهمًا.
-- اجعل الرد لا يتجاوز 10 أسطر.
-- الأسلوب يجب أن يكون لبقاً، مشجعاً، وطبيعيًا.
-- إذا كانت القطعة محترفة، اجعل الرد بالإنجليزية بالكامل.
-- الحكم على القطعة يجب أن يكون حقيقياً بناءً على مستواها.
-- يمكنك تعديل جمل المجاملة بما يناسب، مع الحفاظ على الطابع التحفيزي.
-- النصيحة الأخيرة يجب أن تذكّر الطالب بأن الهدف هو التعود على الأسلوب الأمريكي، لا فقط الحفظ.
-
-الرسالة الأصلية = "{message}"
-"""
-                
-            
-
-                response = generate_gemini_response(prompt)
-                await update.message.reply_text(response, parse_mode='Markdown')
+                prompt = build_prompt("composition", message, get_recent_channel_messages(),
+                                      user_name=get_user_name(update))
+                with llm_priority(PRIORITY_COMPOSITION):
+                    await reply_with_gemini(update, prompt, faq_fallback=False)
     
     
             elif intent == "3":  # تصحيح أخطاء
                 user_name = get_user_name(update)
-                prompt = f"""الرسالة تحتوي على أخطاء إملائية أو نحوية. و هي من الطالب {user_name} أذكر أسمه في البداية في كلمات قصيرة و برفق لتبدو الرسالة من استاذ الى تلميذ لينتبه إلى الرسالة  
-✅ قم بتصحيح الأخطاء أولاً، ثم قدّم شرحًا تعليمياً بسيطًا في رسالة قصيرة.  
-📌 استخدم إيموجي مناسب لتحسين وضوح التصحيح.  
-📄 نسّق الرسالة بفواصل وسطور لجعلها سهلة القراءة.  
-🎯 الهدف هو مساعدة المستخدم دون إزعاجه، لذا استخدم أسلوبًا لبقًا ومشجعًا في البداية.  
-✍️ مثال على التنسيق المطلوب:  
-
-🔹 *خطأ*: [الجملة الأصلية]  
-✅ *التصحيح*: [الجملة المصححة]
-💡 _لماذا_: [شرح قصير و مباشر]
-
-📌 اجعل الأسلوب وديًا واحترافيًا، وكأنك مدرس لطيف يساعد الطلاب دون إشعارهم بالحرج و لا تستخدم نص عريض باي شكل من الاشكال و باللغة الانجليزية. الرسالة الأصلية = "{message}" 
-
-أجب بأسلوب أستاذ لغة إنجليزية محترف، مع الحرص على الوضوح والإيجاز. 
-اجعل الرد جذابًا بصريًا باستخدام الإيموجي عند الحاجة، دون مبالغة. 
-لتجنب الإزعاج، لا تُضمّن جملة تحفيزية أو طلب تقييم إلا إذا كان ذلك مناسبًا في سياق الرد.
-اكتب كل الشرح بالعربية الا جزئية الخطأ كم هي. """
-
-                response = generate_gemini_response(prompt)
-                await update.message.reply_text(response, parse_mode='Markdown')
+                if structured:
+                    outbound.reply(update.message, structured["answer"], parse_mode='Markdown')
+                else:
+                    prompt = build_prompt("grammar", message, user_name=user_name)
+                    await reply_with_gemini(update, prompt, faq_fallback=False)
             elif intent.strip() == "4":  # يحذف كل الفراغات والأحرف الخفية
             # مخالفة أو سلوك غير لائق
                 logging.info("🚨 [LOG] - دخلنا في جزء المخالفات.")
-                print(f"قيمة intent: '{intent}'، نوعها: {type(intent)}، طولها: {len(intent)}")
-                logging.info(f"قيمة intent: '{intent}'، نوعها: {type(intent)}")
-
-                try:
-
-                    logging.info("🗑️ [LOG] - تم حذف الرسالة المخالفة بنجاح.")
-                    print("🗑️ [LOG] - تم حذف الرسالة المخالفة بنجاح.")
-
-                    warning_msg = ("⚠️ تم حذف الرسالة بسبب مخالفتها لقواعد المجموعة. "
-                           "نرحب بالأسئلة والمناقشات المتعلقة بتعلم اللغة الإنجليزية، "
-                           "ولكن نرفض السلوك غير اللائق أو المضايقة. يرجى مراجعة قواعد المجموعة.")
-
-                    sent_warning = await context.bot.send_message(
-                        chat_id=chat_id,
-                        text=warning_msg,
-                        reply_to_message_id=update.message.message_id
-                        )
-                    await update.message.delete()
-                    logging.info("⚠️ [LOG] - تم إرسال رسالة تحذيرية للمستخدم.")
-                    print("⚠️ [LOG] - تم إرسال رسالة تحذيرية للمستخدم.")
-
-            # حذف رسالة التحذير بعد 10 ثوانٍ
-                    await asyncio.sleep(10)
-                    await sent_warning.delete()
-                    logging.info("🗑️ [LOG] - تم حذف رسالة التحذير بعد 10 ثوانٍ.")
-                    print("🗑️ [LOG] - تم حذف رسالة التحذير بعد 10 ثوانٍ.")
-
-            # كتم العضو لمدة 10 دقائق إذا تكررت المخالفة
-                    if user_id in user_violations:
-                        user_violations[user_id] += 1
-                    else:
-                        user_violations[user_id] = 1
-
-                    logging.info(f"📊 [LOG] - عدد مخالفات المستخدم {user_id}: {user_violations[user_id]}")
-                    print(f"📊 [LOG] - عدد مخالفات المستخدم {user_id}: {user_violations[user_id]}")
-
-                    if user_violations[user_id] >= 3:  # بعد 3 مخالفات
-                        mute_duration = timedelta(minutes=10)
-                        mute_until = datetime.now() + mute_duration
-
-                        await context.bot.restrict_chat_member(
-                            chat_id=chat_id,
-                            user_id=user_id,
-                            until_date=mute_until,
-                            permissions=ChatPermissions(
-                                can_send_messages=False,
-                                can_send_media_messages=False,
-                                can_send_polls=False,
-                                can_send_other_messages=False,
-                                can_add_web_page_previews=False
-                                )
-                            )
-
-
-                    mute_notification = await context.bot.send_message(
-                        chat_id=chat_id,
-                        text=f"🔇 تم كتم العضو لمدة 10 دقائق بسبب تكرار المخالفات."
-                        )
-
-                    await asyncio.sleep(10)
-                    await mute_notification.delete()
-                    logging.info("🗑️ [LOG] - تم حذف رسالة إشعار الكتم.")
-                    print("🗑️ [LOG] - تم حذف رسالة إشعار الكتم.")
-
+                logging.debug(f"قيمة intent: '{intent}'، نوعها: {type(intent)}، طولها: {len(intent)}")
+                await handle_violation(update, context, chat_id, user_id)
 
-                except Exception as e:
-                    logging.error(f"❌ [LOG] - خطأ عام أثناء معالجة النية: {e}")
-                    print(f"❌ [LOG] - خطأ عام أثناء معالجة النية: {e}")
-            
-                logging.info(f"❓ [LOG] - النية غير معروفة: {intent}")
-                print(f"❓ [LOG] - النية غير معروفة: {intent}")
-                
             elif intent == "6":
-            # 1. استخرج المحتوى الخام من Gemini (بدون أي تنسيقات Markdown)
-                message = update.message.text
-                user_name = get_user_name(update)
+                await reply_vocabulary(update, message, structured)
 
-            # مثال prompt يبقيه بسيطًا: يرسل لك 5 أسطر: الكلمة، المعنى، الترجمة، المثال، والجملة الختامية.
-                prompt = f"""اكتب لي هذه المعلومات كل في سطر جديد فقط، بدون أي تنسيقات:
-1. الكلمة بالإنجليزي  
-2. المعنى بالإنجليزي  
-3. الترجمة بالعربي  
-4. مثال (بالإنجليزي)  
-5. جملة ختامية تحفيزية قصيرة بالإنجليزي  
-المستخدم: "{message}"
-"""
-                raw = generate_gemini_response(prompt)
-
-            # 2. افصل الأسطر الخمسة
-                parts = [line.strip() for line in raw.splitlines() if line.strip()]
-                if len(parts) < 5:
-                # لو الرد غير مكتمل، أرسِل خطأ احتياطي
-                    await update.message.reply_text(
-                        "عذرًا، لم أتمكَّن من فهم استجابة النموذج.",
-                        parse_mode='HTML'
-                    )
-                    return
 
-                word, meaning, arabic, example, closing = parts[:5]
+        # النية "5" أو أي قيمة أخرى يتم تجاهلها
 
-            # 3. ابنِ رسالة HTML مع تنسيقك الكامل
-                html = (
-        f"<b>Great pick, {user_name}!</b>\n"
-        f"📌 <i>{word}</i>\n"
-        f"🗣️ <b>Meaning:</b> {meaning}\n"
-        f"🪄 <b>بالعربي:</b> <tg-spoiler>{arabic}</tg-spoiler>\n"
-        f"✏️ <b>Example:</b> {example}\n\n"
-        f"{closing}"
-    )
+    except Exception as e:
+        ERRORS.inc(intent=intent or "none")
+        logging.error(f"❌ خطأ في معالجة الرسالة: {e}")
+        outbound.reply(update.message, "عذرًا، حدث خطأ أثناء معالجة سؤالك. يرجى المحاولة لاحقًا.")
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage="update")
+        report_first_update()
+
+
+
+# دالة للرد على سؤال معنى كلمة: من ذاكرة المفردات إن وُجدت، وإلا من Gemini (5 أسطر: الكلمة، المعنى، الترجمة، المثال، والجملة الختامية)
+async def reply_vocabulary(update, message, structured=None):
+    headword = extract_headword(message)
+    fields = structured["vocabulary"] if structured else None
+    cached = False
+    if fields is None and headword:
+        fields = await vocabulary_cache.get(headword)
+        cached = fields is not None
+    if fields is None:
+        if headword and vocabulary_cache.recently_failed(headword):
+            logging.info(f"⚡ [LOG] - تعذر تحليل رد الكلمة '{headword}' مؤخرًا، لن تُطلب من Gemini مجددًا.")
+        else:
+            raw = await generate_gemini_response(build_prompt("vocabulary", message), cache_key=(message, "6"))
+            if raw in (FALLBACK_REPLY, TIMEOUT_REPLY, UNAVAILABLE_REPLY, BUSY_REPLY):
+                # خطأ في الاتصال لا في الرد، فلا يُحسب فشل تحليل
+                outbound.reply(update.message, raw)
+                return
+            fields = parse_vocabulary(raw)
+            if fields is None and headword:
+                vocabulary_cache.mark_failed(headword)
+    if fields is None:
+        # لو الرد غير مكتمل، أرسِل خطأ احتياطي
+        outbound.reply(update.message, "عذرًا، لم أتمكَّن من فهم استجابة النموذج.", parse_mode='HTML')
+        return
+    if not cached:
+        vocabulary_cache.put(fields, headword)
+    outbound.reply(update.message, render_vocabulary(fields, get_user_name(update)), parse_mode='HTML')
 
-    # 4. أرسِلها مع HTML parsing
-                await update.message.reply_text(html, parse_mode='HTML')
+# تعبئة ذاكرة المفردات مسبقًا من قائمة كلمات (الأمر /vocab_prewarm والأداة vocab_cache.py)
+async def prewarm_vocabulary(words):
+    return await vocabulary_cache.prewarm(
+        words, lambda word: llm_client.generate(build_prompt("vocabulary", word)))
 
 
-        # النية "5" أو أي قيمة أخرى يتم تجاهلها
+# دالة لمعالجة المخالفة: حذف الرسالة مع تحذير، وكتم العضو بعد 3 مخالفات
+# notify=False لموجات السبام: حذف دون تحذير جديد في كل مرة
+async def handle_violation(update, context, chat_id, user_id, notify=True, earlier_message_ids=()):
+    try:
+        if notify:
+            warning_msg = ("⚠️ تم حذف الرسالة بسبب مخالفتها لقواعد المجموعة. "
+                           "نرحب بالأسئلة والمناقشات المتعلقة بتعلم اللغة الإنجليزية، "
+                           "ولكن نرفض السلوك غير اللائق أو المضايقة. يرجى مراجعة قواعد المجموعة.")
 
-    except Exception as e:
-        logging.error(f"❌ خطأ في معالجة الرسالة: {e}")
-        await update.message.reply_text("عذرًا، حدث خطأ أثناء معالجة سؤالك. يرجى المحاولة لاحقًا.")
+            # التحذير يسبق الحذف في طابور المحادثة، ويُحذف هو نفسه بعد 10 ثوانٍ
+            outbound.send_message(context.bot, chat_id, warning_msg, delete_after=NOTICE_DELETE_DELAY,
+                                  reply_to_message_id=update.message.message_id, allow_sending_without_reply=True)
+            logging.info("⚠️ [LOG] - تمت إضافة رسالة تحذيرية للمستخدم إلى طابور الإرسال.")
+        # الرسالة المخالفة والنسخ السابقة من نفس الرسالة المكررة تُحذف معًا في طلب واحد
+        outbound.delete(context.bot, chat_id, [update.message.message_id, *earlier_message_ids],
+                        priority=OUTBOUND_PRIORITY_MODERATION)
+
+        # كتم العضو لمدة 10 دقائق إذا تكررت المخالفة
+        violations = await rate_limiter.record("violation", user_id)
+
+        logging.info(f"📊 [LOG] - عدد مخالفات المستخدم {user_id}: {violations}")
+
+        if violations >= 3:  # بعد 3 مخالفات
+            mute_duration = timedelta(minutes=10)
+            mute_until = datetime.now() + mute_duration
+
+            outbound.send(chat_id, lambda: context.bot.restrict_chat_member(
+                chat_id=chat_id,
+                user_id=user_id,
+                until_date=mute_until,
+                permissions=ChatPermissions(
+                    can_send_messages=False,
+                    can_send_media_messages=False,
+                    can_send_polls=False,
+                    can_send_other_messages=False,
+                    can_add_web_page_previews=False
+                    )
+                ), priority=OUTBOUND_PRIORITY_MODERATION, kind="restrict", rate_limited=False)
 
+            outbound.send_message(context.bot, chat_id, f"🔇 تم كتم العضو لمدة 10 دقائق بسبب تكرار المخالفات.",
+                                  priority=OUTBOUND_PRIORITY_MODERATION, delete_after=NOTICE_DELETE_DELAY)
 
+    except Exception as e:
+        ERRORS.inc(intent="4")
+        logging.error(f"❌ [LOG] - خطأ عام أثناء معالجة النية: {e}")
 
 async def send_message(update: Update, text: str):
     """ دالة موحدة لإرسال الرسائل مع التحقق من وجود `message`. """
     if update.message:
-        await update.message.reply_text(text)
+        outbound.reply(update.message, text)
 
 async def is_admin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
     """ التحقق مما إذا كان المستخدم مشرفًا. """
-    return str(update.effective_user.id) in ADMIN_USER_ID
+    return update.effective_user.id == ADMIN_USER_ID
+
+async def cache_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """ عرض عدادات ذاكرة الردود للمشرف. """
+    if not await is_admin(update, context):
+        return
+    stats = response_cache.stats()
+    direct = similarity_index.stats()
+    vocabulary = vocabulary_cache.stats()
+    await send_message(
+        update,
+        f"📊 ذاكرة الردود:\n"
+        f"✅ مرات الاستخدام: {stats['hits']}\n"
+        f"❌ مرات عدم الوجود: {stats['misses']}\n"
+        f"📈 نسبة الاستخدام: {stats['hit_rate']:.1%}\n"
+        f"⚡ ردود مباشرة دون Gemini: {direct['direct_answers']} من {direct['queries']} ({direct['rate']:.1%})\n"
+        f"📚 ذاكرة المفردات: {vocabulary['entries']} كلمة، استخدام {vocabulary['hits']} من "
+        f"{vocabulary['hits'] + vocabulary['misses']} ({vocabulary['hit_rate']:.1%})، ردود غير مفهومة {vocabulary['parse_failures']}"
+    )
+
+async def intent_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """ عرض نسبة الرسائل التي حسم المصنف المحلي نيتها دون Gemini. """
+    if not await is_admin(update, context):
+        return
+    stats = intent_classifier.stats()
+    moderation = moderator.stats()
+    await send_message(
+        update,
+        f"📊 المصنف المحلي للنوايا:\n"
+        f"⚡ قرارات محلية: {stats['fast_path_hits']} من {stats['total']}\n"
+        f"📈 النسبة: {stats['hit_rate']:.1%}\n"
+        f"📚 أمثلة التدريب: {stats['samples']}\n"
+        f"🛡️ المرشح المحلي: {moderation['blocked']} مخالفة من {moderation['checked']} رسالة "
+        f"(كلمات وروابط {moderation['pattern']}، تكرار {moderation['duplicate']}، إغراق {moderation['flood']})"
+    )
+
+async def llm_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """ عرض حالة قاطع دائرة Gemini وعدد إعادة المحاولات للمشرف. """
+    if not await is_admin(update, context):
+        return
+    stats = llm_client.stats()
+    await send_message(
+        update,
+        f"📊 طلبات Gemini:\n"
+        f"⚡ حالة الدائرة: {stats['state']} (إخفاقات متتالية: {stats['consecutive_failures']})\n"
+        f"🚫 مرات الفتح: {stats['opens']}، طلبات مرفوضة: {stats['rejected']}\n"
+        f"🔁 إعادة المحاولات: {stats['retries']}، طلبات التحوط: {stats['hedges']}\n"
+        f"💰 رصيد إعادة المحاولة: {stats['budget']:.1f}\n"
+        f"⏳ طابور الأولويات: {stats['queue_depth']} منتظر، {stats['queue_admitted']} مقبول، "
+        f"ساقط {stats['queue_full'] + stats['queue_evicted'] + stats['queue_expired']} "
+        f"(امتلاء {stats['queue_full']}، طرد {stats['queue_evicted']}، انتهاء مهلة {stats['queue_expired']})"
+    )
+
+async def export_faq_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """ تصدير جدول الأسئلة كملف للمشرف: /export_faq csv أو /export_faq jsonl """
+    if not await is_admin(update, context):
+        return
+    fmt = context.args[0].lower() if context.args else "csv"
+    if fmt not in FORMATS:
+        await send_message(update, "❌ صيغة غير مدعومة. استخدم: /export_faq csv أو /export_faq jsonl")
+        return
+    path = os.path.join(tempfile.gettempdir(), f"faq_export_{uuid.uuid4().hex}.{fmt}")
+    try:
+        # الكتابة في ملف مؤقت دفعة بعد دفعة في خيط القراءة، دون تحميل الجدول كاملًا في الذاكرة
+        count = await storage.run(export_to_file, path, fmt)
+        with open(path, "rb") as f:
+            await update.message.reply_document(f, filename=f"faq.{fmt}", caption=f"✅ تم تصدير {count} سؤالًا.")
+    except Exception as e:
+        logging.error(f"❌ خطأ في تصدير الأسئلة: {e}")
+        await send_message(update, "❌ فشل تصدير الأسئلة.")
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+async def vocab_prewarm_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """ تعبئة ذاكرة المفردات للمشرف: /vocab_prewarm word1, word2, phrasal verb ... """
+    if not await is_admin(update, context):
+        return
+    words = [word.strip() for word in " ".join(context.args or []).split(",") if word.strip()]
+    if not words:
+        await send_message(update, "❌ استخدم: /vocab_prewarm word1, word2, ...")
+        return
+    await send_message(update, f"⌛ جاري تعبئة {len(words)} كلمة...")
+    try:
+        added, cached, failed = await prewarm_vocabulary(words)
+        await send_message(update, f"✅ تمت التعبئة: {added} جديدة، {cached} موجودة مسبقًا، {failed} فاشلة.")
+    except Exception as e:
+        logging.error(f"❌ خطأ في تعبئة المفردات: {e}")
+        await send_message(update, "❌ فشلت تعبئة المفردات.")
+
+async def import_faq_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """ استيراد ملف أسئلة (CSV أو JSONL) يرسله المشرف؛ كلمة skip في التعليق تبقي أجوبة الأسئلة الموجودة. """
+    if not await is_admin(update, context):
+        return
+    document = update.message.document
+    fmt = detect_format(document.file_name)
+    if fmt is None:
+        await send_message(update, "❌ يجب أن يكون الملف CSV (question,answer,category) أو JSONL.")
+        return
+    await send_message(update, "⌛ جاري استيراد الأسئلة...")
+    try:
+        data = await (await document.get_file()).download_as_bytearray()
+        rows = list(parse_rows(bytes(data), fmt))
+        inserted, updated, skipped = await import_faq(rows, update_existing="skip" not in (update.message.caption or ""))
+        await send_message(update, f"✅ تم الاستيراد: {inserted} جديد، {updated} محدث، {skipped} مكرر أو متخطى.")
+    except Exception as e:
+        logging.error(f"❌ خطأ في استيراد الأسئلة: {e}")
+        await send_message(update, "❌ فشل استيراد الملف.")
 
 async def reset_database(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """ دالة لإعادة تهيئة قاعدة البيانات بعد التأكيد. """
     if not await is_admin(update, context):
         await send_message(update, "⛔ هذا الأمر متاح للمشرفين فقط!")
         return
+    if SHARD_COUNT > 1:
+        # العمال الآخرون يبقون ملف قاعدة البيانات مفتوحًا، فلا يمكن حذفه من عامل واحد
+        await send_message(update, "⛔ إعادة التعيين غير متاحة في وضع العمال المتعددين، أوقف البوت واحذف الملف يدويًا.")
+        return
 
     confirmation_key = str(uuid.uuid4())[:8]
     context.user_data['db_confirmation'] = confirmation_key
@@ -637,15 +920,21 @@ async def confirm_reset(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         await send_message(update, "⌛ جاري حذف قاعدة البيانات...")
-        db_path = 'faq.db'
+        db_path = storage.path
 
         # حذف قاعدة البيانات إذا كانت موجودة
         if os.path.exists(db_path):
-            os.remove(db_path)
-            await asyncio.sleep(2)  # منح وقت للحذف
+            # إغلاق كل الاتصالات ثم حذف الملف مع ملفات WAL المرافقة
+            storage.close()
+            for path in (db_path, f"{db_path}-wal", f"{db_path}-shm"):
+                if os.path.exists(path):
+                    os.remove(path)
 
             # إعادة التهيئة
-            initialize_database()  
+            initialize_database()
+            channel_ring.hydrate()
+            snapshot = await faq_cache.refresh_async()
+            await storage.run(similarity_index.load, snapshot.version)
 
             await send_message(update, "✅ تم إعادة تعيين قاعدة البيانات بنجاح!")
         else:
@@ -655,24 +944,97 @@ async def confirm_reset(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logging.error(f"Database reset error: {e}")
         await send_message(update, "❌ فشل في إعادة تعيين قاعدة البيانات!")
 
+async def on_shutdown(application):
+    """ حفظ العدادات المعلقة وإنهاء الكتابات المؤجلة قبل الإيقاف. """
+    pending = rate_limiter.flush()
+    if pending is not None:
+        try:
+            await asyncio.wrap_future(pending)
+        except Exception as e:
+            logging.error(f"❌ خطأ في حفظ العدادات عند الإيقاف: {e}")
+    await drain_final_edits()
+    await outbound.close()
+    storage.shutdown()
+    if traffic_recorder is not None:
+        traffic_recorder.close()
+
+async def on_startup(application):
+    """ تقرير زمن البدء، ثم تهيئة Gemini في الخلفية حتى لا يدفع أول طالب كلفة استيراد المكتبة. """
+    ready = time.perf_counter() - _IMPORT_STARTED
+    STARTUP_SECONDS.set(ready, phase="ready")
+    logging.info(f"⏱️ زمن البدء: الاستيراد {IMPORT_SECONDS:.2f} ثانية، الجاهزية {ready:.2f} ثانية.")
+    llm_client.prewarm()
+
+
+# تسجيل الحركة الحقيقية لإعادة تشغيلها لاحقًا في اختبارات الأداء
+traffic_recorder = None
+
+
 # إنشاء البوت
-app = ApplicationBuilder().token(TOKEN).build()
-# إضافة المعالجات
-app.add_handler(MessageHandler(filters.TEXT, handle_message))  # تمت إزالة ~filters.COMMAND
-app.add_handler(CommandHandler("reset_db", reset_database))
-app.add_handler(CommandHandler("confirm_reset", confirm_reset))
+# معالجة متوازية للتحديثات مع الحفاظ على ترتيب رسائل كل مستخدم (MAX_CONCURRENT_UPDATES)
+def create_application():
+    """ بناء تطبيق البوت: تهيئة قاعدة البيانات والذاكرة ثم تسجيل المعالجات (من main() وأداة إعادة التشغيل). """
+    global traffic_recorder
+    if not TOKEN:
+        logging.error("❌ المتغير FAQBOT_TOKEN غير مضبوط.")
+    if not ALLOWED_GROUP_ID or not ADMIN_USER_ID:
+        logging.warning("⚠️ ALLOWED_GROUP_ID أو ADMIN_USER_ID غير مضبوط، لن يُعرف المشرف أو المجموعة.")
+    initialize_state()
+    application = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .request(ReplayRequest() if TRAFFIC_REPLAY else InstrumentedRequest(connection_pool_size=256))
+        .concurrent_updates(OrderedUpdateProcessor())
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
+    if TRAFFIC_RECORD_PATH:
+        traffic_recorder = TrafficRecorder(TRAFFIC_RECORD_PATH, ADMIN_USER_ID, ALLOWED_GROUP_ID, CHANNEL_ID)
+        llm_client.observer = traffic_recorder.record_llm
+        application.add_handler(TypeHandler(Update, traffic_recorder.record_update), group=-1)
+
+    # إضافة المعالجات
+    application.add_handler(MessageHandler(filters.UpdateType.CHANNEL_POST & filters.TEXT, store_channel_message))
+    application.add_handler(MessageHandler(filters.TEXT, handle_message))  # تمت إزالة ~filters.COMMAND
+    application.add_handler(CommandHandler("reset_db", reset_database))
+    application.add_handler(CommandHandler("confirm_reset", confirm_reset))
+    application.add_handler(CommandHandler("cache_stats", cache_stats))
+    application.add_handler(CommandHandler("intent_stats", intent_stats))
+    application.add_handler(CommandHandler("llm_stats", llm_stats))
+    application.add_handler(CommandHandler("export_faq", export_faq_command))
+    application.add_handler(CommandHandler("vocab_prewarm", vocab_prewarm_command))
+    application.add_handler(MessageHandler(filters.ChatType.PRIVATE & (filters.Document.FileExtension("csv")
+                                                                       | filters.Document.FileExtension("jsonl")),
+                                           import_faq_document))
+    return application
+
 
 # دالة رئيسية لتشغيل البوت
 
-PORT = int(os.environ.get("PORT", 10000))  # اجعل PORT متاحًا عالميًا
+PORT = env_int("PORT", 10000)  # اجعل PORT متاحًا عالميًا
 
 def run_flask():
-    app_flask.run(host="0.0.0.0", port=PORT)
+    create_flask_app().run(host="0.0.0.0", port=PORT)
 
 def main():
+    # وضع العمال المتعددين: هذه العملية تستقبل التحديثات فقط وتوزعها على SHARD_WORKERS عملية
+    if SHARD_WORKERS > 1:
+        logging.info(f"✅ تشغيل البوت بـ {SHARD_WORKERS} عمال...")
+        asyncio.run(run_front(SHARD_WORKERS, PORT, WEBHOOK_URL, TOKEN))
+        return
+    # وضع الويبهوك: خادم واحد للتحديثات وفحص الصحة بدل polling وخيط Flask
+    if WEBHOOK_URL:
+        logging.info("✅ تشغيل البوت بـ webhook...")
+        asyncio.run(run_webhook(create_application(), WEBHOOK_URL, PORT))
+        return
+    application = create_application()
     threading.Thread(target=run_flask).start()
     logging.info("✅ تشغيل البوت بـ polling...")
-    app.run_polling()
+    application.run_polling()
+
+IMPORT_SECONDS = time.perf_counter() - _IMPORT_STARTED
+STARTUP_SECONDS.set(IMPORT_SECONDS, phase="import")
 
 if __name__ == '__main__':
     main()
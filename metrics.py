@@ -0,0 +1,160 @@
+import time
+import threading
+from contextlib import contextmanager
+
+from telegram.request import HTTPXRequest
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# حدود الـ buckets بالثواني: من قراءة SQLite (أجزاء من الملي ثانية) إلى طلبات Gemini الطويلة
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_REGISTRY = []
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    """ عداد تراكمي بعناوين (labels). """
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name}_total {self.documentation}", f"# TYPE {self.name}_total counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}_total{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge:
+    """ قيمة حالية قابلة للارتفاع والانخفاض (مثل حالة قاطع الدائرة). """
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def set(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """ توزيع المدد في buckets ثابتة (تكفي لحساب p95/p99 في Prometheus عبر histogram_quantile). """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # المفتاح -> [عدادات الـ buckets، المجموع، العدد]
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.labelnames, key, [("le", repr(float(bound)))])
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key, [("le", "+Inf")])
+                lines.append(f"{self.name}_bucket{labels} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("faqbot_stage_seconds", "Time spent in each message-processing stage.", ("stage",))
+TELEGRAM_SECONDS = Histogram("faqbot_telegram_request_seconds", "Telegram Bot API request latency.", ("method",))
+UPDATES = Counter("faqbot_updates", "Updates received by chat type.", ("chat",))
+INTENTS = Counter("faqbot_intents", "Resolved intents by source.", ("intent", "source"))
+ERRORS = Counter("faqbot_errors", "Errors while handling a message, by intent.", ("intent",))
+LLM_CALLS = Counter("faqbot_llm_calls", "Gemini calls by final outcome.", ("outcome",))
+LLM_EXTRA_ATTEMPTS = Counter("faqbot_llm_extra_attempts", "Gemini retries and hedged requests.", ("kind",))
+LLM_BREAKER_STATE = Gauge("faqbot_llm_breaker_state", "Gemini circuit breaker: 0 closed, 1 half-open, 2 open.")
+OUTBOUND_ACTIONS = Counter("faqbot_outbound_actions", "Outbound Telegram actions by kind and outcome.", ("kind", "outcome"))
+SHARD_UPDATES = Counter("faqbot_shard_updates", "Updates routed by the webhook front, by worker.", ("shard", "outcome"))
+STARTUP_SECONDS = Gauge("faqbot_startup_seconds", "Seconds from process import to each startup phase.", ("phase",))
+LLM_QUEUE_DEPTH = Gauge("faqbot_llm_queue_depth", "Gemini requests waiting for a slot in the scheduler.")
+LLM_QUEUE_SECONDS = Histogram("faqbot_llm_queue_seconds", "Time Gemini requests wait in the scheduler, by priority.",
+                              ("priority",))
+LLM_SHED = Counter("faqbot_llm_shed", "Gemini requests dropped by the scheduler, by priority and reason.",
+                   ("priority", "reason"))
+OUTBOUND_PENDING = Gauge("faqbot_outbound_pending", "Outbound Telegram actions waiting in the queue.")
+
+
+def timed(stage):
+    """ قياس مدة مرحلة: with timed("rate_limit"): ... """
+    return STAGE_SECONDS.time(stage=stage)
+
+
+def render():
+    """ كل المقاييس بصيغة Prometheus النصية. """
+    lines = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """ HTTPXRequest يقيس مدة كل طلب إلى Telegram (sendMessage، deleteMessage، ...). """
+
+    async def do_request(self, url, method, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().do_request(url, method, *args, **kwargs)
+        finally:
+            TELEGRAM_SECONDS.observe(time.perf_counter() - started, method=url.rsplit("/", 1)[-1])
@@ -0,0 +1,204 @@
+import os
+import time
+import logging
+from collections import deque, namedtuple
+
+from retrieval import ARABIC_MARKS
+from response_cache import normalize_message
+from similarity_index import _LETTER_FOLDING
+
+
+# مرشح المخالفات المحلي: كلمات وروابط محظورة، ورسائل مكررة أو متلاحقة، دون أي طلب إلى Gemini
+MODERATION_PATTERNS_PATH = os.getenv("MODERATION_PATTERNS_PATH")  # ملف: نمط في كل سطر (# للتعليقات)
+MODERATION_EXTRA_PATTERNS = os.getenv("MODERATION_PATTERNS", "")  # أنماط إضافية مفصولة بفواصل
+DUPLICATE_WINDOW = float(os.getenv("DUPLICATE_WINDOW", 300))  # ثوانٍ تُتذكر فيها بصمات الرسائل
+DUPLICATE_THRESHOLD = int(os.getenv("DUPLICATE_THRESHOLD", 3))  # النسخة رقم كذا من نفس الرسالة تُعد سبامًا
+DUPLICATE_MIN_CHARS = int(os.getenv("DUPLICATE_MIN_CHARS", 20))  # الرسائل القصيرة (شكرًا، تمام) تتكرر طبيعيًا
+FLOOD_WINDOW = float(os.getenv("FLOOD_WINDOW", 10))
+FLOOD_MAX_MESSAGES = int(os.getenv("FLOOD_MAX_MESSAGES", 6))  # أكثر من هذا من نفس العضو خلال FLOOD_WINDOW
+FINGERPRINT_HISTORY = 500  # أقصى عدد بصمات محفوظة لكل محادثة
+
+# أنماط افتراضية: روابط الدعوات والاختصار الشائعة في السبام فقط. كلمات المواضيع (تداول، واجبات...) تختلف
+# من مجموعة إلى أخرى وقد تطابق أسئلة عادية، فتُحمّل من MODERATION_PATTERNS_PATH لا من هنا.
+# * في بداية النمط أو نهايته تلغي شرط حدود الكلمة في ذلك الطرف (لمطابقة جزء من كلمة).
+DEFAULT_PATTERNS = (
+    "t.me/joinchat", "t.me/+", "chat.whatsapp.com", "wa.me/", "bit.ly/", "tinyurl.com", "discord.gg/",
+)
+
+Verdict = namedtuple("Verdict", "reason pattern earlier_message_ids notify")
+
+
+def _prepare(text):
+    """ توحيد النص للمطابقة: أحرف صغيرة، بدون تشكيل، بهمزات موحدة، ومسافات مفردة (الروابط تبقى كما هي). """
+    text = ARABIC_MARKS.sub("", text or "").lower().translate(_LETTER_FOLDING)
+    return " ".join(text.split())
+
+
+def _is_word_char(char):
+    return char.isalnum() or char == "_"
+
+
+class AhoCorasick:
+    """ مطابقة عدة أنماط في مرور واحد على النص (آلة Aho-Corasick). """
+
+    def __init__(self, patterns=()):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]  # لكل حالة: (النمط، طوله، حدود الكلمة في البداية، في النهاية)
+        self.size = 0
+        for pattern in patterns:
+            self._insert(pattern)
+        self._build()
+
+    def _insert(self, pattern):
+        pattern = pattern.strip()
+        bounded_start = not pattern.startswith("*")
+        bounded_end = not pattern.endswith("*")
+        key = _prepare(pattern.strip("*"))
+        if not key:
+            return
+        state = 0
+        for char in key:
+            if char not in self._goto[state]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+                self._goto[state][char] = len(self._goto) - 1
+            state = self._goto[state][char]
+        self._output[state].append((key, len(key), bounded_start and _is_word_char(key[0]),
+                                    bounded_end and _is_word_char(key[-1])))
+        self.size += 1
+
+    def _build(self):
+        # روابط الفشل بالعرض: أطول لاحقة للحالة هي أيضًا بادئة نمط
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                if state:
+                    self._fail[child] = self._goto[fallback].get(char, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def search(self, text):
+        """ أول نمط يطابق النص الموحد (مع احترام حدود الكلمات)، أو None. """
+        text = _prepare(text)
+        state = 0
+        for end, char in enumerate(text, 1):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for pattern, length, bounded_start, bounded_end in self._output[state]:
+                start = end - length
+                if bounded_start and start > 0 and _is_word_char(text[start - 1]):
+                    continue
+                if bounded_end and end < len(text) and _is_word_char(text[end]):
+                    continue
+                return pattern
+        return None
+
+
+def load_patterns(path=MODERATION_PATTERNS_PATH, extra=MODERATION_EXTRA_PATTERNS):
+    patterns = list(DEFAULT_PATTERNS)
+    if path:
+        try:
+            with open(path, encoding="utf-8") as f:
+                patterns.extend(line.strip() for line in f if line.strip() and not line.startswith("#"))
+        except OSError as e:
+            logging.error(f"❌ خطأ في قراءة ملف الأنماط المحظورة {path}: {e}")
+    patterns.extend(p.strip() for p in extra.split(",") if p.strip())
+    return patterns
+
+
+class _ChatHistory:
+    """ بصمات الرسائل الأخيرة في محادثة: نافذة زمنية متدحرجة مع عدّاد لكل بصمة. """
+
+    def __init__(self):
+        self.entries = deque(maxlen=FINGERPRINT_HISTORY)  # (الوقت، البصمة، العضو، رقم الرسالة)
+        self.counts = {}
+        self.by_user = {}
+
+    def expire(self, now):
+        while self.entries and (now - self.entries[0][0] > DUPLICATE_WINDOW or len(self.entries) == self.entries.maxlen):
+            self._forget(self.entries.popleft())
+
+    def _forget(self, entry):
+        _, fingerprint, user_id, _ = entry
+        if fingerprint is not None:
+            self.counts[fingerprint] -= 1
+            if not self.counts[fingerprint]:
+                del self.counts[fingerprint]
+        times = self.by_user.get(user_id)
+        if times:
+            times.popleft()
+            if not times:
+                del self.by_user[user_id]
+
+    def add(self, now, fingerprint, user_id, message_id):
+        self.entries.append((now, fingerprint, user_id, message_id))
+        if fingerprint is not None:
+            self.counts[fingerprint] = self.counts.get(fingerprint, 0) + 1
+        self.by_user.setdefault(user_id, deque()).append(now)
+
+
+class Moderator:
+    """ المرشح المحلي أمام طلب النية: يعيد Verdict للمخالفة الواضحة أو None لتكمل الرسالة مسارها المعتاد. """
+
+    def __init__(self, patterns=None):
+        self.matcher = AhoCorasick(load_patterns() if patterns is None else patterns)
+        self._chats = {}
+        self._warned = {}  # (المحادثة، العضو) -> وقت آخر تحذير لسبام مكرر
+        self.checked = 0
+        self.blocked = {"pattern": 0, "duplicate": 0, "flood": 0}
+        logging.info(f"✅ تم تحميل {self.matcher.size} نمطًا محظورًا للمرشح المحلي.")
+
+    @staticmethod
+    def fingerprint(text):
+        normalized = normalize_message(text).translate(_LETTER_FOLDING)
+        if len(normalized) < DUPLICATE_MIN_CHARS:
+            return None
+        return hash(normalized)
+
+    def check(self, chat_id, user_id, message_id, text, now=None):
+        self.checked += 1
+        now = time.monotonic() if now is None else now
+        history = self._chats.get(chat_id)
+        if history is None:
+            history = self._chats[chat_id] = _ChatHistory()
+        history.expire(now)
+        fingerprint = self.fingerprint(text)
+        history.add(now, fingerprint, user_id, message_id)
+
+        pattern = self.matcher.search(text)
+        if pattern is not None:
+            self.blocked["pattern"] += 1
+            return Verdict("pattern", pattern, [], True)
+        if fingerprint is not None and history.counts[fingerprint] >= DUPLICATE_THRESHOLD:
+            self.blocked["duplicate"] += 1
+            # عند بلوغ الحد تُحذف النسخ السابقة أيضًا (موجة نسخ ولصق)، وتحذير واحد لكل عضو خلال النافذة
+            earlier = []
+            if history.counts[fingerprint] == DUPLICATE_THRESHOLD:
+                earlier = [entry[3] for entry in list(history.entries)[:-1] if entry[1] == fingerprint]
+            return Verdict("duplicate", None, earlier, self._should_warn(chat_id, user_id, now))
+        times = history.by_user.get(user_id, ())
+        if len([t for t in times if now - t <= FLOOD_WINDOW]) > FLOOD_MAX_MESSAGES:
+            self.blocked["flood"] += 1
+            return Verdict("flood", None, [], self._should_warn(chat_id, user_id, now))
+        return None
+
+    def _should_warn(self, chat_id, user_id, now):
+        last = self._warned.get((chat_id, user_id))
+        if last is not None and now - last < DUPLICATE_WINDOW:
+            return False
+        if len(self._warned) > FINGERPRINT_HISTORY:
+            self._warned = {key: t for key, t in self._warned.items() if now - t < DUPLICATE_WINDOW}
+        self._warned[(chat_id, user_id)] = now
+        return True
+
+    def stats(self):
+        total = sum(self.blocked.values())
+        return {"checked": self.checked, "blocked": total, **self.blocked,
+                "rate": total / self.checked if self.checked else 0.0}
@@ -0,0 +1,313 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+from metrics import OUTBOUND_ACTIONS, OUTBOUND_PENDING, STAGE_SECONDS
+from rate_limit import parse_quota
+from streaming import _retry_seconds
+
+
+# حدود Telegram للإرسال: عدد الرسائل / طول النافذة بالثواني. الحد 0 يعني بلا حد (الاختبارات وإعادة التشغيل).
+OUTBOUND_GLOBAL_LIMIT = parse_quota(os.getenv("OUTBOUND_GLOBAL_LIMIT"), "30/1")  # كل المحادثات معًا
+OUTBOUND_PRIVATE_LIMIT = parse_quota(os.getenv("OUTBOUND_PRIVATE_LIMIT"), "1/1")  # لكل محادثة خاصة
+OUTBOUND_GROUP_LIMIT = parse_quota(os.getenv("OUTBOUND_GROUP_LIMIT"), "20/60")  # لكل مجموعة
+OUTBOUND_CHAT_BURST = int(os.getenv("OUTBOUND_CHAT_BURST", 3))  # رسائل متتالية مسموحة قبل تطبيق المعدل
+OUTBOUND_MAX_ATTEMPTS = 3  # لأخطاء الشبكة؛ retry_after لا يُحسب محاولة
+OUTBOUND_DRAIN_TIMEOUT = float(os.getenv("OUTBOUND_DRAIN_TIMEOUT", 10))  # ثوانٍ لإفراغ الطابور عند الإيقاف
+DELETE_BATCH_SIZE = 100  # أقصى عدد رسائل في طلب deleteMessages واحد
+
+# الأولويات داخل كل محادثة: الردود أولًا، ثم الإشراف (حذف المخالفة والكتم)، ثم التنظيف (حذف التحذيرات القديمة)
+PRIORITY_REPLY = 0
+PRIORITY_MODERATION = 1
+PRIORITY_HOUSEKEEPING = 2
+
+
+def _sooner(wait, other):
+    return other if wait is None else min(wait, other)
+
+
+async def _reply_text(message, text, kwargs):
+    """ الرد بالتنسيق المطلوب، ثم نصًا عاديًا إذا رفض Telegram تنسيق رد Gemini. """
+    try:
+        return await message.reply_text(text, **kwargs)
+    except BadRequest as e:
+        if not kwargs.get("parse_mode") or "parse" not in str(e).lower():
+            raise
+        logging.warning(f"⚠️ تنسيق غير صالح في الرد، سيُرسل نصًا عاديًا: {e}")
+        return await message.reply_text(text, **{**kwargs, "parse_mode": None})
+
+
+class TokenBucket:
+    """ دلو رموز: limit رسالة كل window ثانية، مع سعة burst للرسائل المتتالية. """
+
+    def __init__(self, quota, burst=None):
+        limit, window = quota
+        self.rate = limit / window if limit > 0 else 0.0
+        self.capacity = float(burst if burst is not None else max(limit, 1))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def wait_time(self, now):
+        """ ثوانٍ حتى يتوفر رمز (0 إذا كان متاحًا الآن أو بلا حد). """
+        if not self.rate:
+            return 0.0
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        if self.rate:
+            self.tokens -= 1
+
+    def full(self, now):
+        """ هل امتلأ الدلو من جديد؟ عندها لا فرق بينه وبين دلو جديد. """
+        return self.wait_time(now) == 0.0 and (not self.rate or self.tokens >= self.capacity)
+
+
+class _Action:
+    __slots__ = ("kind", "priority", "factory", "future", "queued_at", "attempts", "rate_limited")
+
+    def __init__(self, kind, priority, factory, future, rate_limited):
+        self.kind = kind
+        self.priority = priority
+        self.factory = factory
+        self.future = future
+        self.queued_at = time.monotonic()
+        self.attempts = 0
+        self.rate_limited = rate_limited  # الإرسال يستهلك من حصة المحادثة؛ الحذف والكتم لا
+
+
+class _ChatQueue:
+    """ ما ينتظر الإرسال في محادثة واحدة: طابور لكل أولوية، ومجموعة حذف تُدمج في طلب واحد. """
+
+    def __init__(self, chat_id):
+        self.actions = tuple(deque() for _ in range(PRIORITY_HOUSEKEEPING + 1))
+        self.deletes = {}  # رقم الرسالة -> الأولوية (بترتيب الإضافة)
+        self.delete_bot = None
+        self.bucket = TokenBucket(OUTBOUND_GROUP_LIMIT if chat_id < 0 else OUTBOUND_PRIVATE_LIMIT,
+                                  OUTBOUND_CHAT_BURST)
+        self.blocked_until = 0.0  # بعد RetryAfter لهذه المحادثة
+        self.busy = False  # طلب واحد في الطريق لكل محادثة حتى يبقى ترتيب الرسائل محفوظًا
+
+    def __len__(self):
+        return sum(len(actions) for actions in self.actions) + len(self.deletes)
+
+    def idle(self, now):
+        """ لا شيء ينتظر ولا حالة حدود تستحق الحفظ: حذف المحادثة لا يمنح رسائلها التالية حصة جديدة. """
+        return not self.busy and not len(self) and self.blocked_until <= now and self.bucket.full(now)
+
+    def head(self):
+        """ (الأولوية، الإجراء) لأول ما يجب تنفيذه؛ الإجراء None يعني دفعة حذف. """
+        delete_priority = min(self.deletes.values()) if self.deletes else None
+        for priority, actions in enumerate(self.actions):
+            if delete_priority is not None and delete_priority <= priority:
+                return delete_priority, None
+            if actions:
+                return priority, actions[0]
+        return delete_priority, None
+
+
+class OutboundQueue:
+    """ طابور الإجراءات الصادرة إلى Telegram: المعالج يضيف ويعود فورًا، والمرسل يحترم الحدود وretry_after.
+
+    send/reply تعيد Future بنتيجة الطلب (الرسالة المرسلة) أو None إذا فشل نهائيًا؛ الأخطاء تُسجل هنا.
+    """
+
+    def __init__(self):
+        self._chats = {}
+        self._global = TokenBucket(OUTBOUND_GLOBAL_LIMIT)
+        self._wakeup = None
+        self._task = None
+        self._running = set()
+        self.sent = 0
+        self.retry_after = 0
+        self.failed = 0
+        self.coalesced = 0  # رسائل حُذفت ضمن طلب deleteMessages مشترك بدل طلب منفصل
+
+    # --- الإضافة إلى الطابور ---
+
+    def send(self, chat_id, factory, priority=PRIORITY_REPLY, kind="send", rate_limited=True):
+        """ factory: دالة بلا معاملات تعيد coroutine الطلب (تُستدعى من جديد عند إعادة المحاولة). """
+        future = asyncio.get_running_loop().create_future()
+        self._chat(chat_id).actions[priority].append(_Action(kind, priority, factory, future, rate_limited))
+        self._wake()
+        return future
+
+    def reply(self, message, text, priority=PRIORITY_REPLY, **kwargs):
+        return self.send(message.chat_id, lambda: _reply_text(message, text, kwargs), priority, kind="reply")
+
+    def send_message(self, bot, chat_id, text, priority=PRIORITY_REPLY, delete_after=None, **kwargs):
+        """ إرسال رسالة، مع حذفها تلقائيًا بعد delete_after ثانية (التحذيرات وإشعارات الكتم). """
+        future = self.send(chat_id, lambda: bot.send_message(chat_id=chat_id, text=text, **kwargs), priority)
+        if delete_after is not None:
+            def schedule_delete(done):
+                sent = done.result()
+                if sent is not None:
+                    asyncio.get_running_loop().call_later(delete_after, self.delete, bot, chat_id, [sent.message_id])
+            future.add_done_callback(schedule_delete)
+        return future
+
+    def delete(self, bot, chat_id, message_ids, priority=PRIORITY_HOUSEKEEPING):
+        """ حذف رسائل؛ كل الحذف المعلق في نفس المحادثة يُرسل معًا في طلب deleteMessages. """
+        chat = self._chat(chat_id)
+        chat.delete_bot = bot
+        for message_id in message_ids:
+            chat.deletes[message_id] = min(priority, chat.deletes.get(message_id, priority))
+        self._wake()
+
+    def _chat(self, chat_id):
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _ChatQueue(chat_id)
+        return chat
+
+    def _wake(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._dispatch_loop())
+        self._wakeup.set()
+
+    # --- المرسل ---
+
+    async def _dispatch_loop(self):
+        while True:
+            self._wakeup.clear()
+            wait = self._dispatch_ready(time.monotonic())
+            OUTBOUND_PENDING.set(self.pending())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def _dispatch_ready(self, now):
+        """ تنفيذ كل ما تسمح به الحدود الآن؛ يعيد الثواني حتى أقرب إجراء ممكن (None: انتظار إضافة جديدة). """
+        candidates = []
+        wait = None
+        for chat_id, chat in list(self._chats.items()):
+            if chat.idle(now):
+                del self._chats[chat_id]
+                continue
+            if chat.busy or not len(chat):
+                continue
+            if chat.blocked_until > now:
+                wait = _sooner(wait, chat.blocked_until - now)
+                continue
+            priority, action = chat.head()
+            candidates.append((priority, action.queued_at if action else 0.0, chat_id, action))
+        candidates.sort(key=lambda candidate: candidate[:2])
+
+        for _, _, chat_id, action in candidates:
+            global_wait = self._global.wait_time(now)
+            if global_wait:
+                return _sooner(wait, global_wait)
+            chat = self._chats[chat_id]
+            if action is not None and action.rate_limited:
+                chat_wait = chat.bucket.wait_time(now)
+                if chat_wait:
+                    wait = _sooner(wait, chat_wait)
+                    continue
+                chat.bucket.take()
+            self._global.take()
+            chat.busy = True
+            if action is None:
+                task = self._execute_deletes(chat_id, chat)
+            else:
+                chat.actions[action.priority].popleft()
+                STAGE_SECONDS.observe(now - action.queued_at, stage="outbound_wait")
+                task = self._execute(chat_id, chat, action)
+            task = asyncio.get_running_loop().create_task(task)
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+        return wait
+
+    async def _execute(self, chat_id, chat, action):
+        try:
+            result = await action.factory()
+        except RetryAfter as e:
+            self._delay_chat(chat, e, action.kind)
+            chat.actions[action.priority].appendleft(action)
+        except BadRequest as e:
+            self._fail(action, e)
+        except NetworkError as e:
+            action.attempts += 1
+            if action.attempts < OUTBOUND_MAX_ATTEMPTS:
+                logging.warning(f"⚠️ خطأ شبكة في إرسال {action.kind} إلى {chat_id}، إعادة المحاولة: {e}")
+                OUTBOUND_ACTIONS.inc(kind=action.kind, outcome="retry")
+                chat.actions[action.priority].appendleft(action)
+            else:
+                self._fail(action, e)
+        except Exception as e:
+            self._fail(action, e)
+        else:
+            self.sent += 1
+            OUTBOUND_ACTIONS.inc(kind=action.kind, outcome="ok")
+            if not action.future.done():
+                action.future.set_result(result)
+        finally:
+            chat.busy = False
+            self._wakeup.set()
+
+    async def _execute_deletes(self, chat_id, chat):
+        batch = list(chat.deletes.items())[:DELETE_BATCH_SIZE]
+        for message_id, _ in batch:
+            del chat.deletes[message_id]
+        message_ids = [message_id for message_id, _ in batch]
+        try:
+            if len(message_ids) == 1:
+                await chat.delete_bot.delete_message(chat_id=chat_id, message_id=message_ids[0])
+            else:
+                await chat.delete_bot.delete_messages(chat_id=chat_id, message_ids=message_ids)
+                self.coalesced += len(message_ids) - 1
+            self.sent += 1
+            OUTBOUND_ACTIONS.inc(kind="delete", outcome="ok")
+            logging.info(f"🗑️ [LOG] - تم حذف {len(message_ids)} رسالة في {chat_id}.")
+        except RetryAfter as e:
+            self._delay_chat(chat, e, "delete")
+            for message_id, priority in batch:
+                chat.deletes.setdefault(message_id, priority)
+        except Exception as e:
+            # رسالة حذفها مشرف أو مر عليها 48 ساعة: لا فائدة من إعادة المحاولة
+            self.failed += 1
+            OUTBOUND_ACTIONS.inc(kind="delete", outcome="error")
+            logging.error(f"❌ [LOG] - تعذر حذف الرسائل {message_ids} في {chat_id}: {e}")
+        finally:
+            chat.busy = False
+            self._wakeup.set()
+
+    def _delay_chat(self, chat, error, kind):
+        seconds = _retry_seconds(error)
+        chat.blocked_until = time.monotonic() + seconds
+        self.retry_after += 1
+        OUTBOUND_ACTIONS.inc(kind=kind, outcome="retry_after")
+        logging.warning(f"⚠️ Telegram طلب الانتظار {seconds:.0f} ثانية قبل {kind} التالي.")
+
+    def _fail(self, action, error):
+        self.failed += 1
+        OUTBOUND_ACTIONS.inc(kind=action.kind, outcome="error")
+        logging.error(f"❌ خطأ في إرسال {action.kind}: {error}")
+        if not action.future.done():
+            action.future.set_result(None)
+
+    # --- الحالة والإيقاف ---
+
+    def pending(self):
+        return sum(len(chat) for chat in self._chats.values())
+
+    def stats(self):
+        return {"pending": self.pending(), "in_flight": len(self._running), "sent": self.sent,
+                "retry_after": self.retry_after, "failed": self.failed, "coalesced_deletes": self.coalesced}
+
+    async def close(self, timeout=OUTBOUND_DRAIN_TIMEOUT):
+        """ إفراغ الطابور قبل الإيقاف (حتى timeout)، ثم إيقاف المرسل. """
+        deadline = time.monotonic() + timeout
+        while (self.pending() or self._running) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self.pending():
+            logging.warning(f"⚠️ تم الإيقاف مع {self.pending()} إجراء صادر لم يُرسل.")
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
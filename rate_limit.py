@@ -0,0 +1,222 @@
+import os
+import time
+import logging
+import threading
+from datetime import datetime
+from collections import OrderedDict
+
+
+def parse_quota(value, default):
+    """ تحويل "10/86400" إلى (الحد، طول النافذة بالثواني). الحد 0 يعني بلا حد. """
+    try:
+        limit, _, window = (value or default).partition("/")
+        return int(limit), float(window or 86400)
+    except ValueError:
+        logging.error(f"❌ صيغة حد غير صحيحة: {value}")
+        return parse_quota(default, default)
+
+
+# الحصص لكل نوع دردشة: عدد الرسائل / طول النافذة بالثواني
+QUOTAS = {
+    "group": parse_quota(os.getenv("RATE_LIMIT_GROUP"), "10/86400"),
+    "private": parse_quota(os.getenv("RATE_LIMIT_PRIVATE"), "10/86400"),
+    "admin": parse_quota(os.getenv("RATE_LIMIT_ADMIN"), "0/86400"),
+    "violation": parse_quota(os.getenv("VIOLATION_WINDOW"), "0/86400"),  # نافذة عدّ المخالفات
+}
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", 10000))  # أقصى عدد مفاتيح في الذاكرة
+RATE_LIMIT_FLUSH_INTERVAL = float(os.getenv("RATE_LIMIT_FLUSH_INTERVAL", 5))  # ثوانٍ بين كل حفظ دفعي
+RATE_LIMIT_FLUSH_BATCH = 200  # حفظ فوري إذا تراكم هذا العدد من المفاتيح المعدلة
+RATE_LIMIT_TIMEZONE = "Africa/Khartoum"  # النافذة اليومية تبدأ عند منتصف الليل بتوقيت السودان (كساعات العمل)
+
+RATE_LIMIT_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS rate_limits (
+            key TEXT PRIMARY KEY,
+            window_start REAL NOT NULL,
+            window REAL NOT NULL,
+            count INTEGER NOT NULL,
+            prev_count INTEGER NOT NULL,
+            updated_at REAL NOT NULL
+        )""",
+    "CREATE INDEX IF NOT EXISTS rate_limits_updated_at ON rate_limits(updated_at)",
+]
+
+# دمج الزيادات مع ما كتبته العمليات الأخرى: نفس النافذة تُجمع، والنافذة الأحدث تُزيح القديمة
+_UPSERT = """
+    INSERT INTO rate_limits (key, window_start, window, count, prev_count, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(key) DO UPDATE SET
+        prev_count = CASE
+            WHEN excluded.window_start = rate_limits.window_start THEN rate_limits.prev_count
+            WHEN excluded.window_start = rate_limits.window_start + excluded.window THEN rate_limits.count
+            WHEN excluded.window_start > rate_limits.window_start THEN 0
+            ELSE rate_limits.prev_count END,
+        count = CASE
+            WHEN excluded.window_start = rate_limits.window_start THEN rate_limits.count + excluded.count
+            WHEN excluded.window_start > rate_limits.window_start THEN excluded.count
+            ELSE rate_limits.count END,
+        window_start = MAX(rate_limits.window_start, excluded.window_start),
+        window = excluded.window,
+        updated_at = excluded.updated_at
+"""
+
+
+_timezone = None
+
+
+def window_start_for(now, window):
+    """ بداية النافذة التي يقع فيها now، محاذاة على التوقيت المحلي لا على أيام UTC. """
+    global _timezone
+    if _timezone is None:
+        import pytz  # تُستورد عند أول استخدام كما في is_within_working_hours
+        _timezone = pytz.timezone(RATE_LIMIT_TIMEZONE)
+    offset = datetime.fromtimestamp(now, _timezone).utcoffset().total_seconds()
+    return now - ((now + offset) % window)
+
+
+def ensure_rate_limit_schema(cur):
+    for statement in RATE_LIMIT_SCHEMA:
+        cur.execute(statement)
+
+
+class _Counter:
+    __slots__ = ("window_start", "count", "prev_count", "pending")
+
+    def __init__(self, window_start, count=0, prev_count=0):
+        self.window_start = window_start
+        self.count = count
+        self.prev_count = prev_count
+        self.pending = 0  # زيادات لم تُحفظ بعد في قاعدة البيانات
+
+
+class RateLimiter:
+    """ عداد نافذة منزلقة لكل مفتاح بفحص O(1)، محفوظ في SQLite على دفعات ومشترك بين العمليات. """
+
+    def __init__(self, storage, quotas=QUOTAS, max_keys=RATE_LIMIT_MAX_KEYS, flush_interval=RATE_LIMIT_FLUSH_INTERVAL):
+        self.storage = storage
+        self.quotas = quotas
+        self.max_keys = max_keys
+        self.flush_interval = flush_interval
+        self._counters = OrderedDict()
+        self._dirty = set()
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()  # الحفظ يكمل في خيط الكتابة
+
+    @staticmethod
+    def _load(conn, key):
+        row = conn.execute("SELECT window_start, count, prev_count FROM rate_limits WHERE key = ?", (key,)).fetchone()
+        return _Counter(*row) if row else _Counter(0.0)
+
+    async def _counter(self, key, window, now):
+        counter = self._counters.get(key)
+        if counter is None:
+            loaded = await self.storage.run(self._load, key)
+            with self._lock:
+                # قد يكون معالج آخر حمّل المفتاح أثناء الانتظار
+                counter = self._counters.setdefault(key, loaded)
+            self._evict()
+        else:
+            self._counters.move_to_end(key)
+        # تدوير النافذة عند انتهائها
+        window_start = window_start_for(now, window)
+        with self._lock:
+            if window_start != counter.window_start:
+                counter.prev_count = counter.count if window_start - counter.window_start == window else 0
+                counter.count = 0
+                counter.window_start = window_start
+        return counter
+
+    @staticmethod
+    def _estimate(counter, window, now):
+        elapsed = (now - counter.window_start) / window
+        return counter.prev_count * (1 - elapsed) + counter.count
+
+    def _increment(self, key, counter):
+        with self._lock:
+            counter.count += 1
+            counter.pending += 1
+            self._dirty.add(key)
+        if len(self._dirty) >= RATE_LIMIT_FLUSH_BATCH or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    async def allow(self, scope, user_id):
+        """ استهلاك رسالة من حصة المستخدم؛ False إذا تجاوز الحد خلال النافذة. """
+        limit, window = self.quotas[scope]
+        if limit <= 0:
+            return True
+        key = f"{scope}:{user_id}"
+        now = time.time()
+        counter = await self._counter(key, window, now)
+        if self._estimate(counter, window, now) >= limit:
+            return False
+        self._increment(key, counter)
+        return True
+
+    async def record(self, scope, user_id):
+        """ تسجيل حدث (مثل مخالفة) وإرجاع عدد الأحداث التقديري خلال النافذة. """
+        _, window = self.quotas[scope]
+        key = f"{scope}:{user_id}"
+        now = time.time()
+        counter = await self._counter(key, window, now)
+        self._increment(key, counter)
+        return round(self._estimate(counter, window, now))
+
+    def _evict(self):
+        if len(self._counters) <= self.max_keys:
+            return
+        if self._dirty:
+            self.flush()
+        with self._lock:
+            # المفاتيح التي لم تُحفظ بعد تبقى حتى ينتهي الحفظ
+            for key in list(self._counters):
+                if len(self._counters) <= self.max_keys:
+                    break
+                if key not in self._dirty:
+                    del self._counters[key]
+
+    def _write_rows(self, conn, rows, now):
+        conn.executemany(_UPSERT, rows)
+        max_window = max(window for _, window in self.quotas.values())
+        conn.execute("DELETE FROM rate_limits WHERE updated_at < ?", (now - 2 * max_window,))
+        return [(key, conn.execute("SELECT window_start, count, prev_count FROM rate_limits WHERE key = ?",
+                                   (key,)).fetchone()) for key, *_ in rows]
+
+    def _apply_synced(self, future, flushed):
+        error = future.exception()
+        with self._lock:
+            if error is not None:
+                # إعادة المفاتيح للحفظ في المرة القادمة
+                self._dirty.update(flushed)
+                logging.error(f"❌ خطأ في حفظ عدادات الحدود: {error}")
+                return
+            for key, row in future.result():
+                counter = self._counters.get(key)
+                if counter is None or row is None:
+                    continue
+                # الزيادات التي وصلت أثناء الحفظ تبقى معلقة فوق القيمة المتزامنة
+                unsaved = counter.pending - flushed[key]
+                counter.window_start, counter.count, counter.prev_count = row
+                counter.count += unsaved
+                counter.pending = unsaved
+                if unsaved:
+                    self._dirty.add(key)
+
+    def flush(self):
+        """ حفظ كل الزيادات المعلقة في دفعة الكتابة التالية ثم مزامنة القيم مع ما كتبته العمليات الأخرى.
+        يُرجع Future للحفظ أو None إذا لم يكن هناك ما يُحفظ. """
+        self._last_flush = time.monotonic()
+        now = time.time()
+        with self._lock:
+            if not self._dirty:
+                return None
+            rows, flushed = [], {}
+            for key in self._dirty:
+                counter = self._counters.get(key)
+                if counter is None:
+                    continue
+                window = self.quotas[key.split(":", 1)[0]][1]
+                rows.append((key, counter.window_start, window, counter.pending, counter.prev_count, now))
+                flushed[key] = counter.pending
+            self._dirty.clear()
+        future = self.storage.submit_write(self._write_rows, rows, now)
+        future.add_done_callback(lambda f: self._apply_synced(f, flushed))
+        return future
@@ -0,0 +1,103 @@
+import os
+import re
+import time
+import hashlib
+import logging
+from retrieval import ARABIC_MARKS
+
+
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 7 * 24 * 3600))  # صلاحية الرد المخزن بالثواني
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 5000))
+EVICTION_EVERY = 50  # عدد الإضافات بين كل عملية تنظيف
+
+RESPONSE_CACHE_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS response_cache (
+            key TEXT PRIMARY KEY,
+            response TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_used REAL NOT NULL
+        )""",
+    "CREATE INDEX IF NOT EXISTS response_cache_last_used ON response_cache(last_used)",
+]
+
+_PUNCTUATION = re.compile(r"[^\w\s]", re.UNICODE)
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_message(text):
+    """ توحيد الرسالة قبل استخدامها كمفتاح: أحرف صغيرة، بدون تشكيل أو علامات ترقيم أو مسافات زائدة. """
+    text = ARABIC_MARKS.sub("", text or "").lower()
+    text = _PUNCTUATION.sub(" ", text)
+    return _SPACES.sub(" ", text).strip()
+
+
+def ensure_response_cache_schema(cur):
+    for statement in RESPONSE_CACHE_SCHEMA:
+        cur.execute(statement)
+
+
+class ResponseCache:
+    """ ذاكرة دائمة لردود Gemini بمفتاح (الرسالة الموحدة، النية، جيل الأسئلة) مع صلاحية وحد أقصى LRU. """
+
+    def __init__(self, storage, ttl=RESPONSE_CACHE_TTL, max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.storage = storage
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+
+    @staticmethod
+    def make_key(message, intent, version):
+        raw = f"{normalize_message(message)}\x1f{intent}\x1f{version}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _lookup(conn, key):
+        return conn.execute("SELECT response, created_at FROM response_cache WHERE key = ?", (key,)).fetchone()
+
+    @staticmethod
+    def _touch(conn, key, now):
+        conn.execute("UPDATE response_cache SET last_used = ? WHERE key = ?", (now, key))
+
+    async def get(self, message, intent, version):
+        key = self.make_key(message, intent, version)
+        now = time.time()
+        row = await self.storage.run(self._lookup, key)
+        if row is None or now - row[1] > self.ttl:
+            self.misses += 1
+            return None
+        # تحديث وقت آخر استخدام ضمن دفعة الكتابة التالية دون انتظار
+        self.storage.fire_and_forget(self._touch, key, now)
+        self.hits += 1
+        return row[0]
+
+    def _store(self, conn, key, response, now, evict):
+        conn.execute("INSERT OR REPLACE INTO response_cache (key, response, created_at, last_used) VALUES (?, ?, ?, ?)",
+                     (key, response, now, now))
+        if evict:
+            self.evict(conn, now)
+
+    def put(self, message, intent, version, response):
+        """ تخزين الرد في الخلفية؛ لا حاجة لانتظار الكتابة قبل إرسال الرد للمستخدم. """
+        self._puts += 1
+        key = self.make_key(message, intent, version)
+        return self.storage.fire_and_forget(self._store, key, response, time.time(), self._puts % EVICTION_EVERY == 0)
+
+    def evict(self, conn, now=None):
+        """ حذف الردود المنتهية ثم الأقل استخدامًا حتى لا يتجاوز الجدول الحد الأقصى. """
+        now = now or time.time()
+        conn.execute("DELETE FROM response_cache WHERE created_at < ?", (now - self.ttl,))
+        overflow = conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0] - self.max_entries
+        if overflow > 0:
+            conn.execute("DELETE FROM response_cache WHERE key IN "
+                         "(SELECT key FROM response_cache ORDER BY last_used ASC LIMIT ?)", (overflow,))
+            logging.info(f"🧹 تم حذف {overflow} ردًا قديمًا من ذاكرة الردود.")
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+        }
@@ -0,0 +1,86 @@
+import os
+import re
+import logging
+
+
+# عدد المداخل الأكثر صلة التي تُرسل مع كل طلب إلى Gemini
+FAQ_TOP_K = int(os.getenv("FAQ_TOP_K", 5))
+
+CHANNEL_ANSWER = "معلومة من القناة"
+
+# فهرس نصي واحد يغطي جدول الأسئلة ورسائل القناة.
+# rowid في الفهرس = id * 2 للأسئلة و slot * 2 + 1 لخانات القناة، حتى يكون الحذف عبر rowid مباشرة.
+FTS_TABLE = "knowledge_fts"
+
+FTS_SCHEMA = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+            question, answer, category,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )""",
+    f"""CREATE TRIGGER IF NOT EXISTS faq_fts_ai AFTER INSERT ON faq BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, question, answer, category)
+            VALUES (new.id * 2, new.question, new.answer, new.category);
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS faq_fts_ad AFTER DELETE ON faq BEGIN
+            DELETE FROM {FTS_TABLE} WHERE rowid = old.id * 2;
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS faq_fts_au AFTER UPDATE ON faq BEGIN
+            UPDATE {FTS_TABLE} SET question = new.question, answer = new.answer, category = new.category
+            WHERE rowid = old.id * 2;
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS channel_ring_fts_ai AFTER INSERT ON channel_ring BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, question, answer, category)
+            VALUES (new.slot * 2 + 1, new.text, '', 'channel');
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS channel_ring_fts_au AFTER UPDATE ON channel_ring BEGIN
+            UPDATE {FTS_TABLE} SET question = new.text WHERE rowid = old.slot * 2 + 1;
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS channel_ring_fts_ad AFTER DELETE ON channel_ring BEGIN
+            DELETE FROM {FTS_TABLE} WHERE rowid = old.slot * 2 + 1;
+        END""",
+]
+
+# تشكيل عربي وتطويل يُحذفان من الاستعلام قبل البحث
+ARABIC_MARKS = re.compile(r"[\u0610-\u061A\u064B-\u065F\u0670\u0640]")
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+MAX_QUERY_TERMS = 16
+
+
+def ensure_fts_schema(cur):
+    """ إنشاء الفهرس النصي والمشغلات، وتعبئته من البيانات الحالية عند إنشائه لأول مرة. """
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (FTS_TABLE,))
+    existed = cur.fetchone() is not None
+    for statement in FTS_SCHEMA:
+        cur.execute(statement)
+    if not existed:
+        cur.execute(f"INSERT INTO {FTS_TABLE}(rowid, question, answer, category) "
+                    "SELECT id * 2, question, answer, category FROM faq")
+        cur.execute(f"INSERT INTO {FTS_TABLE}(rowid, question, answer, category) "
+                    "SELECT slot * 2 + 1, text, '', 'channel' FROM channel_ring")
+        logging.info("✅ تم بناء الفهرس النصي للأسئلة ورسائل القناة.")
+
+
+def build_match_query(text):
+    """ تحويل رسالة المستخدم إلى استعلام FTS5 (كلمات مقتبسة مع مطابقة البادئة، مربوطة بـ OR). """
+    text = ARABIC_MARKS.sub("", text or "").lower()
+    terms = []
+    for token in _TOKEN.findall(text):
+        if len(token) < 2 or token in terms:
+            continue
+        terms.append(token)
+        if len(terms) >= MAX_QUERY_TERMS:
+            break
+    return " OR ".join('"' + t.replace('"', '""') + '"' + ("*" if len(t) >= 3 else "") for t in terms)
+
+
+def search_knowledge(conn, text, k=FAQ_TOP_K):
+    """ إرجاع أفضل k مداخل (سؤال، جواب) مرتبة حسب BM25. """
+    query = build_match_query(text)
+    if not query:
+        return []
+    rows = conn.execute(
+        f"SELECT rowid, question, answer FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH ? "
+        f"ORDER BY bm25({FTS_TABLE}, 10.0, 2.0, 1.0) LIMIT ?",
+        (query, k),
+    ).fetchall()
+    return [(q, a if rowid % 2 == 0 else CHANNEL_ANSWER) for rowid, q, a in rows]
@@ -0,0 +1,308 @@
+""" وضع العمال المتعددين: مستقبل ويبهوك واحد يوزع التحديثات على N عملية حسب المحادثة.
+
+كل عامل يشغل البوت كاملًا (main.create_application) ويتشارك مع الباقين نفس قاعدة SQLite: الأسئلة وعداد
+الأجيال وذاكرة الردود وعدادات الحدود والمخالفات. المحادثة كلها عند عامل واحد: المجموعة بكل أعضائها (فيرى
+المرشح المحلي موجات النسخ من عدة حسابات، ويبقى فاصل التعديلات وحد الإرسال لكل مجموعة صحيحًا)، والمحادثة
+الخاصة حسب المستخدم، فيبقى ترتيب الرسائل وتبقى context.user_data (مثل كود تأكيد إعادة التعيين) صحيحة.
+
+    SHARD_WORKERS=4 WEBHOOK_URL=https://... python main.py
+    python sharding.py --workers 4 --port 10000      # تجربة محلية: POST للتحديثات إلى /telegram
+    python traffic_replay.py traffic.jsonl --workers 4   # قياس التوسع على جهاز واحد
+"""
+import os
+import sys
+import json
+import hmac
+import time
+import zlib
+import queue
+import signal
+import asyncio
+import logging
+import argparse
+import importlib
+import multiprocessing
+
+from metrics import SHARD_UPDATES
+from rate_limit import parse_quota
+
+
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", 0))  # 0 أو 1: عملية واحدة كالمعتاد
+SHARD_QUEUE_SIZE = int(os.getenv("SHARD_QUEUE_SIZE", 1000))  # تحديثات معلقة لكل عامل قبل رد 503 (Telegram يعيد الإرسال)
+SHARD_METRICS_PORT = int(os.getenv("SHARD_METRICS_PORT", 0))  # إن ضُبط: العامل i يعرض /metrics على المنفذ + i
+WORKER_CHECK_INTERVAL = 5  # ثوانٍ بين فحوص العمال وإعادة تشغيل المتوقف منها
+WORKER_STOP_TIMEOUT = 30
+# الحد العام مشترك بين العمال فيُقسم عليهم؛ كل محادثة (خاصة أو مجموعة) عند عامل واحد فحدها لا يتغير
+SHARED_OUTBOUND_LIMITS = (("OUTBOUND_GLOBAL_LIMIT", "30/1"),)
+
+
+def shard_key(data):
+    """ (المحادثة، المستخدم) من التحديث الخام، بنفس مفتاح update_ordering_key دون بناء كائن Update. """
+    for field, value in data.items():
+        if field == "update_id" or not isinstance(value, dict):
+            continue
+        chat = value.get("chat") or (value.get("message") or {}).get("chat") or {}
+        user = value.get("from") or value.get("user") or {}
+        return chat.get("id"), user.get("id")
+    return None, None
+
+
+def shard_for(data, workers):
+    # حسب المحادثة فقط (في الخاص رقمها هو رقم المستخدم)، وحسب المستخدم إذا لم تكن هناك محادثة
+    # crc32 ثابت بين العمليات والتشغيلات، بخلاف hash() للنصوص
+    chat_id, user_id = shard_key(data)
+    return zlib.crc32(str(chat_id if chat_id is not None else user_id).encode()) % workers
+
+
+def configure_worker_env(workers):
+    """ متغيرات البيئة التي يقرؤها كل عامل عند استيراد main (تُضبط قبل إنشاء العمليات). """
+    os.environ["SHARD_COUNT"] = str(workers)
+    for name, default in SHARED_OUTBOUND_LIMITS:
+        limit, window = parse_quota(os.getenv(name), default)
+        if limit > 0:
+            os.environ[name] = f"{limit}/{window * workers:g}"
+
+
+def _import_main():
+    # بالتشغيل عبر python main.py تستورد spawn الملف مسبقًا باسم __mp_main__؛ نستخدم نفس النسخة
+    spawned = sys.modules.get("__mp_main__")
+    if spawned is not None and hasattr(spawned, "create_application"):
+        sys.modules.setdefault("main", spawned)
+        return spawned
+    return importlib.import_module("main")
+
+
+def worker_main(index, workers, inbox, results=None, setup=None):
+    """ نقطة دخول العامل: setup(main) اختيارية (لأداة إعادة التشغيل) وقد تعيد دالة تقرير نهائي. """
+    # المستقبل هو من يقرر الإيقاف (Ctrl+C وsystemd يرسلان الإشارة لكل العمليات)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    main = _import_main()
+    report = setup(main) if setup else None
+    try:
+        asyncio.run(_serve(main, index, inbox, results, report))
+    finally:
+        main._log_listener.stop()  # العملية الفرعية تنتهي دون atexit، فنفرغ السجلات المعلقة هنا
+
+
+def _next_update(inbox, parent):
+    """ التحديث التالي، أو None عند طلب الإيقاف أو إذا توقف المستقبل فجأة (لا نبقى عملية يتيمة). """
+    while True:
+        try:
+            return inbox.get(timeout=WORKER_CHECK_INTERVAL)
+        except queue.Empty:
+            if os.getppid() != parent:
+                logging.error("❌ توقف المستقبل، إيقاف العامل.")
+                return None
+
+
+async def _serve(main, index, inbox, results, report):
+    from telegram import Update
+
+    application = main.create_application()
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    if SHARD_METRICS_PORT:
+        import tornado.web
+        from webhook_server import MetricsHandler
+        tornado.web.Application([(r"/metrics", MetricsHandler)]).listen(SHARD_METRICS_PORT + index, address="127.0.0.1")
+    logging.info(f"✅ العامل {index} جاهز لاستقبال التحديثات.")
+
+    loop = asyncio.get_running_loop()
+    parent = os.getppid()
+    handled = 0
+    started = None
+    try:
+        while True:
+            data = await loop.run_in_executor(None, _next_update, inbox, parent)
+            if data is None:
+                break
+            if started is None:
+                started = time.perf_counter()
+            await application.update_queue.put(Update.de_json(data, application.bot))
+            handled += 1
+    finally:
+        # stop() ينتظر انتهاء معالجة كل ما وصل قبل الإيقاف
+        await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+    logging.info(f"✅ تم إيقاف العامل {index} بعد {handled} تحديثًا.")
+    if results is not None:
+        summary = {"shard": index, "updates": handled,
+                   "seconds": time.perf_counter() - started if started else 0.0}
+        if report:
+            summary.update(report(application))
+        results.put(summary)
+
+
+class WorkerPool:
+    """ عمليات العمال وطوابير الإدخال: طابور لكل عامل حتى تبقى رسائل كل مستخدم بالترتيب. """
+
+    def __init__(self, workers, setup=None, results=None):
+        self.workers = workers
+        self.setup = setup
+        self.results = results
+        self._context = multiprocessing.get_context("spawn")  # fork مع خيوط السجلات والتخزين غير آمن
+        self.inboxes = [self._context.Queue(SHARD_QUEUE_SIZE) for _ in range(workers)]
+        self.processes = [None] * workers
+        self.restarts = 0
+
+    def start(self):
+        configure_worker_env(self.workers)
+        for index in range(self.workers):
+            self._spawn(index)
+
+    def _spawn(self, index):
+        os.environ["SHARD_INDEX"] = str(index)  # spawn ينسخ البيئة عند start()
+        process = self._context.Process(target=worker_main, name=f"faqbot-shard-{index}",
+                                        args=(index, self.workers, self.inboxes[index], self.results, self.setup))
+        process.start()
+        self.processes[index] = process
+
+    def dispatch(self, data, block=False):
+        """ False إذا كان طابور العامل ممتلئًا (المستقبل يرد 503 فيعيد Telegram الإرسال لاحقًا). """
+        index = shard_for(data, self.workers)
+        try:
+            self.inboxes[index].put(data, block=block)
+        except queue.Full:
+            SHARD_UPDATES.inc(shard=str(index), outcome="rejected")
+            logging.warning(f"⚠️ طابور العامل {index} ممتلئ، تم رفض التحديث.")
+            return False
+        SHARD_UPDATES.inc(shard=str(index), outcome="dispatched")
+        return True
+
+    def check(self):
+        """ إعادة تشغيل العامل المتوقف على نفس الطابور (نفس الجزء من المحادثات). """
+        for index, process in enumerate(self.processes):
+            if process is not None and not process.is_alive():
+                logging.error(f"❌ توقف العامل {index} (رمز الخروج {process.exitcode})، إعادة تشغيله.")
+                self.restarts += 1
+                self._spawn(index)
+
+    def alive(self):
+        return all(process is not None and process.is_alive() for process in self.processes)
+
+    def close(self):
+        for inbox in self.inboxes:
+            inbox.put(None)
+
+    def join(self, timeout=WORKER_STOP_TIMEOUT):
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        for index, process in enumerate(self.processes):
+            process.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logging.error(f"❌ العامل {index} لم يتوقف خلال المهلة، إنهاؤه.")
+                process.terminate()
+
+
+def _make_front_app(pool, url_path, secret_token):
+    import tornado.web
+    from webhook_server import SECRET_HEADER, HealthHandler, MetricsHandler
+
+    class ShardingUpdateHandler(tornado.web.RequestHandler):
+        """ التحقق من الرمز السري ثم تمرير التحديث الخام إلى عامله دون تحليله إلى Update. """
+
+        def post(self):
+            received = self.request.headers.get(SECRET_HEADER, "")
+            if not hmac.compare_digest(received, secret_token):
+                logging.warning("⚠️ تم رفض طلب ويبهوك برمز سري غير صحيح.")
+                self.set_status(403)
+                return
+            try:
+                data = json.loads(self.request.body)
+            except ValueError:
+                self.set_status(400)
+                return
+            self.set_status(200 if pool.dispatch(data) else 503)
+
+    class PoolReadinessHandler(tornado.web.RequestHandler):
+        def get(self):
+            if pool.alive():
+                self.write("ready")
+            else:
+                self.set_status(503)
+                self.write("starting")
+
+    return tornado.web.Application([
+        (rf"/{url_path}", ShardingUpdateHandler),
+        (r"/", HealthHandler),
+        (r"/healthz", HealthHandler),
+        (r"/readyz", PoolReadinessHandler),
+        (r"/metrics", MetricsHandler),
+    ])
+
+
+async def run_front(workers, port, webhook_url=None, token=None):
+    """ المستقبل: خادم الويبهوك وتوزيع التحديثات ومراقبة العمال حتى SIGINT أو SIGTERM. """
+    import tornado.ioloop
+    from webhook_server import WEBHOOK_PATH, WEBHOOK_SECRET
+
+    pool = WorkerPool(workers)
+    pool.start()
+    server = _make_front_app(pool, WEBHOOK_PATH, WEBHOOK_SECRET).listen(port, address="0.0.0.0")
+    logging.info(f"✅ المستقبل يستمع على المنفذ {port} ويوزع على {workers} عمال.")
+    if webhook_url:
+        from telegram import Bot, Update
+        async with Bot(token) as bot:
+            await bot.set_webhook(url=f"{webhook_url.rstrip('/')}/{WEBHOOK_PATH}", secret_token=WEBHOOK_SECRET,
+                                  allowed_updates=Update.ALL_TYPES)
+        logging.info("✅ تم تسجيل الويبهوك لدى تيليجرام.")
+    else:
+        logging.info(f"ℹ️ بدون WEBHOOK_URL: أرسل التحديثات يدويًا إلى /{WEBHOOK_PATH} مع الترويسة السرية.")
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+    checker = tornado.ioloop.PeriodicCallback(pool.check, WORKER_CHECK_INTERVAL * 1000)
+    checker.start()
+    try:
+        await stop_event.wait()
+    finally:
+        logging.info("⌛ جاري إيقاف المستقبل والعمال...")
+        checker.stop()
+        server.stop()
+        pool.close()
+        await loop.run_in_executor(None, pool.join)
+        logging.info("✅ تم إيقاف كل العمال.")
+
+
+def run_local(updates, workers, setup=None):
+    """ توزيع قائمة تحديثات خام على العمال دون HTTP ثم انتظار انتهائها؛ يعيد تقرير كل عامل. """
+    results = multiprocessing.get_context("spawn").Queue()
+    pool = WorkerPool(workers, setup, results)
+    pool.start()
+    for data in updates:
+        pool.dispatch(data, block=True)
+    pool.close()
+    # قراءة التقارير قبل join: العملية لا تنتهي قبل تفريغ ما كتبته في الطابور
+    reports = []
+    while len(reports) < workers:
+        try:
+            reports.append(results.get(timeout=1))
+        except queue.Empty:
+            if not any(process.is_alive() for process in pool.processes):
+                logging.error("❌ توقفت كل العمال قبل إرسال تقاريرها.")
+                break
+    pool.join()
+    return sorted(reports, key=lambda report: report["shard"])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the bot as a webhook front with N sharded worker processes.")
+    parser.add_argument("--workers", type=int, default=SHARD_WORKERS or os.cpu_count() or 2)
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT") or 10000))
+    parser.add_argument("--webhook-url", default=os.getenv("WEBHOOK_URL"))
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format='%(asctime)s - %(levelname)s - %(message)s')
+    args = parse_args()
+    asyncio.run(run_front(args.workers, args.port, args.webhook_url, os.getenv("FAQBOT_TOKEN")))
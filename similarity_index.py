@@ -0,0 +1,215 @@
+import os
+import math
+import logging
+import threading
+
+import numpy as np
+
+from response_cache import normalize_message
+
+
+# أقل تشابه (cosine) بين السؤال وسؤال مخزن لإرسال الجواب المخزن مباشرة دون Gemini
+DIRECT_ANSWER_THRESHOLD = float(os.getenv("DIRECT_ANSWER_THRESHOLD", 0.85))
+NGRAM_SIZES = (2, 3, 4)  # أطوال الـ n-gram الحرفية
+MIN_QUERY_CHARS = 4  # الرسائل الأقصر من هذا لا تُطابق (تحيات وكلمات مفردة)
+
+
+# توحيد أشكال الهمزة والتاء المربوطة والألف المقصورة (أخطاء الكتابة الشائعة)
+_LETTER_FOLDING = str.maketrans({"\u0623": "\u0627", "\u0625": "\u0627", "\u0622": "\u0627",
+                                 "\u0629": "\u0647", "\u0649": "\u064a"})
+
+
+_HASH_PRIME = np.uint64(1099511628211)
+
+
+def _gram_hashes(texts):
+    """ (رقم النص، بصمة 64 بت) لكل n-gram حرفية في النصوص الموحدة، محسوبة لكل النصوص دفعة واحدة. """
+    padded = [f" {normalize_message(text).translate(_LETTER_FOLDING)} " for text in texts]
+    codes = np.frombuffer("".join(padded).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    owner = np.repeat(np.arange(len(padded)), [len(text) for text in padded])
+    rows, hashes = [], []
+    for n in NGRAM_SIZES:
+        size = len(codes) - n + 1
+        if size <= 0:
+            continue
+        grams = np.full(size, n, dtype=np.uint64)
+        for k in range(n):
+            grams = grams * _HASH_PRIME + codes[k:k + size]  # الفيض في uint64 مقصود (التفاف)
+        # n-gram لا تعبر من نص إلى النص التالي
+        inside = owner[:size] == owner[n - 1:]
+        rows.append(owner[:size][inside])
+        hashes.append(grams[inside])
+    if not rows:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint64)
+    return np.concatenate(rows), np.concatenate(hashes)
+
+
+def _ngrams(text):
+    """ عدد مرات كل n-gram حرفية (ببصمتها) في النص الموحد (بحدود كلمات). """
+    _, hashes = _gram_hashes([text])
+    grams, counts = np.unique(hashes, return_counts=True)
+    return dict(zip(grams.tolist(), counts.tolist()))
+
+
+class SimilarityIndex:
+    """ فهرس تشابه محلي لأسئلة FAQ: متجهات TF-IDF لـ n-gram حرفية في مصفوفة NumPy متفرقة (صف، عمود، قيمة). """
+
+    def __init__(self, threshold=DIRECT_ANSWER_THRESHOLD):
+        self.threshold = threshold
+        self.version = None  # جيل البيانات الذي بُني عليه الفهرس
+        self._pending_load = None
+        self._lock = threading.Lock()
+        self._reset()
+        self.queries = 0
+        self.direct_answers = 0
+
+    def _reset(self):
+        self._vocabulary = {}  # بصمة الـ n-gram -> رقم العمود
+        self._ids = []
+        self._answers = []
+        # العناصر غير الصفرية فقط: المصفوفة الكاملة (أسئلة × n-gram) لا تتسع للقواعد الكبيرة
+        self._rows = np.zeros(0, dtype=np.int32)
+        self._cols = np.zeros(0, dtype=np.int32)
+        self._tf = np.zeros(0, dtype=np.float32)
+        self._df = np.zeros(0, dtype=np.float32)
+        self._matrix = None  # أوزان TF-IDF وأطوال الصفوف؛ تُحسب عند أول استعلام بعد أي تعديل
+
+    def _add_many(self, rows):
+        """ إضافة (id، سؤال، جواب) لعدة أسئلة دفعة واحدة: n-gram كل الأسئلة تُحسب معًا. """
+        if not rows:
+            return
+        owners, hashes = _gram_hashes([question for _, question, _ in rows])
+        grams, inverse = np.unique(hashes, return_inverse=True)
+        columns = np.array([self._vocabulary.setdefault(gram, len(self._vocabulary)) for gram in grams.tolist()],
+                           dtype=np.int64)[inverse.reshape(-1)]
+        cells, counts = np.unique(owners * len(self._vocabulary) + columns, return_counts=True)
+        if len(self._vocabulary) > len(self._df):
+            self._df = np.pad(self._df, (0, len(self._vocabulary) - len(self._df)))
+        cols = (cells % len(self._vocabulary)).astype(np.int32)
+        self._rows = np.concatenate([self._rows, (cells // len(self._vocabulary) + len(self._ids)).astype(np.int32)])
+        self._cols = np.concatenate([self._cols, cols])
+        self._tf = np.concatenate([self._tf, 1 + np.log(counts.astype(np.float32))])
+        np.add.at(self._df, cols, 1)
+        self._ids.extend(faq_id for faq_id, _, _ in rows)
+        self._answers.extend(answer for _, _, answer in rows)
+        self._matrix = None
+
+    def load(self, conn, version=None):
+        """ إعادة بناء الفهرس كاملًا من جدول الأسئلة. """
+        rows = conn.execute("SELECT id, question, answer FROM faq").fetchall()
+        owners, hashes = _gram_hashes([question for _, question, _ in rows])
+        grams, columns = np.unique(hashes, return_inverse=True)
+        # عدّ كل (سؤال، n-gram) مرة واحدة لكل الأسئلة بدل حلقة بايثون على كل n-gram
+        cells, counts = np.unique(owners * len(grams) + columns.reshape(-1), return_counts=True)
+        with self._lock:
+            self._reset()
+            self._vocabulary = dict(zip(grams.tolist(), range(len(grams))))
+            self._rows = (cells // max(len(grams), 1)).astype(np.int32)
+            self._cols = (cells % max(len(grams), 1)).astype(np.int32)
+            self._tf = 1 + np.log(counts.astype(np.float32))
+            self._df = np.bincount(self._cols, minlength=len(grams)).astype(np.float32)
+            self._ids = [faq_id for faq_id, _, _ in rows]
+            self._answers = [answer for _, _, answer in rows]
+            self.version = version
+        logging.info(f"✅ تم بناء فهرس التشابه لـ {len(rows)} سؤالًا ({len(grams)} n-gram).")
+
+    def sync(self, storage, version):
+        """ إعادة البناء في الخلفية إذا تغيرت البيانات من خارج هذه العملية؛ الفهرس الحالي يبقى مستخدمًا حتى ينتهي. """
+        if version == self.version or self._pending_load is not None:
+            return
+        future = storage.submit(self.load, version)
+        self._pending_load = future
+        future.add_done_callback(self._load_done)
+
+    def _load_done(self, future):
+        self._pending_load = None
+        if future.exception() is not None:
+            logging.error(f"❌ خطأ في إعادة بناء فهرس التشابه: {future.exception()}")
+
+    def add(self, faq_id, question, answer):
+        """ إضافة سؤال جديد دون إعادة بناء الفهرس. """
+        self.add_many([(faq_id, question, answer)])
+
+    def add_many(self, rows):
+        with self._lock:
+            self._add_many(rows)
+
+    def remove(self, faq_id):
+        self.remove_many([faq_id])
+
+    def remove_many(self, faq_ids):
+        """ حذف عدة أسئلة بعملية واحدة على المصفوفات (ثم إعادة ترقيم الصفوف الباقية). """
+        with self._lock:
+            wanted = set(faq_ids)
+            removed_rows = np.array([i for i, faq_id in enumerate(self._ids) if faq_id in wanted], dtype=np.int64)
+            if not len(removed_rows):
+                return
+            removed = np.isin(self._rows, removed_rows)
+            np.subtract.at(self._df, self._cols[removed], 1)
+            keep = ~removed
+            # الرقم الجديد لكل صف = رقمه القديم ناقص عدد الصفوف المحذوفة قبله
+            shift = np.searchsorted(removed_rows, np.arange(len(self._ids)))
+            self._rows = (self._rows[keep] - shift[self._rows[keep]]).astype(np.int32)
+            self._cols = self._cols[keep]
+            self._tf = self._tf[keep]
+            kept = np.ones(len(self._ids), dtype=bool)
+            kept[removed_rows] = False
+            self._ids = [faq_id for faq_id, k in zip(self._ids, kept) if k]
+            self._answers = [answer for answer, k in zip(self._answers, kept) if k]
+            self._matrix = None
+
+    def _weights(self):
+        if self._matrix is None:
+            idf = (np.log((1 + len(self._ids)) / (1 + self._df)) + 1).astype(np.float32)
+            weighted = self._tf * idf[self._cols]
+            norms = np.sqrt(np.bincount(self._rows, weights=weighted * weighted, minlength=len(self._ids)))
+            norms[norms == 0] = 1
+            # ترتيب العناصر حسب العمود (فهرس مقلوب) حتى لا يلمس الاستعلام إلا n-gram الموجودة فيه
+            order = np.argsort(self._cols, kind="stable")
+            starts = np.zeros(len(idf) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(self._cols, minlength=len(idf)), out=starts[1:])
+            self._matrix = (self._rows[order], (weighted / norms[self._rows])[order], starts, idf)
+        return self._matrix
+
+    def match(self, message):
+        """ (الجواب المخزن، درجة التشابه) لأقرب سؤال إذا تجاوز الحد، وإلا None. """
+        self.queries += 1
+        if len(normalize_message(message)) < MIN_QUERY_CHARS:
+            return None
+        with self._lock:
+            if not self._ids:
+                return None
+            rows, weights, starts, idf = self._weights()
+            grams = _ngrams(message)
+            counts = {self._vocabulary[gram]: count for gram, count in grams.items() if gram in self._vocabulary}
+            if not counts:
+                return None
+            columns = np.fromiter(counts, dtype=np.int64, count=len(counts))
+            query = np.fromiter(((1 + math.log(c)) for c in counts.values()), dtype=np.float32,
+                                count=len(counts)) * idf[columns]
+            # n-gram غير الموجودة في أي سؤال (df=0) لا تشارك في الضرب لكنها تدخل في طول متجه الاستعلام،
+            # وإلا ارتفعت درجة سؤال يختلف عن المخزن بكلمة جديدة ("cancel" بدل "join")
+            unseen_idf = math.log(1 + len(self._ids)) + 1
+            unseen = sum(((1 + math.log(c)) * unseen_idf) ** 2 for gram, c in grams.items()
+                         if gram not in self._vocabulary)
+            query /= math.sqrt(float(np.dot(query, query)) + unseen)
+            # مواضع كل العناصر في أعمدة الاستعلام، ثم حاصل الضرب بعملية bincount واحدة
+            lengths = starts[columns + 1] - starts[columns]
+            offsets = np.repeat(starts[columns] - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+            scores = np.bincount(rows[offsets], weights=weights[offsets] * np.repeat(query, lengths),
+                                 minlength=len(self._ids))
+            best = int(np.argmax(scores))
+            score = float(scores[best])
+            answer = self._answers[best]
+        if score < self.threshold:
+            return None
+        self.direct_answers += 1
+        return answer, score
+
+    def stats(self):
+        return {
+            "queries": self.queries,
+            "direct_answers": self.direct_answers,
+            "rate": self.direct_answers / self.queries if self.queries else 0.0,
+            "size": len(self._ids),
+        }
@@ -0,0 +1,174 @@
+import os
+import time
+import queue
+import sqlite3
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from metrics import STAGE_SECONDS, timed
+
+
+FAQ_DB_PATH = os.getenv("FAQ_DB_PATH", "faq.db")
+DB_READ_WORKERS = int(os.getenv("DB_READ_WORKERS", 4))  # عدد خيوط القراءة (لكل خيط اتصال خاص به)
+DB_WRITE_BATCH_DELAY = float(os.getenv("DB_WRITE_BATCH_DELAY", 0.02))  # مهلة تجميع الكتابات في معاملة واحدة
+DB_WRITE_BATCH_SIZE = 100
+DB_BUSY_TIMEOUT = 30  # ثوانٍ انتظار القفل عند الكتابة من عمليات أخرى
+STATEMENT_CACHE_SIZE = 256  # عدد الاستعلامات المُحضّرة المحفوظة لكل اتصال
+
+
+def _log_write_error(future):
+    error = future.exception()
+    if error is not None:
+        logging.error(f"❌ خطأ في كتابة مؤجلة: {error}")
+
+
+class Storage:
+    """ طبقة تخزين SQLite: وضع WAL، اتصال لكل خيط، قراءات في منفذ مخصص وكتابات مجمعة في معاملات. """
+
+    def __init__(self, path=FAQ_DB_PATH, read_workers=DB_READ_WORKERS):
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._generation = 0  # يزيد عند إغلاق كل الاتصالات حتى تعيد الخيوط الاتصال
+        self._readers = ThreadPoolExecutor(max_workers=read_workers, thread_name_prefix="sqlite-read")
+        self._writes = queue.Queue()
+        self._writer = None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=DB_BUSY_TIMEOUT, check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE_SIZE)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT * 1000}")
+        with self._connections_lock:
+            self._connections.append(conn)
+        return conn
+
+    def connection(self):
+        """ اتصال الخيط الحالي (يُنشأ عند أول استخدام). """
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.generation != self._generation:
+            conn = self._connect()
+            self._local.conn = conn
+            self._local.generation = self._generation
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """ معاملة على اتصال الخيط الحالي: commit عند النجاح و rollback عند الخطأ. """
+        conn = self.connection()
+        with conn:
+            yield conn
+
+    # --- القراءة ---
+
+    def submit(self, fn, *args):
+        """ تشغيل fn(conn, *args) في خيط قراءة وإرجاع Future. """
+        return self._readers.submit(lambda: fn(self.connection(), *args))
+
+    async def run(self, fn, *args):
+        """ الواجهة غير المتزامنة للقراءة: لا تحجب حلقة الأحداث. """
+        with timed("db_read"):
+            return await asyncio.wrap_future(self.submit(fn, *args))
+
+    async def fetchall(self, sql, params=()):
+        return await self.run(lambda conn: conn.execute(sql, params).fetchall())
+
+    # --- الكتابة ---
+
+    def submit_write(self, fn, *args):
+        """ وضع fn(conn, *args) في طابور الكتابة؛ تُنفذ مع غيرها في معاملة واحدة. """
+        self._ensure_writer()
+        future = Future()
+        self._writes.put((fn, args, future))
+        return future
+
+    async def write(self, fn, *args):
+        return await asyncio.wrap_future(self.submit_write(fn, *args))
+
+    def write_sync(self, fn, *args):
+        """ كتابة من كود غير متزامن (التشغيل، أدوات سطر الأوامر) مع انتظار النتيجة. """
+        return self.submit_write(fn, *args).result()
+
+    def fire_and_forget(self, fn, *args):
+        """ كتابة لا ينتظر أحد نتيجتها؛ الأخطاء تُسجل فقط. """
+        future = self.submit_write(fn, *args)
+        future.add_done_callback(_log_write_error)
+        return future
+
+    def _ensure_writer(self):
+        if self._writer is None or not self._writer.is_alive():
+            self._writer = threading.Thread(target=self._write_loop, name="sqlite-write", daemon=True)
+            self._writer.start()
+
+    def _write_loop(self):
+        while True:
+            item = self._writes.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + DB_WRITE_BATCH_DELAY
+            while len(batch) < DB_WRITE_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._writes.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._writes.put(None)  # إعادة إشارة الإيقاف بعد إنهاء الدفعة
+                    break
+                batch.append(item)
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        conn = self.connection()
+        results = []
+        started = time.perf_counter()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, args, future in batch:
+                # نقطة حفظ لكل عملية حتى لا يُلغي فشل عملية واحدة باقي الدفعة
+                conn.execute("SAVEPOINT batch_op")
+                try:
+                    results.append((future, fn(conn, *args), None))
+                    conn.execute("RELEASE batch_op")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO batch_op")
+                    conn.execute("RELEASE batch_op")
+                    results.append((future, None, e))
+            conn.commit()
+        except Exception as e:
+            logging.error(f"❌ خطأ في تنفيذ دفعة الكتابة: {e}")
+            if conn.in_transaction:
+                conn.rollback()
+            results = [(future, None, e) for _, _, future in batch]
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage="db_write_batch")
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def close(self):
+        """ إغلاق كل الاتصالات؛ الخيوط تفتح اتصالات جديدة عند الاستخدام التالي. """
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+            self._generation += 1
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception as e:
+                logging.error(f"❌ خطأ في إغلاق اتصال قاعدة البيانات: {e}")
+
+    def shutdown(self):
+        if self._writer is not None and self._writer.is_alive():
+            self._writes.put(None)
+            self._writer.join(timeout=5)
+        self._readers.shutdown(wait=True)
+        self.close()
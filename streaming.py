@@ -0,0 +1,203 @@
+import os
+import time
+import asyncio
+import logging
+
+from telegram.error import BadRequest, RetryAfter
+
+from metrics import STAGE_SECONDS
+from llm_scheduler import SchedulerBusyError
+
+
+# أقل فاصل بين تعديلين لنفس المحادثة (Telegram يحد التعديلات، والمجموعات أشد من المحادثات الخاصة)
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", 1.0))
+STREAM_GROUP_EDIT_INTERVAL = float(os.getenv("STREAM_GROUP_EDIT_INTERVAL", 3.0))
+STREAM_MIN_DELTA = 20  # لا نعدل الرسالة من أجل بضعة أحرف جديدة فقط
+STREAM_CURSOR = " …"
+TELEGRAM_MAX_LENGTH = 4096
+
+STREAM_DRAIN_TIMEOUT = 10  # ثوانٍ لإنهاء التعديلات الأخيرة المعلقة عند الإيقاف
+LAST_EDIT_MAX_CHATS = 1024  # بعد هذا العدد تُحذف المحادثات التي انقضى فاصلها
+
+# وقت آخر تعديل لكل محادثة، مشترك بين كل الردود المتدفقة فيها
+_last_edit = {}
+# التعديلات الأخيرة تجري في الخلفية حتى لا ينتظر المعالج (ومكانه في حد التزامن) فاصل المجموعة
+_final_edits = set()
+
+
+def _mark_edit(chat_id, at):
+    _last_edit[chat_id] = at
+    if len(_last_edit) > LAST_EDIT_MAX_CHATS:
+        # مدخل انقضى فاصله لا يؤثر على التعديل التالي، فحذفه لا يغير شيئًا
+        expired = time.monotonic() - max(STREAM_EDIT_INTERVAL, STREAM_GROUP_EDIT_INTERVAL)
+        for key in [key for key, value in _last_edit.items() if value < expired]:
+            del _last_edit[key]
+
+
+def _fit(text, suffix=""):
+    """ نص جزئي أو كامل مقصوص ليتسع مع suffix وإغلاق Markdown في حد Telegram. """
+    limit = TELEGRAM_MAX_LENGTH - len(suffix) - 4  # مكان لرموز الإغلاق (``` مع سطر جديد)
+    return close_markdown(text[:limit] if len(text) > limit else text) + suffix
+
+
+def close_markdown(text):
+    """ إغلاق كيانات Markdown المفتوحة في نص جزئي حتى يقبله Telegram عند كل تعديل.
+
+    *عريض* و _مائل_ و `رمز` تُغلق بإضافة الرمز، وكتلة ``` تُغلق بسطر جديد، والرابط غير المكتمل يُحذف.
+    """
+    entity = None
+    start = 0
+    i = 0
+    while i < len(text):
+        if entity is None:
+            if text.startswith("```", i):
+                entity, start = "```", i
+                i += 3
+                continue
+            char = text[i]
+            if char == "\\":
+                i += 2
+                continue
+            if char in "*_`":
+                entity, start = char, i
+            elif char == "[":
+                entity, start = "[", i
+        elif entity == "```":
+            if text.startswith("```", i):
+                entity = None
+                i += 3
+                continue
+        elif entity == "[":
+            if text[i] == "]":
+                if text.startswith("](", i):
+                    entity = "("
+                    i += 2
+                    continue
+                entity = None
+        elif entity == "(":
+            if text[i] == ")":
+                entity = None
+        elif text[i] == entity:
+            entity = None
+        i += 1
+
+    if entity is None:
+        return text
+    if entity in ("[", "("):
+        return text[:start].rstrip()
+    body = text[start + len(entity):]
+    if not body.strip():
+        return text[:start].rstrip()
+    if entity == "```":
+        return text.rstrip() + "\n```"
+    return text.rstrip() + entity
+
+
+def _edit_interval(chat):
+    return STREAM_EDIT_INTERVAL if getattr(chat, "type", "private") == "private" else STREAM_GROUP_EDIT_INTERVAL
+
+
+def _retry_seconds(error):
+    retry_after = error.retry_after
+    return retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+
+
+async def _edit(sent, text, parse_mode):
+    """ تعديل وسيط؛ False إذا رفضه Telegram (Markdown غير صالح أو حد التعديلات) فيُترك للتعديل التالي. """
+    try:
+        await sent.edit_text(text, parse_mode=parse_mode)
+        return True
+    except RetryAfter as e:
+        _mark_edit(sent.chat_id, time.monotonic() + _retry_seconds(e))
+        return False
+    except BadRequest as e:
+        if "not modified" in str(e).lower():
+            return True
+        logging.warning(f"⚠️ تعذر تعديل الرد المتدفق: {e}")
+        return False
+
+
+async def _final_edit(sent, text, parse_mode, interval):
+    """ التعديل الأخير لا يُتخطى: ينتظر الفاصل أو retry_after، ويرجع إلى نص عادي إذا كان Markdown الكامل غير صالح. """
+    for _ in range(3):
+        wait = _last_edit.get(sent.chat_id, 0) + interval - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        _mark_edit(sent.chat_id, time.monotonic())
+        try:
+            await sent.edit_text(text, parse_mode=parse_mode)
+            return
+        except RetryAfter as e:
+            _mark_edit(sent.chat_id, time.monotonic() + _retry_seconds(e) - interval)
+        except BadRequest as e:
+            if "not modified" in str(e).lower():
+                return
+            logging.warning(f"⚠️ Markdown غير صالح في الرد الكامل، سيُرسل نصًا عاديًا: {e}")
+            parse_mode = None
+    logging.error("❌ تعذر إكمال الرد المتدفق بعد عدة محاولات.")
+
+
+def _schedule_final_edit(sent, text, parse_mode, interval):
+    task = asyncio.get_running_loop().create_task(_final_edit(sent, text, parse_mode, interval))
+    _final_edits.add(task)
+    task.add_done_callback(_final_edits.discard)
+
+
+async def drain_final_edits(timeout=STREAM_DRAIN_TIMEOUT):
+    """ انتظار التعديلات الأخيرة المعلقة قبل الإيقاف. """
+    if _final_edits:
+        await asyncio.wait(set(_final_edits), timeout=timeout)
+
+
+async def stream_reply(message, chunks, parse_mode="Markdown", error_reply=None, timeout_reply=None, busy_reply=None):
+    """ إرسال رد Gemini المتدفق: رسالة أولى مع أول جزء، ثم تعديلات متباعدة، ثم النص الكامل.
+
+    يعيد النص الكامل، أو None إذا فشل التدفق (يُرسل عندها error_reply أو timeout_reply أو busy_reply للطالب).
+    التعديل الأخير يُجدول في الخلفية ولا يُنتظر هنا.
+    """
+    started = time.perf_counter()
+    interval = _edit_interval(message.chat)
+    chat_id = message.chat_id
+    text = ""
+    shown = ""
+    sent = None
+    failed, failure = False, None
+    try:
+        async for chunk in chunks:
+            text += chunk
+            if sent is None:
+                sent = await message.reply_text(_fit(text, STREAM_CURSOR), parse_mode=parse_mode)
+                _mark_edit(chat_id, time.monotonic())
+                # الزمن الذي ينتظره الطالب فعليًا قبل أن يرى بداية الرد
+                STAGE_SECONDS.observe(time.perf_counter() - started, stage="first_chunk")
+                shown = text
+                continue
+            if len(text) - len(shown) < STREAM_MIN_DELTA or time.monotonic() - _last_edit.get(chat_id, 0) < interval:
+                continue
+            _mark_edit(chat_id, time.monotonic())
+            if await _edit(sent, _fit(text, STREAM_CURSOR), parse_mode):
+                shown = text
+    except asyncio.TimeoutError:
+        logging.error("❌ انتهت مهلة الرد المتدفق من Gemini.")
+        failed, failure = True, timeout_reply or error_reply
+    except SchedulerBusyError as e:
+        logging.warning(f"⚠️ طابور Gemini مزدحم، سقط الرد المتدفق ({e.reason}).")
+        failed, failure = True, busy_reply or error_reply
+    except Exception as e:
+        logging.error(f"❌ خطأ في الرد المتدفق من Gemini: {e}")
+        failed, failure = True, error_reply
+
+    if sent is None:
+        if not failed:
+            logging.error("❌ لم يتم استقبال نص من Gemini.")
+            failure = error_reply
+        if failure:
+            await message.reply_text(failure)
+        return None
+    # التعديل الأخير (بعد فاصل المحادثة) في الخلفية: الرد كامل عند المعالج، فلا داعي لحجز مكانه حتى يُعرض
+    if failed:
+        # نبقي ما وصل من الرد ونوضح أنه غير مكتمل
+        _schedule_final_edit(sent, _fit(text, "\n\n" + failure if failure else ""), parse_mode, interval)
+        return None
+    _schedule_final_edit(sent, _fit(text), parse_mode, interval)
+    return text
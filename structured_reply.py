@@ -0,0 +1,67 @@
+import json
+import re
+import logging
+
+
+INTENTS = ("1", "2", "3", "4", "5", "6")
+VOCABULARY_FIELDS = ("word", "meaning", "arabic", "example", "closing")
+
+# مخطط الرد المنظم: النية مع الرد الجاهز في طلب واحد
+GROUP_REPLY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "intent": {"type": "string", "enum": list(INTENTS)},
+        "answer": {"type": "string"},
+        "vocabulary": {
+            "type": "object",
+            "properties": {field: {"type": "string"} for field in VOCABULARY_FIELDS},
+        },
+    },
+    "required": ["intent"],
+}
+
+STRUCTURED_GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": GROUP_REPLY_SCHEMA,
+}
+
+_INTENT_DIGIT = re.compile(r"[1-6]")
+
+
+def parse_intent(text):
+    """ استخراج رقم النية من رد Gemini بدل str(int(...)) الذي يفشل مع أي نص إضافي. """
+    match = _INTENT_DIGIT.search(text or "")
+    return match.group(0) if match else None
+
+
+def parse_structured_reply(text):
+    """ التحقق من الرد المنظم وإرجاع dict فيه intent و answer و vocabulary، أو None إذا خالف المخطط. """
+    try:
+        data = json.loads(text)
+    except (TypeError, ValueError):
+        logging.warning("⚠️ الرد المنظم ليس JSON صالحًا.")
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    intent = str(data.get("intent", "")).strip()
+    if intent not in INTENTS:
+        return None
+
+    answer = data.get("answer")
+    if not isinstance(answer, str) or not answer.strip():
+        answer = None
+    vocabulary = data.get("vocabulary")
+    if isinstance(vocabulary, dict) and all(isinstance(vocabulary.get(f), str) and vocabulary[f].strip()
+                                            for f in VOCABULARY_FIELDS):
+        vocabulary = {f: vocabulary[f].strip() for f in VOCABULARY_FIELDS}
+    else:
+        vocabulary = None
+
+    # النوايا التي تتطلب ردًا يجب أن تحمل الرد، وإلا نرجع لمسار الطلبين
+    if intent in ("1", "3") and answer is None:
+        return None
+    if intent == "6" and vocabulary is None:
+        return None
+    return {"intent": intent, "answer": answer, "vocabulary": vocabulary}
+
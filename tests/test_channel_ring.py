@@ -0,0 +1,54 @@
+import pytest
+
+from storage import Storage
+from channel_ring import ChannelRing, ensure_channel_ring_schema, migrate_channel_messages
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = Storage(str(tmp_path / "faq.db"))
+    with storage.transaction() as conn:
+        ensure_channel_ring_schema(conn.cursor())
+    yield storage
+    storage.shutdown()
+
+
+def rows(storage):
+    return storage.connection().execute("SELECT slot, seq, text FROM channel_ring ORDER BY slot").fetchall()
+
+
+def test_ring_overwrites_the_oldest_slot(storage):
+    ring = ChannelRing(storage, size=3)
+    for i in range(5):
+        ring.append(i, -200, f"post {i}").result()
+    assert ring.recent() == ["post 4", "post 3", "post 2"]
+    assert rows(storage) == [(0, 3, "post 3"), (1, 4, "post 4"), (2, 2, "post 2")]
+
+    # بعد إعادة التشغيل تستمر الأرقام من حيث توقفت
+    restarted = ChannelRing(storage, size=3)
+    restarted.hydrate()
+    assert restarted.recent() == ["post 4", "post 3", "post 2"]
+    restarted.append(5, -200, "post 5").result()
+    assert rows(storage)[2] == (2, 5, "post 5")
+
+
+def test_hydrate_reslots_when_the_size_shrinks(storage):
+    ring = ChannelRing(storage, size=4)
+    for i in range(6):
+        ring.append(i, -200, f"post {i}").result()
+    smaller = ChannelRing(storage, size=2)
+    smaller.hydrate()
+    assert smaller.recent() == ["post 5", "post 4"]
+    assert rows(storage) == [(0, 4, "post 4"), (1, 5, "post 5")]
+
+
+def test_migrate_channel_messages_moves_the_latest_rows(storage):
+    with storage.transaction() as conn:
+        conn.execute("CREATE TABLE channel_messages (id INTEGER PRIMARY KEY AUTOINCREMENT, message_id INTEGER, "
+                     "chat_id INTEGER, text TEXT)")
+        conn.executemany("INSERT INTO channel_messages (message_id, chat_id, text) VALUES (?, -200, ?)",
+                         [(i, f"old {i}") for i in range(4)])
+        migrate_channel_messages(conn.cursor(), size=3)
+        migrate_channel_messages(conn.cursor(), size=3)  # مرة ثانية: الجدول القديم لم يعد موجودًا
+        assert conn.execute("SELECT name FROM sqlite_master WHERE name = 'channel_messages'").fetchone() is None
+    assert rows(storage) == [(0, 0, "old 1"), (1, 1, "old 2"), (2, 2, "old 3")]
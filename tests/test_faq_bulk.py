@@ -0,0 +1,55 @@
+import sqlite3
+
+import pytest
+
+from faq_bulk import ensure_faq_schema, import_rows, iter_faq_chunks, parse_rows
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    ensure_faq_schema(conn.cursor())
+    yield conn
+    conn.close()
+
+
+def faq(conn):
+    return conn.execute("SELECT question, answer, category FROM faq ORDER BY id").fetchall()
+
+
+def test_duplicates_in_the_file_collapse_to_the_last_copy(conn):
+    rows = [("How do I join?", "old", "a"), ("Other?", "x", None), ("how do i JOIN", "new", "b")]
+    inserted, updated, skipped = import_rows(conn, rows)
+    assert [q for _, q, _ in inserted] == ["how do i JOIN", "Other?"]
+    assert (updated, skipped) == ([], 1)
+    assert sorted(faq(conn)) == [("Other?", "x", None), ("how do i JOIN", "new", "b")]
+
+
+def test_existing_questions_are_updated_or_skipped(conn):
+    conn.execute("INSERT INTO faq (question, answer, category) VALUES ('What is the fee?', 'free', 'c')")
+    rows = [("what is the FEE", "10$", "c"), ("New question", "answer", None)]
+
+    inserted, updated, skipped = import_rows(conn, rows, update_existing=False)
+    assert (len(inserted), updated, skipped) == (1, [], 1)
+    assert faq(conn)[0] == ("What is the fee?", "free", "c")
+
+    inserted, updated, skipped = import_rows(conn, rows)
+    assert (inserted, skipped) == ([], 0)  # السؤال المضاف أعلاه صار موجودًا أيضًا
+    assert [faq_id for faq_id, _, _ in updated] == [1, 2]
+    assert faq(conn)[0] == ("What is the fee?", "10$", "c")
+
+
+def test_csv_with_and_without_a_header_row():
+    with_header = "answer,question,category\nyes,Is it free?,fees\n"
+    without_header = "Is it free?,yes,fees\n,missing question,\nWhen?,Sunday\n"
+    assert list(parse_rows(with_header.encode("utf-8-sig"), "csv")) == [("Is it free?", "yes", "fees")]
+    assert list(parse_rows(without_header, "csv")) == [("Is it free?", "yes", "fees"), ("When?", "Sunday", None)]
+
+
+def test_export_reads_in_keyset_chunks(conn):
+    conn.executemany("INSERT INTO faq (question, answer, category) VALUES (?, ?, NULL)",
+                     [(f"q{i}", f"a{i}") for i in range(7)])
+    conn.execute("DELETE FROM faq WHERE id = 3")  # ثغرة في المعرفات لا تُسقط صفوفًا
+    chunks = list(iter_faq_chunks(conn, chunk_size=3))
+    assert [len(chunk) for chunk in chunks] == [3, 3]
+    assert [row[0] for chunk in chunks for row in chunk] == [1, 2, 4, 5, 6, 7]
@@ -0,0 +1,89 @@
+import asyncio
+import sqlite3
+import time
+
+import pytest
+
+from storage import Storage
+from faq_bulk import ensure_faq_schema
+from channel_ring import ensure_channel_ring_schema
+from faq_cache import FaqSnapshotCache, ensure_generation_schema, read_generation
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = Storage(str(tmp_path / "faq.db"))
+    with storage.transaction() as conn:
+        cur = conn.cursor()
+        ensure_faq_schema(cur)
+        ensure_channel_ring_schema(cur)
+        ensure_generation_schema(cur)
+    yield storage
+    storage.shutdown()
+
+
+def test_channel_posts_do_not_change_the_faq_generation(storage):
+    cache = FaqSnapshotCache(storage)
+    before = cache.refresh()
+    storage.write_sync(lambda conn: conn.execute(
+        "INSERT INTO channel_ring (slot, seq, message_id, chat_id, text) VALUES (0, 0, 1, -200, 'lesson')"))
+    after = cache.refresh()
+    assert after.version == before.version
+    assert after.channel_version == before.channel_version + 1
+    assert after.channel_texts == ["lesson"]
+
+    storage.write_sync(lambda conn: conn.execute(
+        "INSERT INTO faq (question, answer, category) VALUES ('q', 'a', 'c')"))
+    assert cache.refresh().version == before.version + 1
+
+
+def test_old_channel_triggers_are_replaced(storage):
+    with storage.transaction() as conn:
+        conn.execute("""CREATE TRIGGER channel_ring_gen_ai AFTER INSERT ON channel_ring BEGIN
+                UPDATE meta SET value = value + 1 WHERE key = 'faq_generation';
+            END""")
+        ensure_generation_schema(conn.cursor())
+    storage.write_sync(lambda conn: conn.execute(
+        "INSERT INTO channel_ring (slot, seq, message_id, chat_id, text) VALUES (0, 0, 1, -200, 'lesson')"))
+    assert read_generation(storage.connection().cursor()) == (0, 1)
+
+
+def wait_for_check(cache):
+    deadline = time.monotonic() + 5
+    while cache._pending_check is not None and not cache._pending_check.done() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_snapshot_follows_writes_from_other_processes(storage, tmp_path):
+    cache = FaqSnapshotCache(storage, check_interval=0)
+    first = cache.get()
+    assert cache.get() is first  # لا تغيير: نفس النسخة دون إعادة تحميل
+    wait_for_check(cache)
+
+    other = sqlite3.connect(str(tmp_path / "faq.db"))
+    with other:
+        other.execute("INSERT INTO faq (question, answer, category) VALUES ('q', 'a', 'c')")
+    other.close()
+    assert cache.get() is first  # النسخة الحالية تُعاد فورًا والتحقق في الخلفية
+    wait_for_check(cache)
+    assert cache.get().faq_entries == [("q", "a")]
+
+
+def test_search_results_are_memoized_per_generation(storage):
+    cache = FaqSnapshotCache(storage, check_interval=3600)
+    calls = []
+
+    def search(conn, query, k):
+        calls.append(query)
+        return [(query, str(k))]
+
+    async def run():
+        await cache.search("join", 5, search)
+        await cache.search("join", 5, search)
+        storage.write_sync(lambda conn: conn.execute(
+            "INSERT INTO faq (question, answer, category) VALUES ('q', 'a', 'c')"))
+        await cache.refresh_async()
+        return await cache.search("join", 5, search)
+
+    assert asyncio.run(run()) == [("join", "5")]
+    assert calls == ["join", "join"]
@@ -0,0 +1,50 @@
+import sqlite3
+
+import intent_classifier
+from intent_classifier import IntentClassifier, ensure_intent_log_schema
+from response_cache import EVICTION_EVERY
+
+
+def test_single_words_are_not_vocabulary_questions():
+    classifier = IntentClassifier(storage=None)
+    for message in ("yes", "nice", "done", "really?"):
+        assert classifier.classify(message) is None or classifier.classify(message)[0] != "6"
+
+
+def test_explicit_meaning_questions_are_classified_locally():
+    classifier = IntentClassifier(storage=None)
+    for message in ("what does serendipity mean?", "serendipity meaning?", "ما معنى resilient"):
+        assert classifier.classify(message)[0] == "6"
+
+
+def test_only_invite_and_shortener_links_are_violations():
+    classifier = IntentClassifier(storage=None)
+    assert classifier.classify("join https://t.me/joinchat/AbCd")[0] == "4"
+    assert classifier.classify("free signals bit.ly/xyz")[0] == "4"
+    for message in ("see lesson t.me/our_channel/123", "https://dictionary.cambridge.org/dictionary/english/resilient"):
+        result = classifier.classify(message)
+        assert result is None or result[0] != "4"
+
+
+class MemoryStorage:
+    def __init__(self):
+        self.conn = sqlite3.connect(":memory:")
+        ensure_intent_log_schema(self.conn.cursor())
+
+    def fire_and_forget(self, fn, *args):
+        fn(self.conn, *args)
+
+    def connection(self):
+        return self.conn
+
+
+def test_intent_log_is_capped(monkeypatch):
+    monkeypatch.setattr(intent_classifier, "INTENT_TRAINING_LIMIT", 30)
+    storage = MemoryStorage()
+    classifier = IntentClassifier(storage)
+    storage.conn.execute("INSERT INTO intent_log (message, intent, created_at) VALUES ('old', '1', 0)")
+    for i in range(EVICTION_EVERY * 2):
+        classifier.record(f"message {i}", "1")
+    count = storage.conn.execute("SELECT COUNT(*) FROM intent_log").fetchone()[0]
+    assert count <= 30
+    assert storage.conn.execute("SELECT COUNT(*) FROM intent_log WHERE message = 'old'").fetchone()[0] == 0
@@ -0,0 +1,144 @@
+import time
+import asyncio
+
+import pytest
+
+import llm
+from llm import CircuitBreaker, CircuitOpenError, GeminiClient, RetryBudget
+
+
+class Response:
+    def __init__(self, text):
+        self.text = text
+
+
+class SlowFirstModel:
+    """ أول طلب بطيء ثم الباقي سريع: نسخة التحوط تفوز إذا أُرسلت. """
+
+    def __init__(self, first_delay=0.3):
+        self.first_delay = first_delay
+        self.calls = 0
+
+    def generate_content(self, prompt, **kwargs):
+        self.calls += 1
+        if self.calls == 1:
+            time.sleep(self.first_delay)
+            return Response("slow")
+        return Response("fast")
+
+
+def test_hedge_uses_a_free_scheduler_slot():
+    client = GeminiClient(SlowFirstModel(), max_concurrency=2, attempt_timeout=5)
+    text = asyncio.run(client.generate("p", hedge_after=0.05, retries=0))
+    assert text == "fast"
+    assert client.hedges == 1
+    assert client.scheduler.free == 2
+
+
+def test_hedge_is_skipped_when_no_slot_is_free():
+    model = SlowFirstModel(first_delay=0.2)
+    client = GeminiClient(model, max_concurrency=1, attempt_timeout=5)
+    text = asyncio.run(client.generate("p", hedge_after=0.05, retries=0))
+    assert text == "slow"
+    assert client.hedges == 0 and model.calls == 1
+    assert client.scheduler.free == 1
+
+
+class FailingModel:
+    def __init__(self, failures, error=ConnectionError):
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+
+    def generate_content(self, prompt, **kwargs):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error("unavailable")
+        return Response("ok")
+
+
+def test_breaker_opens_then_half_open_probe_closes_it(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(llm.time, "monotonic", lambda: clock[0])
+    breaker = CircuitBreaker(threshold=2, cooldown=30)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == breaker.OPEN and not breaker.allow() and not breaker.available()
+
+    clock[0] += 30
+    assert breaker.allow() and breaker.state == breaker.HALF_OPEN
+    assert not breaker.allow()  # طلب تجريبي واحد فقط
+    breaker.record_success()
+    assert breaker.state == breaker.CLOSED and breaker.allow()
+
+
+def test_failed_half_open_probe_reopens_the_breaker(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(llm.time, "monotonic", lambda: clock[0])
+    breaker = CircuitBreaker(threshold=1, cooldown=30)
+    breaker.allow()
+    breaker.record_failure()
+    clock[0] += 30
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == breaker.OPEN and breaker.opens == 2 and not breaker.allow()
+
+
+def test_open_breaker_rejects_without_calling_the_model():
+    model = FailingModel(failures=0)
+    client = GeminiClient(model)
+    client.breaker.state = client.breaker.OPEN
+    client.breaker.opened_at = time.monotonic()
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(client.generate("p"))
+    assert model.calls == 0
+
+
+def test_retries_stop_when_the_budget_is_exhausted(monkeypatch):
+    monkeypatch.setattr(llm, "GEMINI_RETRY_BASE_DELAY", 0.001)
+    model = FailingModel(failures=10)
+    client = GeminiClient(model, attempt_timeout=1)
+    client.budget = RetryBudget(ratio=0, capacity=1)
+    with pytest.raises(ConnectionError):
+        asyncio.run(client.generate("p", retries=5))
+    assert model.calls == 2  # المحاولة الأولى + إعادة واحدة من الرصيد
+    assert client.retries == 1 and client.budget.tokens == 0
+
+
+def test_transient_error_is_retried_within_the_budget(monkeypatch):
+    monkeypatch.setattr(llm, "GEMINI_RETRY_BASE_DELAY", 0.001)
+    model = FailingModel(failures=1)
+    client = GeminiClient(model, attempt_timeout=1)
+    assert asyncio.run(client.generate("p", retries=2)) == "ok"
+    assert model.calls == 2 and client.breaker.failures == 0
+
+
+def test_request_errors_are_not_retried():
+    model = FailingModel(failures=1, error=ValueError)
+    client = GeminiClient(model, attempt_timeout=1)
+    with pytest.raises(ValueError):
+        asyncio.run(client.generate("p", retries=2))
+    assert model.calls == 1 and client.breaker.state == client.breaker.CLOSED
+
+
+def test_first_attempt_wins_when_the_hedge_is_slower():
+    class SlowHedgeModel:
+        calls = 0
+
+        def generate_content(self, prompt, **kwargs):
+            self.calls += 1
+            first = self.calls == 1
+            time.sleep(0.1 if first else 0.5)
+            return Response("first" if first else "hedge")
+
+    client = GeminiClient(SlowHedgeModel(), max_concurrency=2, attempt_timeout=5)
+    assert asyncio.run(client.generate("p", hedge_after=0.05, retries=0)) == "first"
+    assert client.hedges == 1 and client.scheduler.free == 2
+
+
+def test_hedge_needs_retry_budget():
+    client = GeminiClient(SlowFirstModel(first_delay=0.15), max_concurrency=2, attempt_timeout=5)
+    client.budget = RetryBudget(ratio=0, capacity=0)
+    assert asyncio.run(client.generate("p", hedge_after=0.05, retries=0)) == "slow"
+    assert client.hedges == 0 and client.scheduler.free == 2
@@ -0,0 +1,106 @@
+import asyncio
+
+import pytest
+
+from llm_scheduler import (
+    PRIORITY_ADMIN,
+    PRIORITY_COMPOSITION,
+    PRIORITY_GROUP,
+    PRIORITY_PRIVATE,
+    LlmScheduler,
+    SchedulerBusyError,
+    llm_priority,
+)
+
+
+async def wait_for_slot(scheduler, priority, order, tag):
+    await scheduler.acquire(priority)
+    order.append(tag)
+    scheduler.release()
+
+
+def test_waiting_requests_are_served_by_priority():
+    async def run():
+        scheduler = LlmScheduler(1)
+        await scheduler.acquire(PRIORITY_GROUP)
+        order = []
+        tasks = [asyncio.create_task(wait_for_slot(scheduler, priority, order, tag))
+                 for tag, priority in (("composition", PRIORITY_COMPOSITION), ("group", PRIORITY_GROUP),
+                                       ("admin", PRIORITY_ADMIN), ("private", PRIORITY_PRIVATE))]
+        await asyncio.sleep(0)
+        scheduler.release()
+        await asyncio.gather(*tasks)
+        return order, scheduler.free
+
+    order, free = asyncio.run(run())
+    assert order == ["admin", "private", "group", "composition"]
+    assert free == 1
+
+
+def test_full_queue_evicts_the_lowest_priority_request():
+    async def run():
+        scheduler = LlmScheduler(1, max_depth=2)
+        await scheduler.acquire(PRIORITY_ADMIN)
+        group = asyncio.create_task(scheduler.acquire(PRIORITY_GROUP))
+        composition = asyncio.create_task(scheduler.acquire(PRIORITY_COMPOSITION))
+        await asyncio.sleep(0)
+        private = asyncio.create_task(scheduler.acquire(PRIORITY_PRIVATE))
+        await asyncio.sleep(0)
+        with pytest.raises(SchedulerBusyError) as evicted:
+            await composition
+        # طلب بأقل أولوية من كل المنتظرين يُرفض هو نفسه
+        with pytest.raises(SchedulerBusyError) as full:
+            await scheduler.acquire(PRIORITY_COMPOSITION)
+        scheduler.release()
+        await private
+        scheduler.release()
+        await group
+        scheduler.release()
+        return evicted.value.reason, full.value.reason, scheduler.shed
+
+    evicted, full, shed = asyncio.run(run())
+    assert (evicted, full) == ("evicted", "full")
+    assert shed == {"full": 1, "evicted": 1, "expired": 0}
+
+
+def test_request_expires_after_its_class_max_wait():
+    async def run():
+        scheduler = LlmScheduler(1, max_wait={PRIORITY_GROUP: 0.05, PRIORITY_PRIVATE: 1})
+        await scheduler.acquire(PRIORITY_ADMIN)
+        private = asyncio.create_task(scheduler.acquire(PRIORITY_PRIVATE))
+        with pytest.raises(SchedulerBusyError) as expired:
+            await scheduler.acquire(PRIORITY_GROUP)
+        scheduler.release()
+        await private  # الفئة ذات الانتظار الأطول ما زالت تنتظر
+        return expired.value.reason, scheduler.shed["expired"], scheduler.depth()
+
+    assert asyncio.run(run()) == ("expired", 1, 0)
+
+
+def test_request_timeout_bounds_the_class_max_wait():
+    async def run():
+        scheduler = LlmScheduler(1)  # المشرف ينتظر بلا حد إلا مهلة الطلب نفسه
+        await scheduler.acquire(PRIORITY_ADMIN)
+        with pytest.raises(SchedulerBusyError) as expired:
+            await scheduler.acquire(PRIORITY_ADMIN, timeout=0.05)
+        return expired.value.reason
+
+    assert asyncio.run(run()) == "expired"
+
+
+def test_llm_priority_is_reset_after_the_block():
+    async def run():
+        scheduler = LlmScheduler(1)
+        await scheduler.acquire(PRIORITY_GROUP)
+        order = []
+        with llm_priority(PRIORITY_COMPOSITION):
+            composition = asyncio.create_task(wait_for_slot(scheduler, None, order, "composition"))
+        with llm_priority(PRIORITY_ADMIN):
+            admin = asyncio.create_task(wait_for_slot(scheduler, None, order, "admin"))
+        group = asyncio.create_task(wait_for_slot(scheduler, None, order, "group"))
+        await asyncio.sleep(0)
+        scheduler.release()
+        await asyncio.gather(composition, admin, group)
+        return order
+
+    assert asyncio.run(run()) == ["admin", "group", "composition"]
@@ -0,0 +1,40 @@
+import pytest
+
+import metrics
+
+
+@pytest.fixture
+def registry():
+    # مقاييس الاختبار تُزال من السجل العام بعده حتى لا تظهر في render لاختبارات أخرى
+    before = list(metrics._REGISTRY)
+    yield
+    metrics._REGISTRY[:] = before
+
+
+def test_render_counter_gauge_and_escaped_labels(registry):
+    counter = metrics.Counter("test_events", "Test events.", ("kind",))
+    gauge = metrics.Gauge("test_depth", "Test depth.")
+    counter.inc(kind='say "hi"\\now')
+    counter.inc(2, kind='say "hi"\\now')
+    gauge.set(3)
+    text = metrics.render()
+    assert text.endswith("\n")
+    assert "# TYPE test_events_total counter\n" in text
+    assert 'test_events_total{kind="say \\"hi\\"\\\\now"} 3\n' in text
+    assert "# TYPE test_depth gauge\ntest_depth 3\n" in text
+
+
+def test_render_histogram_buckets_are_cumulative(registry):
+    histogram = metrics.Histogram("test_seconds", "Test durations.", ("stage",), buckets=(1, 0.1))
+    for value in (0.05, 0.5, 0.5, 7):
+        histogram.observe(value, stage="db")
+    lines = histogram.render()
+    assert lines[1] == "# TYPE test_seconds histogram"
+    assert lines[2:] == [
+        'test_seconds_bucket{stage="db",le="0.1"} 1',
+        'test_seconds_bucket{stage="db",le="1.0"} 3',
+        'test_seconds_bucket{stage="db",le="+Inf"} 4',
+        'test_seconds_sum{stage="db"} 8.05',
+        'test_seconds_count{stage="db"} 4',
+    ]
+    assert "\n".join(lines) in metrics.render()
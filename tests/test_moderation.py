@@ -0,0 +1,17 @@
+from moderation import Moderator, load_patterns
+
+
+def test_topic_words_are_not_blocked_by_default():
+    moderator = Moderator(load_patterns(path=None, extra=""))
+    assert moderator.check(1, 10, 100, "هل يوجد حل واجبات الوحدة الثالثة؟") is None
+    assert moderator.check(1, 11, 101, "what does forex mean?") is None
+    verdict = moderator.check(1, 12, 102, "join us https://t.me/joinchat/abc")
+    assert verdict is not None and verdict.reason == "pattern"
+
+
+def test_topic_words_load_from_patterns_file(tmp_path):
+    path = tmp_path / "patterns.txt"
+    path.write_text("# كلمات هذه المجموعة\nforex\n", encoding="utf-8")
+    moderator = Moderator(load_patterns(path=str(path), extra=""))
+    verdict = moderator.check(1, 10, 100, "best forex signals here")
+    assert verdict is not None and verdict.pattern == "forex"
@@ -0,0 +1,28 @@
+import time
+import asyncio
+
+import outbound
+
+
+def test_spaced_group_sends_are_throttled(monkeypatch):
+    """ رسائل متباعدة قليلًا لا تحصل على حصة جديدة كلما فرغ طابور المحادثة. """
+    monkeypatch.setattr(outbound, "OUTBOUND_GLOBAL_LIMIT", (0, 1))
+    monkeypatch.setattr(outbound, "OUTBOUND_GROUP_LIMIT", (10, 1))  # 10 رسائل في الثانية، بعد دفعة من 3
+    sent = []
+
+    async def send():
+        sent.append(time.monotonic())
+
+    async def run():
+        queue = outbound.OutboundQueue()
+        started = time.monotonic()
+        for _ in range(10):
+            queue.send(-100, send)
+            await asyncio.sleep(0.05)
+        await queue.close()
+        return started
+
+    started = asyncio.run(run())
+    assert len(sent) == 10
+    # 3 رموز في البداية + 10 في الثانية: الرسالة العاشرة لا تخرج قبل 0.7 ثانية (دون الحد: 0.45 ثانية)
+    assert sent[-1] - started >= 0.65
@@ -0,0 +1,22 @@
+import pytest
+
+from prompts import build_prompt
+
+
+def test_prompt_stays_within_budget_when_required_sections_are_too_long():
+    message = "I goes to school every day. " * 100
+    prompt = build_prompt("grammar", message, max_chars=2000, user_name="Sam")
+    assert len(prompt) <= 2000
+    assert "I goes to school" in prompt
+
+
+def test_context_rows_are_dropped_before_the_message():
+    context = [(f"question {i}", "answer " * 40) for i in range(20)]
+    prompt = build_prompt("faq", "how do I join?", context, max_chars=1200)
+    assert len(prompt) <= 1200
+    assert "how do I join?" in prompt and "question 0" in prompt and "question 19" not in prompt
+
+
+def test_template_longer_than_budget_is_an_error():
+    with pytest.raises(ValueError):
+        build_prompt("composition", "hello", max_chars=100, user_name="Sam")
@@ -0,0 +1,83 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+import pytz
+
+import rate_limit
+from rate_limit import RateLimiter, ensure_rate_limit_schema, window_start_for
+from storage import Storage
+
+KHARTOUM = pytz.timezone("Africa/Khartoum")
+
+
+def test_daily_window_starts_at_khartoum_midnight():
+    # 01:30 بتوقيت الخرطوم (23:30 UTC من اليوم السابق) ما زالت في نفس اليوم المحلي
+    now = KHARTOUM.localize(datetime(2026, 3, 10, 1, 30)).timestamp()
+    start = window_start_for(now, 86400)
+    assert datetime.fromtimestamp(start, KHARTOUM) == KHARTOUM.localize(datetime(2026, 3, 10))
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = Storage(str(tmp_path / "faq.db"))
+    with storage.transaction() as conn:
+        ensure_rate_limit_schema(conn.cursor())
+    yield storage
+    storage.shutdown()
+
+
+def test_sliding_window_counts_the_previous_window(storage, monkeypatch):
+    clock = [window_start_for(1_800_000_000, 100) + 90]
+    monkeypatch.setattr(rate_limit.time, "time", lambda: clock[0])
+    limiter = RateLimiter(storage, quotas={"group": (4, 100)}, flush_interval=3600)
+
+    async def run():
+        results = [await limiter.allow("group", 7) for _ in range(5)]
+        # بعد حدود النافذة بربعها: 4 × 0.75 = 3 من النافذة السابقة، فمكان واحد فقط
+        clock[0] += 35
+        results += [await limiter.allow("group", 7) for _ in range(2)]
+        # بعد نافذتين كاملتين لا يبقى شيء من القديم
+        clock[0] += 200
+        results.append(await limiter.allow("group", 7))
+        return results
+
+    assert asyncio.run(run()) == [True] * 4 + [False] + [True, False] + [True]
+
+
+def test_upsert_merges_counts_from_other_processes(storage):
+    now = 1_800_000_000.0
+    first = RateLimiter(storage, quotas={"group": (100, 100)})
+    second = RateLimiter(storage, quotas={"group": (100, 100)})
+    start = window_start_for(now, 100)
+    for limiter, count in ((first, 3), (second, 2)):
+        storage.write_sync(limiter._write_rows, [("group:7", start, 100, count, 0, now)], now)
+    assert storage.connection().execute(
+        "SELECT window_start, count, prev_count FROM rate_limits WHERE key = 'group:7'").fetchone() == (start, 5, 0)
+    # نافذة تالية: العدد الحالي يصبح السابق
+    storage.write_sync(first._write_rows, [("group:7", start + 100, 100, 1, 0, now + 100)], now + 100)
+    assert storage.connection().execute(
+        "SELECT window_start, count, prev_count FROM rate_limits WHERE key = 'group:7'").fetchone() == (start + 100, 1, 5)
+    # زيادة متأخرة من نافذة قديمة لا تعيد النافذة إلى الوراء
+    storage.write_sync(second._write_rows, [("group:7", start, 100, 4, 0, now + 100)], now + 100)
+    assert storage.connection().execute(
+        "SELECT window_start, count, prev_count FROM rate_limits WHERE key = 'group:7'").fetchone() == (start + 100, 1, 5)
+
+
+def test_increments_are_flushed_in_one_batch(storage, monkeypatch):
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_FLUSH_BATCH", 3)
+    limiter = RateLimiter(storage, quotas={"private": (10, 86400)}, flush_interval=3600)
+    writes = []
+    submit_write = storage.submit_write
+    monkeypatch.setattr(storage, "submit_write", lambda fn, *args: writes.append(args) or submit_write(fn, *args))
+
+    async def run():
+        for user_id in (1, 2):
+            await limiter.allow("private", user_id)
+        assert writes == []  # أقل من الدفعة: لا كتابة بعد
+        await limiter.allow("private", 3)
+        await asyncio.wrap_future(submit_write(lambda conn: None))  # انتظار انتهاء دفعة الكتابة
+
+    asyncio.run(run())
+    assert len(writes) == 1 and sorted(row[0] for row in writes[0][0]) == ["private:1", "private:2", "private:3"]
+    assert storage.connection().execute("SELECT COUNT(*), SUM(count) FROM rate_limits").fetchone() == (3, 3)
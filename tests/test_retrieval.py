@@ -0,0 +1,53 @@
+import sqlite3
+
+import pytest
+
+from faq_bulk import ensure_faq_schema
+from channel_ring import ensure_channel_ring_schema
+from retrieval import CHANNEL_ANSWER, FTS_TABLE, build_match_query, ensure_fts_schema, search_knowledge
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    cur = conn.cursor()
+    ensure_faq_schema(cur)
+    ensure_channel_ring_schema(cur)
+    cur.execute("INSERT INTO faq (question, answer, category) VALUES ('كيف أسجل في الدورة؟', 'من الرابط المثبت', 'تسجيل')")
+    ensure_fts_schema(cur)  # يعبئ الفهرس من الصفوف الموجودة
+    yield conn
+    conn.close()
+
+
+def test_match_query_quotes_terms_and_drops_diacritics():
+    assert build_match_query('مَا "price" of it?') == '"ما" OR "price"* OR "of" OR "it"'
+    assert build_match_query("a ?") == ""
+
+
+def test_triggers_keep_the_index_in_sync(conn):
+    assert search_knowledge(conn, "أسجل") == [("كيف أسجل في الدورة؟", "من الرابط المثبت")]
+    conn.execute("INSERT INTO faq (question, answer, category) VALUES ('What is the course fee?', 'Free', 'fees')")
+    conn.execute("UPDATE faq SET answer = 'It is free' WHERE question LIKE 'What%'")
+    assert search_knowledge(conn, "course fee") == [("What is the course fee?", "It is free")]
+    conn.execute("DELETE FROM faq WHERE question LIKE 'What%'")
+    assert search_knowledge(conn, "course fee") == []
+    assert conn.execute(f"SELECT COUNT(*) FROM {FTS_TABLE}").fetchone()[0] == 1
+
+
+def test_channel_posts_are_searchable_and_replaced_with_their_slot(conn):
+    conn.execute("INSERT INTO channel_ring (slot, seq, message_id, chat_id, text) VALUES (0, 0, 1, -200, 'Lesson: past simple')")
+    assert search_knowledge(conn, "past simple") == [("Lesson: past simple", CHANNEL_ANSWER)]
+    conn.execute("UPDATE channel_ring SET seq = 5, text = 'Lesson: phrasal verbs' WHERE slot = 0")
+    assert search_knowledge(conn, "past simple") == []
+    assert search_knowledge(conn, "phrasal") == [("Lesson: phrasal verbs", CHANNEL_ANSWER)]
+
+
+def test_bm25_ranks_question_matches_first_and_limits_to_k(conn):
+    conn.executemany("INSERT INTO faq (question, answer, category) VALUES (?, ?, ?)", [
+        ("Where do I find the grammar notes?", "Pinned message", "notes"),
+        ("How long is the course?", "Ask about grammar in the group", "course"),
+        ("Are there grammar exercises?", "Yes, weekly", "grammar"),
+    ])
+    results = search_knowledge(conn, "grammar", k=2)
+    assert len(results) == 2
+    assert all("grammar" in question.lower() for question, _ in results)
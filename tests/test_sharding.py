@@ -0,0 +1,15 @@
+from sharding import shard_for
+
+
+def message(chat_id, user_id):
+    return {"update_id": 1, "message": {"message_id": 1, "chat": {"id": chat_id}, "from": {"id": user_id}}}
+
+
+def test_group_members_share_a_worker():
+    workers = {shard_for(message(-1001, user_id), 4) for user_id in range(100, 140)}
+    assert len(workers) == 1
+
+
+def test_private_chats_are_spread_by_user():
+    workers = {shard_for(message(user_id, user_id), 4) for user_id in range(100, 140)}
+    assert len(workers) > 1
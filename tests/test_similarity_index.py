@@ -0,0 +1,26 @@
+import sqlite3
+
+from similarity_index import SimilarityIndex
+
+
+def build_index(questions):
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE faq (id INTEGER PRIMARY KEY, question TEXT, answer TEXT)")
+    conn.executemany("INSERT INTO faq (question, answer) VALUES (?, ?)", [(q, f"answer: {q}") for q in questions])
+    index = SimilarityIndex()
+    index.load(conn)
+    return index
+
+
+def test_exact_question_matches():
+    index = build_index(["How do I join the course?", "What are the lesson times?"])
+    answer, score = index.match("how do i join the course")
+    assert answer == "answer: How do I join the course?"
+    assert score > 0.99
+
+
+def test_new_word_lowers_the_score():
+    """ سؤال يختلف عن المخزن بكلمة جديدة فقط لا يأخذ جوابه مباشرة (n-gram المجهولة تدخل في الطول). """
+    index = build_index(["How do I join the course?", "What are the lesson times?"])
+    assert index.match("how do i cancel the course") is None
+    assert index.match("I have been waiting for a week and nobody answered, how do I join the course?") is None
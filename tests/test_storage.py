@@ -0,0 +1,65 @@
+import logging
+import threading
+
+import pytest
+
+import storage as storage_module
+from storage import Storage
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage_module, "DB_WRITE_BATCH_DELAY", 0.2)  # كل الكتابات أدناه في دفعة واحدة
+    storage = Storage(str(tmp_path / "faq.db"))
+    with storage.transaction() as conn:
+        conn.execute("CREATE TABLE items (name TEXT PRIMARY KEY)")
+    yield storage
+    storage.shutdown()
+
+
+def insert(conn, name):
+    conn.execute("INSERT INTO items (name) VALUES (?)", (name,))
+    return name
+
+
+def insert_then_fail(conn, name):
+    conn.execute("INSERT INTO items (name) VALUES (?)", (name,))
+    conn.execute("INSERT INTO items (name) VALUES (?)", (name,))  # مفتاح مكرر
+
+
+def test_failing_write_rolls_back_only_its_own_savepoint(storage):
+    futures = [storage.submit_write(insert, "a"), storage.submit_write(insert_then_fail, "b"),
+               storage.submit_write(insert, "c")]
+    assert futures[0].result() == "a" and futures[2].result() == "c"
+    with pytest.raises(Exception):
+        futures[1].result()
+    names = [name for (name,) in storage.connection().execute("SELECT name FROM items ORDER BY name")]
+    assert names == ["a", "c"]
+    # الثلاث في معاملة واحدة: خيط الكتابة استخدم اتصالًا واحدًا
+    assert len(storage._connections) == 2
+
+
+def test_each_thread_gets_its_own_connection(storage):
+    connections = []
+
+    def read():
+        connections.append(storage.connection())
+        connections.append(storage.connection())
+
+    threads = [threading.Thread(target=read) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert connections[0] is connections[1] and connections[2] is connections[3]
+    assert connections[0] is not connections[2] and storage.connection() not in connections
+    assert storage.submit(lambda conn: conn.execute("PRAGMA journal_mode").fetchone()[0]).result() == "wal"
+
+
+def test_fire_and_forget_logs_errors(storage, caplog):
+    with caplog.at_level(logging.ERROR):
+        logged = threading.Event()
+        future = storage.fire_and_forget(insert_then_fail, "x")
+        future.add_done_callback(lambda _: logged.set())  # يُنفذ بعد callback التسجيل
+        assert logged.wait(5)
+    assert any("كتابة مؤجلة" in record.getMessage() for record in caplog.records)
@@ -0,0 +1,55 @@
+import time
+import types
+import asyncio
+
+import streaming
+
+
+class Sent:
+    def __init__(self, chat_id, edits):
+        self.chat_id = chat_id
+        self.edits = edits
+
+    async def edit_text(self, text, parse_mode=None):
+        self.edits.append(text)
+
+
+def make_message(chat_type, edits):
+    async def reply_text(text, parse_mode=None):
+        edits.append(text)
+        return Sent(-100, edits)
+    return types.SimpleNamespace(chat_id=-100, chat=types.SimpleNamespace(type=chat_type), reply_text=reply_text)
+
+
+async def chunks(*parts):
+    for part in parts:
+        yield part
+
+
+def test_group_final_edit_does_not_block_the_handler(monkeypatch):
+    monkeypatch.setattr(streaming, "STREAM_GROUP_EDIT_INTERVAL", 0.3)
+    edits = []
+
+    async def run():
+        started = time.monotonic()
+        text = await streaming.stream_reply(make_message("supergroup", edits), chunks("Hello ", "world"))
+        returned = time.monotonic() - started
+        await streaming.drain_final_edits()
+        return text, returned
+
+    text, returned = asyncio.run(run())
+    assert text == "Hello world"
+    assert returned < 0.1
+    assert edits[-1] == "Hello world"
+
+
+def test_final_text_is_truncated():
+    edits = []
+
+    async def run():
+        await streaming.stream_reply(make_message("private", edits), chunks("a" * 3000, "b" * 3000))
+        await streaming.drain_final_edits()
+
+    asyncio.run(run())
+    assert all(len(text) <= streaming.TELEGRAM_MAX_LENGTH for text in edits)
+    assert edits[-1].startswith("a" * 3000)
@@ -0,0 +1,28 @@
+import json
+
+from structured_reply import parse_intent, parse_structured_reply
+
+
+def test_parse_intent_takes_the_first_intent_digit():
+    assert parse_intent("3") == "3"
+    assert parse_intent("النية: 6.") == "6"
+    assert parse_intent("Intent 1\n") == "1"
+    assert parse_intent("no digit") is None and parse_intent(None) is None
+
+
+def test_structured_reply_with_answer_and_vocabulary():
+    vocabulary = {"word": "resilient", "meaning": "able to recover", "arabic": "مرن", "example": "She is resilient.",
+                  "closing": "Keep going!"}
+    assert parse_structured_reply(json.dumps({"intent": "1", "answer": " من الرابط "})) == \
+        {"intent": "1", "answer": " من الرابط ", "vocabulary": None}
+    assert parse_structured_reply(json.dumps({"intent": 6, "answer": "", "vocabulary": vocabulary})) == \
+        {"intent": "6", "answer": None, "vocabulary": vocabulary}
+    assert parse_structured_reply(json.dumps({"intent": "5"})) == {"intent": "5", "answer": None, "vocabulary": None}
+
+
+def test_replies_that_break_the_schema_fall_back_to_two_requests():
+    assert parse_structured_reply("not json") is None
+    assert parse_structured_reply("[1]") is None
+    assert parse_structured_reply(json.dumps({"intent": "9"})) is None
+    assert parse_structured_reply(json.dumps({"intent": "3", "answer": "  "})) is None  # النية 3 بلا تصحيح
+    assert parse_structured_reply(json.dumps({"intent": "6", "vocabulary": {"word": "x"}})) is None
@@ -0,0 +1,27 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+from traffic_replay import TrafficRecorder
+
+
+def test_recorded_response_does_not_keep_student_names(tmp_path):
+    path = tmp_path / "traffic.jsonl"
+    recorder = TrafficRecorder(str(path), 1, -100, None)
+    data = {"update_id": 7, "message": {
+        "message_id": 3, "date": 0, "chat": {"id": 555, "type": "private"}, "text": "صحح: I goes to school",
+        "from": {"id": 555, "is_bot": False, "first_name": "سارة", "last_name": "Osman", "username": "sara_o"}}}
+    update = SimpleNamespace(update_id=7, to_dict=lambda: data)
+
+    async def record():
+        await recorder.record_update(update, None)
+        recorder.record_llm("prompt", None, "أحسنتِ يا سارة Osman! (@sara_o) الصواب: I go to school", None, 0.1)
+    asyncio.run(record())
+    recorder.close()
+
+    content = path.read_text(encoding="utf-8")
+    for name in ("سارة", "Osman", "sara_o"):
+        assert name not in content
+    response = [json.loads(line) for line in content.splitlines() if '"llm"' in line][0]["response"]
+    assert response.startswith("أحسنتِ يا User User!")
+    assert "I go to school" in response
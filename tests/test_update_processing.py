@@ -0,0 +1,49 @@
+import types
+import asyncio
+
+import update_processing
+from update_processing import OrderedUpdateProcessor
+
+
+def make_update(update_id, chat_id, user_id):
+    return types.SimpleNamespace(update_id=update_id, key=(chat_id, user_id))
+
+
+def test_flooding_user_does_not_hold_every_slot(monkeypatch):
+    """ رسائل مستخدم واحد تنتظر دورها دون أن تشغل كل أماكن التزامن، فتُعالج الدردشات الأخرى. """
+    monkeypatch.setattr(update_processing, "update_ordering_key", lambda update: update.key)
+    order = []
+
+    async def handle(tag, delay):
+        await asyncio.sleep(delay)
+        order.append(tag)
+
+    async def run():
+        processor = OrderedUpdateProcessor(max_concurrent_updates=2)
+        tasks = [asyncio.create_task(processor.process_update(make_update(i, 1, 1), handle(f"spam{i}", 0.05)))
+                 for i in range(5)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(processor.process_update(make_update(99, 2, 2), handle("other", 0))))
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    assert order[0] == "other"
+    assert [tag for tag in order if tag != "other"] == [f"spam{i}" for i in range(5)]
+
+
+def test_processing_stays_within_the_concurrency_limit(monkeypatch):
+    monkeypatch.setattr(update_processing, "update_ordering_key", lambda update: update.key)
+    running, peak = [0], [0]
+
+    async def handle():
+        running[0] += 1
+        peak[0] = max(peak[0], running[0])
+        await asyncio.sleep(0.01)
+        running[0] -= 1
+
+    async def run():
+        processor = OrderedUpdateProcessor(max_concurrent_updates=3)
+        await asyncio.gather(*(processor.process_update(make_update(i, i, i), handle()) for i in range(10)))
+
+    asyncio.run(run())
+    assert peak[0] == 3
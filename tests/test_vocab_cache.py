@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+import vocab_cache
+from storage import Storage
+from vocab_cache import VocabularyCache, ensure_vocabulary_schema, extract_headword
+
+
+def fields(word):
+    return {"word": word, "meaning": "m", "arabic": "ع", "example": "e", "closing": "c"}
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = Storage(str(tmp_path / "faq.db"))
+    with storage.transaction() as conn:
+        ensure_vocabulary_schema(conn.cursor())
+    yield storage
+    storage.shutdown()
+
+
+def test_extract_headword():
+    assert extract_headword("what does serendipity mean?") == "serendipity"
+    assert extract_headword('ما معنى "give up" بالعربي') == "give up"
+    assert extract_headword("can you explain how I write a good cover letter for jobs") is None
+
+
+def test_alias_is_stored_only_when_it_is_part_of_the_word(storage):
+    cache = VocabularyCache(storage)
+    cache.put(fields("Give up"), "give", "gave").result()
+
+    async def lookup(*headwords):
+        return [await cache.get(headword) is not None for headword in headwords]
+
+    assert asyncio.run(lookup("give up", "give", "gave")) == [True, True, False]
+    rows = storage.connection().execute("SELECT headword FROM vocabulary ORDER BY headword").fetchall()
+    assert rows == [("give",), ("give up",)]
+
+
+def test_negative_cache_ttls(storage, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(vocab_cache.time, "monotonic", lambda: clock[0])
+    reads = []
+    cache = VocabularyCache(storage)
+    load = cache._load
+    monkeypatch.setattr(cache, "_load", lambda conn, headword: reads.append(headword) or load(conn, headword))
+
+    async def run():
+        assert await cache.get("absent") is None
+        assert await cache.get("absent") is None  # من الذاكرة السلبية دون قراءة
+        clock[0] += vocab_cache.VOCAB_ABSENT_TTL + 1
+        assert await cache.get("absent") is None
+    asyncio.run(run())
+    assert reads == ["absent", "absent"]
+
+    cache.mark_failed("broken")
+    assert cache.recently_failed("broken") and not cache.recently_failed("absent")
+    clock[0] += vocab_cache.VOCAB_FAILURE_TTL + 1
+    assert not cache.recently_failed("broken")
+
+
+def test_lru_evicts_the_least_recently_used_word(storage):
+    cache = VocabularyCache(storage, max_entries=2)
+    cache.put(fields("alpha"))
+    cache.put(fields("beta"))
+    asyncio.run(cache.get("alpha"))
+    cache.put(fields("gamma")).result()
+    assert list(cache._entries) == ["alpha", "gamma"]
+    # الكلمة المطرودة من الذاكرة ما زالت في الجدول
+    assert asyncio.run(cache.get("beta"))["word"] == "beta"
@@ -0,0 +1,438 @@
+""" تسجيل حركة التحديثات الحقيقية ثم إعادة تشغيلها على إصدار جديد دون شبكة.
+
+التسجيل (اختياري): TRAFFIC_RECORD_PATH=traffic.jsonl يجعل البوت يضيف إلى الملف كل تحديث وارد
+بعد تنقيحه، وكل طلب Gemini مع رده، سطرًا JSON لكل منها.
+
+إعادة التشغيل: python traffic_replay.py traffic.jsonl --speed 1|10|max --db faq.db
+عدة عمال (sharding.py): python traffic_replay.py traffic.jsonl --workers 4 --db faq.db
+تُغذى التحديثات للتطبيق بنفس الفواصل الزمنية (أو أسرع)، وتُستبدل ردود Gemini بالردود المسجلة،
+وطلبات Telegram بطلب وهمي، ثم يُطبع ملخص زمن الاستجابة وعدد الاستدعاءات وحمل قاعدة البيانات.
+"""
+import os
+import re
+import sys
+import json
+import time
+import queue
+import shutil
+import asyncio
+import hashlib
+import logging
+import argparse
+import tempfile
+import functools
+import threading
+import contextvars
+
+from telegram.request import BaseRequest
+
+
+# التحديث الجاري معالجته: [update_id، رقم طلب Gemini التالي داخله]
+CURRENT_UPDATE = contextvars.ContextVar("current_update", default=None)
+
+_EMAIL = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+_PHONE = re.compile(r"\+?\d[\d\s\-]{6,}\d")
+_MESSAGE_KEYS = ("message", "edited_message", "channel_post", "edited_channel_post")
+PSEUDONYM_NAME = "User"  # الاسم المسجل بدل first_name، ويحل محل الأسماء الحقيقية في النصوص
+
+
+def prompt_key(prompt, generation_config=None):
+    structured = "1" if generation_config else "0"
+    return hashlib.sha1(f"{structured}\x1f{prompt}".encode("utf-8")).hexdigest()
+
+
+# --- التسجيل ---
+
+class TrafficRecorder:
+    """ يكتب التحديثات المنقحة وطلبات Gemini في ملف JSONL من خيط مستقل. """
+
+    def __init__(self, path, admin_user_id, allowed_group_id, channel_id):
+        self.path = path
+        # المعرفات المضبوطة في البيئة تبقى كما هي لأن منطق البوت يعتمد عليها؛ الباقي يُستبدل
+        self._kept_ids = {int(i) for i in (admin_user_id, allowed_group_id, channel_id)
+                          if i is not None and str(i).lstrip("-").isdigit()}
+        self._pseudonyms = {}
+        # الأسماء الحقيقية التي ظهرت في التحديثات؛ تُحذف من النصوص ومن ردود Gemini (التي تخاطب الطالب باسمه)
+        self._names = set()
+        self._names_pattern = None
+        self._names_lock = threading.Lock()
+        self._started = time.monotonic()
+        self._lines = queue.SimpleQueue()
+        self._writer = threading.Thread(target=self._write_loop, name="traffic-recorder", daemon=True)
+        self._writer.start()
+        self._write({"type": "meta", "admin_user_id": admin_user_id, "allowed_group_id": allowed_group_id,
+                     "channel_id": channel_id, "recorded_at": time.time()})
+        logging.info(f"⏺️ تسجيل الحركة مفعل في {path}.")
+
+    def _write(self, record):
+        self._lines.put(json.dumps(record, ensure_ascii=False))
+
+    def _write_loop(self):
+        with open(self.path, "a", encoding="utf-8") as f:
+            while True:
+                line = self._lines.get()
+                if line is None:
+                    return
+                f.write(line + "\n")
+                f.flush()
+
+    def close(self):
+        self._lines.put(None)
+        self._writer.join(timeout=5)
+
+    def _pseudonym(self, value):
+        if value is None or value in self._kept_ids:
+            return value
+        if value not in self._pseudonyms:
+            self._pseudonyms[value] = (len(self._pseudonyms) + 1) * (1 if value > 0 else -1) + (
+                10 ** 9 if value > 0 else -10 ** 12)
+        return self._pseudonyms[value]
+
+    def _remember_names(self, user):
+        names = {user.get("first_name"), user.get("last_name"), user.get("username")}
+        names = {name.strip() for name in names if name and len(name.strip()) > 1} - self._names
+        if names:
+            with self._names_lock:
+                self._names |= names
+                self._names_pattern = None
+
+    def _name_pattern(self):
+        with self._names_lock:
+            if self._names_pattern is None and self._names:
+                # الأطول أولًا حتى لا يُستبدل جزء من اسم أطول؛ حدود الكلمة بالحروف العربية أيضًا
+                alternatives = "|".join(re.escape(name) for name in sorted(self._names, key=len, reverse=True))
+                self._names_pattern = re.compile(rf"(?<!\w)@?(?:{alternatives})(?!\w)", re.IGNORECASE)
+            return self._names_pattern
+
+    def _redact(self, text):
+        if not text:
+            return text
+        text = _PHONE.sub("0000000", _EMAIL.sub("user@example.com", text))
+        pattern = self._name_pattern()
+        return pattern.sub(PSEUDONYM_NAME, text) if pattern is not None else text
+
+    def sanitize(self, data):
+        """ الإبقاء فقط على الحقول التي يقرؤها البوت، مع استبدال المعرفات والأسماء والبيانات الشخصية. """
+        result = {"update_id": data.get("update_id")}
+        for key in _MESSAGE_KEYS:
+            message = data.get(key)
+            if not message:
+                continue
+            if message.get("from"):
+                self._remember_names(message["from"])
+            chat = message.get("chat", {})
+            clean = {
+                "message_id": message.get("message_id"),
+                "date": message.get("date"),
+                "chat": {"id": self._pseudonym(chat.get("id")), "type": chat.get("type")},
+                "text": self._redact(message.get("text")),
+            }
+            if message.get("from"):
+                user = message["from"]
+                clean["from"] = {"id": self._pseudonym(user.get("id")), "is_bot": user.get("is_bot", False),
+                                 "first_name": PSEUDONYM_NAME}
+            if message.get("sender_chat"):
+                sender = message["sender_chat"]
+                clean["sender_chat"] = {"id": self._pseudonym(sender.get("id")), "type": sender.get("type")}
+            result[key] = clean
+        return result
+
+    async def record_update(self, update, context):
+        """ معالج في المجموعة -1 (قبل باقي المعالجات) يسجل التحديث ويحدد سياق طلبات Gemini التابعة له. """
+        CURRENT_UPDATE.set([update.update_id, 0])
+        try:
+            self._write({"type": "update", "t": time.monotonic() - self._started,
+                         "update": self.sanitize(update.to_dict())})
+        except Exception as e:
+            logging.error(f"❌ خطأ في تسجيل التحديث: {e}")
+
+    def record_llm(self, prompt, generation_config, text, error, latency):
+        """ يُستدعى من GeminiClient بعد كل طلب؛ الرد يمر بنفس تنقيح نصوص التحديثات. """
+        current = CURRENT_UPDATE.get()
+        seq = None
+        if current is not None:
+            seq = current[1]
+            current[1] += 1
+        self._write({"type": "llm", "update_id": current[0] if current else None, "seq": seq,
+                     "key": prompt_key(prompt, generation_config), "structured": generation_config is not None,
+                     "prompt_chars": len(prompt),
+                     "response": self._redact(text), "error": error, "latency": latency})
+
+
+# --- إعادة التشغيل ---
+
+class ReplayModel:
+    """ بديل GenerativeModel يرد بالردود المسجلة: حسب (التحديث، ترتيب الطلب) ثم حسب بصمة الطلب.
+
+    الطلبات غير المسجلة (مثلًا عند تسريع الحركة قبل امتلاء ذاكرة الردود) تُعد في misses
+    وتأخذ آخر رد مسجل من نفس النوع (منظم أو نصي) حتى يستمر مسار المعالجة كما هو.
+    """
+
+    def __init__(self, records, speed):
+        self.speed = speed
+        self._by_position = {}
+        self._by_key = {}
+        self._by_kind = {}
+        for record in records:
+            if not record.get("error"):
+                self._by_kind[bool(record.get("structured"))] = record
+            if record.get("update_id") is not None:
+                self._by_position[(record["update_id"], record["seq"])] = record
+            self._by_key.setdefault(record["key"], record)
+        self.calls = 0
+        self.misses = 0
+        self.prompt_chars = 0
+
+    def _lookup(self, prompt, generation_config):
+        current = CURRENT_UPDATE.get()
+        if current is not None:
+            record = self._by_position.get((current[0], current[1]))
+            current[1] += 1
+            if record is not None:
+                return record
+        record = self._by_key.get(prompt_key(prompt, generation_config))
+        if record is None:
+            self.misses += 1
+            record = self._by_kind.get(generation_config is not None)
+        return record
+
+    def generate_content(self, prompt, generation_config=None, stream=False, **kwargs):
+        self.calls += 1
+        self.prompt_chars += len(prompt)
+        record = self._lookup(prompt, generation_config)
+        if record is None:
+            raise RuntimeError("no recorded response")
+        if stream:
+            return self._stream(record)
+        self._wait(record, 1)
+        return _Response(record["response"])
+
+    def _wait(self, record, fraction):
+        if self.speed and record.get("latency"):
+            time.sleep(record["latency"] * fraction / self.speed)
+        if record.get("error") == "timeout":
+            raise TimeoutError()
+        if record.get("error"):
+            raise RuntimeError(record["error"])
+
+    def _stream(self, record, parts=4):
+        # الزمن المسجل موزع على أجزاء متساوية من الرد
+        text = record.get("response") or ""
+        size = max(1, -(-len(text) // parts))
+        for start in range(0, max(len(text), 1), size):
+            self._wait(record, 1 / parts)
+            yield _Response(text[start:start + size])
+
+
+class _Response:
+    def __init__(self, text):
+        self.text = text
+
+
+class ReplayRequest(BaseRequest):
+    """ طلب Telegram وهمي: يرد بنتائج صالحة دون شبكة ويعدّ الاستدعاءات حسب الطريقة. """
+
+    def __init__(self):
+        self.calls = {}
+        self._next_message_id = 10 ** 6
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit("/", 1)[-1]
+        self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+        params = request_data.parameters if request_data else {}
+        if endpoint == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Replay", "username": "replay_bot"}
+        elif endpoint in ("sendMessage", "editMessageText"):
+            self._next_message_id += 1
+            result = {"message_id": params.get("message_id") or self._next_message_id, "date": int(time.time()),
+                      "chat": {"id": params.get("chat_id", 0), "type": "supergroup"}, "text": params.get("text", "")}
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode("utf-8")
+
+
+def load_recording(path):
+    meta, updates, llm = {}, [], []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record["type"] == "meta":
+                meta = meta or record
+            elif record["type"] == "update":
+                updates.append(record)
+            elif record["type"] == "llm":
+                llm.append(record)
+    return meta, updates, llm
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+async def replay(main, updates, speed):
+    from telegram import Update
+
+    app = main.create_application()
+    await app.initialize()
+    latencies = []
+
+    async def process(update_id, data):
+        CURRENT_UPDATE.set([update_id, 0])
+        started = time.perf_counter()
+        update = Update.de_json(data, app.bot)
+        await app.update_processor.process_update(update, app.process_update(update))
+        latencies.append(time.perf_counter() - started)
+
+    tasks = []
+    started = time.perf_counter()
+    first = updates[0]["t"] if updates else 0.0
+    for record in updates:
+        if speed:
+            delay = (record["t"] - first) / speed - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(process(record["update"]["update_id"], record["update"])))
+    await asyncio.gather(*tasks)
+    await main.outbound.close()  # المعالجات تعود قبل إرسال ردودها
+    wall = time.perf_counter() - started
+    await app.shutdown()
+    return latencies, wall, app.bot.request
+
+
+def _setup_replay_worker(recording, main):
+    """ داخل كل عامل: ردود Gemini من التسجيل، ودالة التقرير التي يرسلها العامل عند انتهائه. """
+    _, _, llm = load_recording(recording)
+    model = ReplayModel(llm, None)
+    main.llm_client.model = model
+    main.is_within_working_hours = lambda: True
+
+    def report(application):
+        request = application.bot.request
+        return {"llm_calls": model.calls, "llm_misses": model.misses,
+                "telegram_calls": getattr(request, "calls", {})}
+    return report
+
+
+def run_sharded(args, updates, llm, recording):
+    """ نفس الحركة موزعة على عدة عمليات: الإنتاجية بزمن أبطأ عامل من أول تحديث حتى انتهاء المعالجة. """
+    from sharding import run_local
+
+    started = time.perf_counter()
+    reports = run_local([record["update"] for record in updates], args.workers,
+                        functools.partial(_setup_replay_worker, recording))
+    busiest = max((report["seconds"] for report in reports), default=0.0)
+    telegram_calls = {}
+    for report in reports:
+        for method, count in report.get("telegram_calls", {}).items():
+            telegram_calls[method] = telegram_calls.get(method, 0) + count
+    return {
+        "workers": args.workers,
+        "updates": sum(report["updates"] for report in reports),
+        "wall_s": time.perf_counter() - started,  # يشمل تشغيل العمليات وتهيئتها
+        "processing_s": busiest,
+        "throughput": sum(report["updates"] for report in reports) / busiest if busiest else 0.0,
+        "llm_calls": sum(report.get("llm_calls", 0) for report in reports),
+        "llm_recorded_calls": len(llm),
+        "llm_misses": sum(report.get("llm_misses", 0) for report in reports),
+        "telegram_calls": telegram_calls,
+        "shards": [{key: report[key] for key in ("shard", "updates", "seconds")} for report in reports],
+    }
+
+
+def run(args):
+    recording = os.path.abspath(args.recording)
+    meta, updates, llm = load_recording(recording)
+    workdir = tempfile.mkdtemp(prefix="faqbot-replay-")
+    db_path = os.path.join(workdir, "faq.db")
+    if args.db and os.path.exists(args.db):
+        shutil.copy(args.db, db_path)  # نسخة حتى لا تُعدل قاعدة البيانات الأصلية
+    os.environ.update({
+        "TRAFFIC_REPLAY": "1",
+        "FAQBOT_TOKEN": "123456:REPLAY",
+        "GEMINI_API_KEY": "replay",
+        "ALLOWED_GROUP_ID": str(meta.get("allowed_group_id") or -1),
+        "ADMIN_USER_ID": str(meta.get("admin_user_id") or 1),
+        "CHANNEL_ID": str(meta.get("channel_id") or ""),
+        "FAQ_DB_PATH": db_path,
+        "LOG_LEVEL": args.log_level,
+        # فاصل تعديلات الرد المتدفق حد لـ Telegram لا كلفة معالجة، فلا يدخل في الأزمنة المقاسة
+        "STREAM_EDIT_INTERVAL": "0",
+        "STREAM_GROUP_EDIT_INTERVAL": "0",
+    })
+    if args.speed == "max":
+        # بالسرعة القصوى نقيس المعالجة لا حدود Telegram، فلا ينتظر طابور الإرسال
+        os.environ.update({"OUTBOUND_GLOBAL_LIMIT": "0/1", "OUTBOUND_PRIVATE_LIMIT": "0/1", "OUTBOUND_GROUP_LIMIT": "0/1"})
+        # ولا يُسقط طابور Gemini طلبات وصلت كلها في اللحظة نفسها
+        os.environ.update({"LLM_QUEUE_DEPTH": "1000000", "LLM_QUEUE_MAX_WAIT": "3600"})
+    os.environ.pop("TRAFFIC_RECORD_PATH", None)
+    os.environ.pop("WEBHOOK_URL", None)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(workdir)
+
+    if args.workers > 1:
+        summary = run_sharded(args, updates, llm, recording)
+        shutil.rmtree(workdir, ignore_errors=True)
+        return summary
+
+    import main
+    from metrics import STAGE_SECONDS
+
+    speed = None if args.speed == "max" else float(args.speed)
+    model = ReplayModel(llm, speed)
+    main.llm_client.model = model
+    # التحديثات المسجلة عولجت داخل ساعات العمل؛ النتيجة لا تعتمد على ساعة إعادة التشغيل
+    main.is_within_working_hours = lambda: True
+
+    latencies, wall, request = asyncio.run(replay(main, updates, speed))
+    stages = {key[0]: (count, total) for key, (_, total, count) in STAGE_SECONDS._values.items()}
+    summary = {
+        "updates": len(latencies),
+        "wall_s": wall,
+        "throughput": len(latencies) / wall if wall else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "llm_calls": model.calls,
+        "llm_recorded_calls": len(llm),
+        "llm_misses": model.misses,
+        "prompt_chars": model.prompt_chars,
+        "telegram_calls": request.calls if hasattr(request, "calls") else {},
+        "db_reads": stages.get("db_read", (0, 0.0))[0],
+        "db_read_ms": stages.get("db_read", (0, 0.0))[1] * 1000,
+        "db_write_batches": stages.get("db_write_batch", (0, 0.0))[0],
+    }
+    shutil.rmtree(workdir, ignore_errors=True)
+    return summary
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded update traffic against this build.")
+    parser.add_argument("recording", help="JSONL file written with TRAFFIC_RECORD_PATH")
+    parser.add_argument("--speed", default="max", help="1 = original pace, 10 = ten times faster, max = no waiting")
+    parser.add_argument("--db", default="faq.db", help="database to copy before replaying")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--workers", type=int, default=1, help="replay through N sharded worker processes")
+    args = parser.parse_args(argv)
+    if args.workers > 1 and args.speed != "max":
+        parser.error("--workers only supports --speed max")
+    return args
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(parse_args()), indent=2, ensure_ascii=False))
@@ -0,0 +1,67 @@
+import os
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+# أقصى عدد من التحديثات التي تُعالج في نفس الوقت
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", 16))
+# أقصى عدد تحديثات مقبولة (تُعالج أو تنتظر دورها في الترتيب)؛ ما زاد ينتظر في Application قبل أن يُقبل
+MAX_PENDING_UPDATES = int(os.getenv("MAX_PENDING_UPDATES", 1024))
+
+
+def update_ordering_key(update):
+    """ مفتاح الترتيب: رسائل نفس المستخدم في نفس الدردشة تُعالج بالترتيب، وما عداها بالتوازي. """
+    if not isinstance(update, Update):
+        return None
+    chat = update.effective_chat
+    user = update.effective_user
+    if chat is None and user is None:
+        return None
+    return (chat.id if chat else None, user.id if user else None)
+
+
+class OrderedUpdateProcessor(BaseUpdateProcessor):
+    """ معالجة متوازية للتحديثات مع الحفاظ على ترتيب رسائل كل مستخدم داخل كل دردشة.
+
+    process_update في المكتبة (final) يأخذ مكانًا من MAX_PENDING_UPDATES فقط، ثم do_process_update ينتظر
+    الترتيب قبل أن يأخذ مكانًا من MAX_CONCURRENT_UPDATES: مستخدم يرسل عشرات الرسائل ينتظر دوره
+    دون أن تحجز رسائله المنتظرة أماكن باقي الدردشات.
+    """
+
+    def __init__(self, max_concurrent_updates=MAX_CONCURRENT_UPDATES, max_pending_updates=MAX_PENDING_UPDATES):
+        super().__init__(max(max_pending_updates, max_concurrent_updates))
+        self.max_processing_updates = max_concurrent_updates
+        self._processing = None  # يُنشأ عند أول استخدام ليرتبط بحلقة الأحداث الفعلية
+        self._locks = {}  # المفتاح -> [القفل، عدد التحديثات المنتظرة]
+
+    async def _process(self, coroutine):
+        if self._processing is None:
+            self._processing = asyncio.Semaphore(self.max_processing_updates)
+        async with self._processing:
+            await coroutine
+
+    async def do_process_update(self, update, coroutine):
+        key = update_ordering_key(update)
+        if key is None:
+            await self._process(coroutine)
+            return
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            # القفل أولًا (بترتيب الوصول) ثم مكان في حد التزامن
+            async with entry[0]:
+                await self._process(coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]  # لا نحتفظ بأقفال المستخدمين غير النشطين
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
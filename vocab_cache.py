@@ -0,0 +1,237 @@
+""" ذاكرة المفردات للنية 6: الحقول الخمسة المحللة (الكلمة، المعنى، الترجمة، المثال، الختام) بمفتاح الكلمة الموحدة.
+
+جدول دائم في SQLite وأمامه LRU في الذاكرة، فالكلمات الشائعة تُجاب محليًا ولا يذهب إلى Gemini إلا ما لم يُسأل عنه
+من قبل. الرد الذي تعذر تحليله يُتذكر مدة VOCAB_FAILURE_TTL حتى لا يتكرر نفس الطلب الفاشل.
+
+التعبئة المسبقة من قائمة كلمات (كلمة في كل سطر):
+    python vocab_cache.py prewarm words.txt [--db faq.db]
+"""
+import os
+import re
+import html
+import time
+import asyncio
+import logging
+import argparse
+from collections import OrderedDict
+
+from structured_reply import VOCABULARY_FIELDS
+
+
+VOCAB_CACHE_SIZE = int(os.getenv("VOCAB_CACHE_SIZE", 2000))  # كلمات محفوظة في الذاكرة
+VOCAB_FAILURE_TTL = float(os.getenv("VOCAB_FAILURE_TTL", 3600))  # ثوانٍ لا نعيد فيها طلب كلمة فشل تحليل ردها
+VOCAB_ABSENT_TTL = 300  # كلمة غير موجودة في الجدول لا تُقرأ من قاعدة البيانات مرة أخرى خلال هذه المدة
+VOCAB_NEGATIVE_SIZE = 1000
+VOCAB_PREWARM_CONCURRENCY = int(os.getenv("VOCAB_PREWARM_CONCURRENCY", 4))
+HEADWORD_MAX_WORDS = 3  # الأفعال المركبة والتعابير القصيرة (give up، by the way)
+
+VOCABULARY_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS vocabulary (
+            headword TEXT PRIMARY KEY,
+            word TEXT NOT NULL,
+            meaning TEXT NOT NULL,
+            arabic TEXT NOT NULL,
+            example TEXT NOT NULL,
+            closing TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )""",
+]
+
+_QUOTED = re.compile(r"[\"“”«»]\s*([A-Za-z][A-Za-z' -]{0,60}?)\s*[\"“”«»]")
+_ENGLISH_WORD = re.compile(r"[A-Za-z][A-Za-z'-]*")
+# كلمات صيغة السؤال نفسها ("what does X mean in arabic")، لا الكلمة المسؤول عنها
+_QUESTION_WORDS = {
+    "a", "an", "the", "what", "whats", "what's", "does", "do", "did", "is", "are", "was", "mean", "means", "meaning",
+    "meanings", "of", "word", "words", "define", "definition", "please", "pls", "plz", "explain", "translate",
+    "translation", "in", "into", "arabic", "english", "how", "to", "use", "say", "it", "this", "that", "me", "tell",
+    "can", "could", "you", "i", "my", "example", "examples", "sentence", "synonym", "synonyms",
+}
+
+
+def ensure_vocabulary_schema(cur):
+    for statement in VOCABULARY_SCHEMA:
+        cur.execute(statement)
+
+
+def normalize_headword(text):
+    words = _ENGLISH_WORD.findall((text or "").lower())
+    return " ".join(word.strip("'-") for word in words)[:64] or None
+
+
+def extract_headword(message):
+    """ الكلمة الإنجليزية المسؤول عنها قبل أي طلب، أو None إذا لم تكن واضحة (فيحددها رد Gemini). """
+    quoted = _QUOTED.findall(message or "")
+    if len(quoted) == 1:
+        return normalize_headword(quoted[0])
+    words = [word for word in _ENGLISH_WORD.findall(message or "") if word.lower() not in _QUESTION_WORDS]
+    if 1 <= len(words) <= HEADWORD_MAX_WORDS:
+        return normalize_headword(" ".join(words))
+    return None
+
+
+def parse_vocabulary(raw):
+    """ الأسطر الخمسة من رد Gemini كحقول، أو None إذا جاء الرد ناقصًا. """
+    parts = [line.strip() for line in (raw or "").splitlines() if line.strip()]
+    if len(parts) < len(VOCABULARY_FIELDS):
+        return None
+    return dict(zip(VOCABULARY_FIELDS, parts))
+
+
+def render_vocabulary(fields, user_name):
+    """ رسالة HTML للرد؛ الحقول تُهرب لأن الرد قد يحتوي < أو & فيرفضه Telegram. """
+    escaped = {field: html.escape(fields[field], quote=False) for field in VOCABULARY_FIELDS}
+    return (
+        f"<b>Great pick, {html.escape(user_name or '', quote=False)}!</b>\n"
+        f"📌 <i>{escaped['word']}</i>\n"
+        f"🗣️ <b>Meaning:</b> {escaped['meaning']}\n"
+        f"🪄 <b>بالعربي:</b> <tg-spoiler>{escaped['arabic']}</tg-spoiler>\n"
+        f"✏️ <b>Example:</b> {escaped['example']}\n\n"
+        f"{escaped['closing']}"
+    )
+
+
+class VocabularyCache:
+    """ LRU في الذاكرة أمام جدول vocabulary، مع ذاكرة سلبية للكلمات الغائبة والردود التي فشل تحليلها. """
+
+    def __init__(self, storage, max_entries=VOCAB_CACHE_SIZE):
+        self.storage = storage
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._negative = OrderedDict()  # الكلمة -> (وقت الانتهاء، فشل التحليل؟)
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+
+    @staticmethod
+    def _load(conn, headword):
+        row = conn.execute("SELECT word, meaning, arabic, example, closing FROM vocabulary WHERE headword = ?",
+                           (headword,)).fetchone()
+        return dict(zip(VOCABULARY_FIELDS, row)) if row else None
+
+    @staticmethod
+    def _store(conn, rows):
+        conn.executemany("INSERT OR REPLACE INTO vocabulary (headword, word, meaning, arabic, example, closing, "
+                         "created_at) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def _remember(self, headword, fields):
+        self._entries[headword] = fields
+        self._entries.move_to_end(headword)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _negative_entry(self, headword):
+        entry = self._negative.get(headword)
+        if entry is not None and entry[0] < time.monotonic():
+            del self._negative[headword]
+            return None
+        return entry
+
+    def _forget_later(self, headword, ttl, failed):
+        self._negative[headword] = (time.monotonic() + ttl, failed)
+        self._negative.move_to_end(headword)
+        while len(self._negative) > VOCAB_NEGATIVE_SIZE:
+            self._negative.popitem(last=False)
+
+    async def get(self, headword):
+        """ حقول الكلمة من الذاكرة ثم من الجدول، أو None. """
+        fields = self._entries.get(headword)
+        if fields is not None:
+            self._entries.move_to_end(headword)
+            self.hits += 1
+            return fields
+        if self._negative_entry(headword) is None:
+            fields = await self.storage.run(self._load, headword)
+            if fields is not None:
+                self._remember(headword, fields)
+                self.hits += 1
+                return fields
+            self._forget_later(headword, VOCAB_ABSENT_TTL, False)
+        self.misses += 1
+        return None
+
+    def recently_failed(self, headword):
+        entry = self._negative_entry(headword)
+        return entry is not None and entry[1]
+
+    def mark_failed(self, headword):
+        self.failures += 1
+        self._forget_later(headword, VOCAB_FAILURE_TTL, True)
+
+    def put(self, fields, *aliases):
+        """ تخزين الحقول بمفتاح الكلمة نفسها وبالصيغة التي سُئل بها عنها؛ الكتابة في الخلفية.
+
+        الصيغة تُقبل فقط إذا كانت كلماتها ضمن الكلمة التي شرحها الرد، حتى لا يربط استخراج خاطئ سؤالًا بكلمة أخرى.
+        """
+        word = normalize_headword(fields["word"])
+        if word is None:
+            return None
+        headwords = {word, *(alias for alias in aliases if alias and set(alias.split()) <= set(word.split()))}
+        now = time.time()
+        rows = []
+        for headword in headwords:
+            self._remember(headword, fields)
+            self._negative.pop(headword, None)
+            rows.append((headword, *(fields[field] for field in VOCABULARY_FIELDS), now))
+        if rows:
+            return self.storage.fire_and_forget(self._store, rows)
+
+    async def prewarm(self, words, generate, concurrency=VOCAB_PREWARM_CONCURRENCY):
+        """ طلب الكلمات غير المحفوظة من قائمة؛ generate(word) يعيد رد Gemini النصي. يعيد (مضافة، موجودة، فاشلة). """
+        semaphore = asyncio.Semaphore(concurrency)
+        counts = {"added": 0, "cached": 0, "failed": 0}
+
+        async def warm(word):
+            headword = normalize_headword(word)
+            if headword is None:
+                return
+            if await self.get(headword) is not None:
+                counts["cached"] += 1
+                return
+            async with semaphore:
+                try:
+                    fields = parse_vocabulary(await generate(word))
+                except Exception as e:
+                    logging.error(f"❌ خطأ في تعبئة الكلمة {word}: {e}")
+                    fields = None
+            if fields is None:
+                self.mark_failed(headword)
+                counts["failed"] += 1
+                return
+            self.put(fields, headword)
+            counts["added"] += 1
+
+        await asyncio.gather(*(warm(word) for word in dict.fromkeys(words)))
+        logging.info(f"✅ تعبئة المفردات: {counts['added']} جديدة، {counts['cached']} محفوظة، {counts['failed']} فاشلة.")
+        return counts["added"], counts["cached"], counts["failed"]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0, "parse_failures": self.failures}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-warm the vocabulary cache from a word list.")
+    parser.add_argument("action", choices=("prewarm",))
+    parser.add_argument("path", help="text file, one word or phrase per line")
+    parser.add_argument("--db", help="database path (default: FAQ_DB_PATH or faq.db)")
+    args = parser.parse_args(argv)
+    if args.db:
+        os.environ["FAQ_DB_PATH"] = args.db
+    with open(args.path, encoding="utf-8") as f:
+        words = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+    import main as bot  # بعد ضبط FAQ_DB_PATH؛ الاستيراد لا يفتح قاعدة البيانات ولا يهيئ Gemini
+
+    async def run():
+        try:
+            return await bot.prewarm_vocabulary(words)
+        finally:
+            await bot.on_shutdown(None)
+
+    bot.initialize_state()
+    asyncio.run(run())  # الأعداد تُسجل في prewarm
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import os
+import hmac
+import json
+import signal
+import asyncio
+import logging
+import secrets
+
+import tornado.web
+from telegram import Update
+
+from metrics import CONTENT_TYPE, render as render_metrics
+
+
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")  # المسار الذي يرسل إليه تيليجرام التحديثات
+# رمز سري يرسله تيليجرام في كل طلب؛ إذا لم يُحدد نولد رمزًا جديدًا عند كل تشغيل
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+HEALTH_TEXT = "✅ البوت يعمل بشكل صحيح!"
+
+
+class TelegramUpdateHandler(tornado.web.RequestHandler):
+    """ استقبال تحديثات تيليجرام بعد التحقق من الرمز السري ووضعها في طابور التطبيق. """
+
+    def initialize(self, bot_app, secret_token):
+        self.bot_app = bot_app
+        self.secret_token = secret_token
+
+    async def post(self):
+        received = self.request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(received, self.secret_token):
+            logging.warning("⚠️ تم رفض طلب ويبهوك برمز سري غير صحيح.")
+            self.set_status(403)
+            return
+        try:
+            data = json.loads(self.request.body)
+        except ValueError:
+            self.set_status(400)
+            return
+        update = Update.de_json(data, self.bot_app.bot)
+        await self.bot_app.update_queue.put(update)
+        self.set_status(200)
+
+
+class HealthHandler(tornado.web.RequestHandler):
+    """ فحص أن الخادم يعمل. """
+
+    def get(self):
+        self.write(HEALTH_TEXT)
+
+
+class ReadinessHandler(tornado.web.RequestHandler):
+    """ جاهز فقط عندما يكون التطبيق قد بدأ معالجة التحديثات. """
+
+    def initialize(self, bot_app):
+        self.bot_app = bot_app
+
+    def get(self):
+        if self.bot_app.running:
+            self.write("ready")
+        else:
+            self.set_status(503)
+            self.write("starting")
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """ مقاييس زمن كل مرحلة بصيغة Prometheus. """
+
+    def get(self):
+        self.set_header("Content-Type", CONTENT_TYPE)
+        self.write(render_metrics())
+
+
+def make_web_app(application, url_path=WEBHOOK_PATH, secret_token=WEBHOOK_SECRET):
+    """ خادم HTTP واحد للتحديثات وفحوصات الصحة والجاهزية والمقاييس. """
+    return tornado.web.Application([
+        (rf"/{url_path}", TelegramUpdateHandler, {"bot_app": application, "secret_token": secret_token}),
+        (r"/", HealthHandler),
+        (r"/healthz", HealthHandler),
+        (r"/readyz", ReadinessHandler, {"bot_app": application}),
+        (r"/metrics", MetricsHandler),
+    ])
+
+
+async def run_webhook(application, webhook_url, port, url_path=WEBHOOK_PATH, secret_token=WEBHOOK_SECRET):
+    """ تشغيل البوت بوضع الويبهوك حتى وصول SIGINT أو SIGTERM ثم إيقافه بشكل نظيف. """
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass  # ويندوز لا يدعم إشارات حلقة الأحداث
+
+    web_app = make_web_app(application, url_path, secret_token)
+    server = web_app.listen(port, address="0.0.0.0")
+    logging.info(f"✅ خادم الويبهوك يستمع على المنفذ {port}.")
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    await application.bot.set_webhook(
+        url=f"{webhook_url.rstrip('/')}/{url_path}",
+        secret_token=secret_token,
+        allowed_updates=Update.ALL_TYPES,
+    )
+    logging.info("✅ تم تسجيل الويبهوك لدى تيليجرام.")
+
+    try:
+        await stop_event.wait()
+    finally:
+        logging.info("⌛ جاري إيقاف البوت...")
+        server.stop()
+        await server.close_all_connections()
+        await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        logging.info("✅ تم إيقاف البوت بشكل نظيف.")